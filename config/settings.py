@@ -64,6 +64,8 @@ MIDDLEWARE = [
     'allauth.account.middleware.AccountMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'event_planner.middleware.ScoreBatchMiddleware',
+    'event_planner.middleware.JobConfigMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -98,6 +100,17 @@ DATABASES = {
 }
 
 
+# Cache
+# Version counters of cached data are stored in the database (see event_planner/cache_versions.py), so every process
+# sees changes within CACHE_VERSION_TIMEOUT seconds. The local memory cache keeps the cached data per process,
+# a shared backend (Redis or DatabaseCache, see settings.py) builds it once for all processes.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -174,5 +187,28 @@ DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 SERVER_EMAIL = EMAIL_HOST_USER
 EMAIL_USE_TLS = True
 EMAIL_PORT = 587
-
-
+# Mail dispatch of the jobs: messages per batch, messages per second (0 is unlimited) and reconnects per failed message
+MAIL_BATCH_SIZE = 50
+MAIL_RATE_LIMIT = 0
+MAIL_MAX_RETRIES = 1
+# Email outbox: jobs and views only enqueue emails, the send_outbox command sends them (attempts per email, backoff and worker lease in seconds)
+# Enable it only together with a running worker next to the web server and run_scheduler: python manage.py send_outbox
+# While disabled (default) mails are sent directly: the idempotency keys of the jobs are ignored and a failed send is not queued for a retry
+MAIL_USE_OUTBOX = False
+MAIL_OUTBOX_MAX_ATTEMPTS = 5
+MAIL_OUTBOX_BACKOFF = 60
+MAIL_OUTBOX_LEASE = 300
+
+# Score engine: re-aggregates the score history after each delta and logs drift (opt-in, costs one query per category)
+SCORE_ENGINE_VERIFY = False
+
+# Scheduler: jobs run in the dedicated run_scheduler process, autostart runs them in a thread of every process which loads Django (single-process setups only)
+SCHEDULER_AUTOSTART = False
+# Job locks: lease of a running job in seconds (extended by heartbeats, an expired lease of a crashed run is taken over)
+JOB_LOCK_TTL = 600
+# Job runs: days for which the runs and metrics of the scheduled jobs are kept
+JOB_RUN_RETENTION = 30
+# Job settings: seconds after which processes check job_settings.json for changes saved by another process
+JOB_CONFIG_CHECK_INTERVAL = 5
+# Cache versions: seconds for which a process uses a version counter before it reads the counter from the database again
+CACHE_VERSION_TIMEOUT = 5
@@ -20,6 +20,11 @@ admin.site.register(Task)
 admin.site.register(TaskScoreHistory)
 admin.site.register(GiftScoreHistory)
 admin.site.register(PaymentScoreHistory)
+admin.site.register(ScoreLedger)
+admin.site.register(EmailOutbox)
+admin.site.register(DigestNotification)
+admin.site.register(JobLock)
+admin.site.register(JobRun)
 admin.site.register(Transaction)
 admin.site.register(Vote)
 
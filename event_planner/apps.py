@@ -1,5 +1,6 @@
 import os
 from django.apps import AppConfig
+from django.conf import settings
 
 
 
@@ -9,5 +10,8 @@ class EventPlannerConfig(AppConfig):
 
     def ready(self):
         import event_planner.signals
-        from . import scheduler
+        # Jobs run in the run_scheduler process, web workers and management commands only start them if configured
+        if getattr(settings, 'SCHEDULER_AUTOSTART', False):
+            from .scheduler import start_scheduler
+            start_scheduler()
 
@@ -0,0 +1,119 @@
+import uuid
+from asgiref.local import Local
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import CacheVersion
+
+
+
+# -------------------------------------------------------------
+# Keys of the version counters (stored as CacheVersion rows, shared by all processes)
+# -------------------------------------------------------------
+POINTS_REGISTRY_VERSION_KEY = 'event_planner:points_registry_version'
+SCORES_VERSION_KEY = 'event_planner:scores_version'
+CALENDAR_VERSION_KEY = 'event_planner:calendar_version'
+
+
+
+# Marker of a value which is not in the cache (None is a valid time of change)
+_missing = object()
+
+# Version increases registered for commit (per thread / async context)
+_pending_state = Local()
+
+
+
+# -------------------------------------------------------------
+# Helper function to read for how many seconds a process may use a version counter without reading it from the database
+# -------------------------------------------------------------
+def get_version_timeout():
+    return getattr(settings, 'CACHE_VERSION_TIMEOUT', 5)
+
+
+
+# -------------------------------------------------------------
+# Helper function which reads a version counter and its time of change from the database and keeps them in the cache
+# -------------------------------------------------------------
+def _load_version(key):
+    # Counters start at 1, the row is created by the first increase
+    version = CacheVersion.objects.filter(key=key).first() or CacheVersion(key=key)
+    cache.set(key, version.version, get_version_timeout())
+    cache.set(f'{key}:modified', version.modified, get_version_timeout())
+    return version
+
+
+
+# -------------------------------------------------------------
+# Returns the current value of a version counter
+# (kept in the cache for CACHE_VERSION_TIMEOUT seconds, fresh=True always reads the database)
+# -------------------------------------------------------------
+def get_version(key, fresh=False):
+    version = None if fresh else cache.get(key)
+    if version is None:
+        version = _load_version(key).version
+    return version
+
+
+
+# -------------------------------------------------------------
+# Increases a version counter in the database, everything cached for an older version is outdated
+# -------------------------------------------------------------
+def increase_version(key):
+    versions = CacheVersion.objects.filter(key=key)
+    if not versions.update(version=F('version') + 1, modified=timezone.now()):
+        CacheVersion.objects.bulk_create([CacheVersion(key=key)], ignore_conflicts=True)
+        versions.update(version=F('version') + 1, modified=timezone.now())
+    _load_version(key)
+
+
+
+# -------------------------------------------------------------
+# Returns the time of the last increase of a version counter (None if unknown)
+# -------------------------------------------------------------
+def get_version_modified(key):
+    modified = cache.get(f'{key}:modified', _missing)
+    if modified is _missing:
+        modified = _load_version(key).modified
+    return modified
+
+
+
+# -------------------------------------------------------------
+# Increases a version counter now or, inside a transaction, once after commit
+# (this process switches to a version of its own at once, other processes may not cache uncommitted state)
+# -------------------------------------------------------------
+def increase_version_on_change(key):
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        increase_version(key)
+        return
+    cache.set(key, f'{get_version(key)}-{uuid.uuid4().hex}', get_version_timeout())
+    cache.set(f'{key}:modified', timezone.now(), get_version_timeout())
+    # An increase which is still registered on the connection covers all changes of the transaction
+    # (a rollback discards the registered callback, the next change registers a new one)
+    pending = _pending_increases()
+    callback = pending.get((connection.alias, key))
+    if callback is not None and any(func is callback for _, func, *_ in connection.run_on_commit):
+        return
+
+    def callback():
+        # Changes after this commit register a new increase
+        if pending.get((connection.alias, key)) is callback:
+            del pending[(connection.alias, key)]
+        increase_version(key)
+
+    pending[(connection.alias, key)] = callback
+    transaction.on_commit(callback)
+
+
+
+# -------------------------------------------------------------
+# Returns the increases registered for the transactions of this thread / async context {(database alias, key): callback}
+# -------------------------------------------------------------
+def _pending_increases():
+    if not hasattr(_pending_state, 'increases'):
+        _pending_state.increases = {}
+    return _pending_state.increases
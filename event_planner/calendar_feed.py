@@ -0,0 +1,195 @@
+import calendar
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from django.core.cache import cache
+from django.db.models.functions import ExtractDay, ExtractMonth
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .cache_versions import CALENDAR_VERSION_KEY, get_version
+from .models import Event, GiftContribution, GiftSearch, Task, UserProfile
+
+
+
+# -------------------------------------------------------------
+# Calendar feed: lifetime of the cached shared entries of a range, longest range and default range length (in days)
+# -------------------------------------------------------------
+FEED_TIMEOUT = 60 * 60
+FEED_MAX_DAYS = 400
+FEED_DEFAULT_DAYS = 42
+
+
+
+# -------------------------------------------------------------
+# Helper function which parses a range boundary sent by FullCalendar (ISO date with optional time and offset)
+# -------------------------------------------------------------
+def parse_feed_date(value):
+    try:
+        parsed = parse_datetime(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValueError(f"Invalid date: {value}")
+    # The date as displayed by the calendar (offset of the browser is kept)
+    return parsed.date()
+
+
+
+# -------------------------------------------------------------
+# Returns the requested range as dates (start inclusive, end exclusive), the current month view if not given
+# -------------------------------------------------------------
+def parse_feed_range(start, end):
+    start_date = parse_feed_date(start) if start else timezone.localdate().replace(day=1)
+    end_date = parse_feed_date(end) if end else start_date + timedelta(days=FEED_DEFAULT_DAYS)
+    if end_date <= start_date:
+        raise ValueError("The end of the range must be after its start.")
+    if (end_date - start_date).days > FEED_MAX_DAYS:
+        raise ValueError(f"The range must not be longer than {FEED_MAX_DAYS} days.")
+    return start_date, end_date
+
+
+
+# -------------------------------------------------------------
+# Helper functions which build the calendar entries (FullCalendar event objects)
+# -------------------------------------------------------------
+def birthday_entry(username, day):
+    return {
+        'title': f"{username}'s Birthday",
+        'start': day.strftime("%Y-%m-%d"),
+        'color': 'DarkCyan',
+        'textColor': 'White',
+        'extendedProps': {
+            'icon': 'bi bi-person-bounding-box',
+            'type': 'birthday'
+        }
+    }
+
+
+def event_entry(event):
+    return {
+        'title': f"{event.title}",
+        'start': event.date.isoformat(),
+        'color': 'ForestGreen',
+        'textColor': 'White',
+        'extendedProps': {
+            'icon': 'bi bi-balloon',
+            'type': 'event'
+        }
+    }
+
+
+def gift_search_entry(gift_search):
+    return {
+        'title': f"Gift Search: {gift_search.title}",
+        'start': gift_search.deadline.isoformat(),
+        'color': 'DarkMagenta',
+        'textColor': 'White',
+        'extendedProps': {
+            'icon': 'bi bi-gift',
+            'type': 'gift'
+        }
+    }
+
+
+def gift_contribution_entry(gift_contribution):
+    return {
+        'title': f"Gift Contribution: {gift_contribution.title}",
+        'start': gift_contribution.deadline.isoformat(),
+        'color': 'BlueViolet',
+        'textColor': 'White',
+        'extendedProps': {
+            'icon': 'bi bi-cash-coin',
+            'type': 'gift'
+        }
+    }
+
+
+def task_entries(task, today):
+    due_date_str = task.due_date.strftime("%Y-%m-%d") if hasattr(task.due_date, 'strftime') else str(task.due_date)
+    task_date = task.due_date.date() if hasattr(task.due_date, 'date') else task.due_date
+    overdue = task_date < today and task.status != 'completed'
+    entries = [{
+        'title': f"Task: {task.title}" + (" (Overdue)" if overdue else ""),
+        'start': due_date_str,
+        'color': 'RoyalBlue',
+        'textColor': 'White',
+        'extendedProps': {
+            'icon': 'bi bi-exclamation-triangle' if overdue else 'bi bi-briefcase',
+            'type': 'task',
+            'status': task.status
+        }
+    }]
+    if overdue:
+        entries.append({
+            'start': due_date_str,
+            'color': 'Red',
+            'textColor': 'White',
+            'title': 'overdue'
+        })
+    return entries
+
+
+
+# -------------------------------------------------------------
+# Returns the birthday entries of the range: one query matching month and day of the birthdays in the database
+# -------------------------------------------------------------
+def birthday_entries(start, end):
+    # Days of the range per month and day (a long range may contain a day twice, Feb 29 is shown on Feb 28 in non-leap years)
+    occurrences = defaultdict(list)
+    day = start
+    while day < end:
+        occurrences[day.month * 100 + day.day].append(day)
+        if day.month == 2 and day.day == 28 and not calendar.isleap(day.year):
+            occurrences[229].append(day)
+        day += timedelta(days=1)
+
+    profiles = (UserProfile.objects.exclude(birthday__isnull=True)
+                .annotate(birthday_code=ExtractMonth('birthday') * 100 + ExtractDay('birthday'))
+                .filter(birthday_code__in=list(occurrences))
+                .values_list('user__username', 'birthday_code'))
+    return [birthday_entry(username, day) for username, code in profiles for day in occurrences[code]]
+
+
+
+# -------------------------------------------------------------
+# Returns the entries of the range which are the same for all users (cached per range and calendar version)
+# -------------------------------------------------------------
+def shared_entries(start, end, version=None):
+    if version is None:
+        version = get_version(CALENDAR_VERSION_KEY)
+    key = f'event_planner:calendar_feed:{version}:{start.isoformat()}:{end.isoformat()}'
+    shared = cache.get(key)
+    if shared is not None:
+        return shared
+
+    entries = birthday_entries(start, end)
+    # Events: Only events with date, time, and location set
+    events = Event.objects.filter(date__gte=start, date__lt=end, time__isnull=False, location__isnull=False)
+    entries += [event_entry(event) for event in events]
+    # Gift searches and contributions are hidden from their donee, the donee is kept with each entry
+    gifts = [(gift_search.donee_id, gift_search_entry(gift_search))
+             for gift_search in GiftSearch.objects.filter(deadline__gte=start, deadline__lt=end)]
+    gifts += [(gift_contribution.donee_id, gift_contribution_entry(gift_contribution))
+              for gift_contribution in GiftContribution.objects.filter(deadline__gte=start, deadline__lt=end)]
+
+    shared = {'entries': entries, 'gifts': gifts}
+    cache.set(key, shared, FEED_TIMEOUT)
+    return shared
+
+
+
+# -------------------------------------------------------------
+# Returns all calendar entries of the range for a user (shared entries and own tasks)
+# -------------------------------------------------------------
+def build_feed(user_profile, start, end, version=None):
+    shared = shared_entries(start, end, version)
+    entries = list(shared['entries'])
+    entries += [entry for donee_id, entry in shared['gifts'] if donee_id != user_profile.pk]
+
+    # Tasks: Only tasks for the user with a due date in the range
+    today = timezone.now().date()
+    range_start = timezone.make_aware(datetime.combine(start, time.min))
+    range_end = timezone.make_aware(datetime.combine(end, time.min))
+    tasks = Task.objects.filter(assigned_to=user_profile, due_date__gte=range_start, due_date__lt=range_end)
+    for task in tasks:
+        entries += task_entries(task, today)
+    return entries
@@ -1,5 +1,9 @@
+import copy
 import json
 import os
+import time
+import threading
+from django.conf import settings
 
 # Path to configuration file
 CONFIG_FILE_PATH = os.path.join(os.path.dirname(__file__), 'job_settings.json')
@@ -8,6 +12,8 @@ CONFIG_FILE_PATH = os.path.join(os.path.dirname(__file__), 'job_settings.json')
 
 # -------------------------------------------------------------
 # Global configuration for job settings
+# Optional schedule keys of a job (see scheduler.py): 'cron' (crontab, e.g. '30 2 * * 0' for Sundays) or 'time_window'
+# ({'start': '01:00', 'end': '05:00'}) instead of the interval, 'jitter' (seconds), 'max_instances', 'coalesce', 'misfire_grace_time'
 # -------------------------------------------------------------
 DEFAULT_JOB_CONFIG = {
     'check_overdue_tasks': {
@@ -119,6 +125,24 @@ DEFAULT_JOB_CONFIG = {
         'max': 96,
         'description': 'Checks the status of a gift contribution. The job checks every X hours; if status is "open" after deadline, the status is changed to "closed".'
     },
+    'send_digest_emails': {
+        'enabled': False,
+        'interval': 1,  # how often (in hours) to check for closed digest windows
+        'min': 1,
+        'max': 24,
+        'window': 'daily',  # 'hourly' or 'daily': notifications of one window are sent as one email per user
+        'jobs': [           # jobs whose notifications are collected for the digest
+            'check_overdue_tasks',
+            'send_reminder_email',
+            'check_payment_reminder',
+            'send_gift_search_invitation',
+            'gift_search_reminder',
+            'gift_search_results',
+            'send_gift_contribution_invitation',
+            'gift_contribution_reminder',
+        ],
+        'description': 'Sends digest emails. While enabled, notifications of the digest jobs are collected and sent as one email per user and window (hourly or daily); the job checks every X hours for closed windows. Disabling the digest sends the collected notifications at once.'
+    },
     'general': {
         'conversion_rate': 0.5,  # float
         'description': 'Conversion rate for payments in points (input as decimal number)',
@@ -138,6 +162,9 @@ def load_job_config():
         try:
             with open(CONFIG_FILE_PATH, 'r') as f:
                 config = json.load(f)
+                # Jobs added after the file was saved use their defaults
+                for job, defaults in DEFAULT_JOB_CONFIG.items():
+                    config.setdefault(job, copy.deepcopy(defaults))
                 return config
         except Exception as e:
             print("Error loading config file, using defaults:", e)
@@ -153,10 +180,67 @@ def load_job_config():
 # -------------------------------------------------------------
 def save_job_config(config):
     try:
-        with open(CONFIG_FILE_PATH, 'w') as f:
+        # Written to a temporary file and replaced, other processes never read a half-written file
+        temp_path = f'{CONFIG_FILE_PATH}.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as f:
             json.dump(config, f, indent=4)
+        os.replace(temp_path, CONFIG_FILE_PATH)
+        # This process already has the saved configuration
+        _config_state['version'] = get_config_version()
     except Exception as e:
         print("Error saving config file:", e)
 
+
+
+# -------------------------------------------------------------
+# Version stamp of the JSON file (modification time and size, None if the file does not exist)
+# -------------------------------------------------------------
+def get_config_version():
+    try:
+        stat = os.stat(CONFIG_FILE_PATH)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+
+# -------------------------------------------------------------
+# Helper function to read how often (in seconds) a process checks the JSON file for changes
+# -------------------------------------------------------------
+def get_config_check_interval():
+    return getattr(settings, 'JOB_CONFIG_CHECK_INTERVAL', 5)
+
+
+
+# -------------------------------------------------------------
+# Reloads JOB_CONFIG in place if the JSON file was saved by another process and returns whether it changed
+# (at most one stat of the file per check interval, modules which imported JOB_CONFIG see the new values)
+# -------------------------------------------------------------
+def refresh_job_config(force=False):
+    now = time.monotonic()
+    if not force and now - _config_state['checked'] < get_config_check_interval():
+        return False
+    with _config_lock:
+        _config_state['checked'] = now
+        version = get_config_version()
+        if version is None or version == _config_state['version']:
+            return False
+        config = load_job_config()
+        _config_state['version'] = version
+        if config == JOB_CONFIG:
+            return False
+        # Keys are replaced in place and stale keys removed afterwards, concurrent readers never see a missing job
+        JOB_CONFIG.update(config)
+        for job_id in JOB_CONFIG.keys() - config.keys():
+            del JOB_CONFIG[job_id]
+        return True
+
+
+
+# Version of the loaded configuration and time of the last check (per process)
+_config_lock = threading.Lock()
+_config_state = {'version': None, 'checked': time.monotonic()}
+
 # Initialize JOB_CONFIG at import time
-JOB_CONFIG = load_job_config()
\ No newline at end of file
+JOB_CONFIG = load_job_config()
+_config_state['version'] = get_config_version()
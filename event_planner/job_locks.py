@@ -0,0 +1,151 @@
+import os
+import zlib
+import socket
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+from functools import wraps
+from uuid import uuid4
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import JobLock
+from .job_runs import mark_job_skipped
+
+
+
+logger = logging.getLogger(__name__)
+
+
+
+# -------------------------------------------------------------
+# Helper function to read the lease lifetime of a job in seconds (extended by heartbeats while the job runs)
+# -------------------------------------------------------------
+def get_lock_ttl():
+    return getattr(settings, 'JOB_LOCK_TTL', 600)
+
+
+
+# -------------------------------------------------------------
+# Helper functions for PostgreSQL advisory locks (released by the database when the holding connection is lost)
+# -------------------------------------------------------------
+def uses_advisory_locks():
+    return connection.vendor == 'postgresql'
+
+
+def advisory_key(job_id):
+    return zlib.crc32(job_id.encode())
+
+
+def try_advisory_lock(job_id):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", [advisory_key(job_id)])
+        return cursor.fetchone()[0]
+
+
+def advisory_unlock(job_id):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_unlock(%s)", [advisory_key(job_id)])
+
+
+
+# -------------------------------------------------------------
+# Takes the lease of a job if it is free or expired (one conditional UPDATE, atomic on SQLite and PostgreSQL)
+# -------------------------------------------------------------
+def acquire_job_lock(job_id, owner, ttl):
+    now = timezone.now()
+    JobLock.objects.bulk_create([JobLock(job_id=job_id)], ignore_conflicts=True)
+    locks = JobLock.objects.filter(job_id=job_id)
+    if not uses_advisory_locks():
+        locks = locks.filter(Q(expires_at__isnull=True) | Q(expires_at__lte=now))
+    # With an advisory lock no other run is active, a lease left by a crashed process is taken over
+    return locks.update(owner=owner, acquired_at=now, heartbeat_at=now, expires_at=now + timedelta(seconds=ttl)) == 1
+
+
+def extend_job_lock(job_id, owner, ttl):
+    now = timezone.now()
+    return JobLock.objects.filter(job_id=job_id, owner=owner).update(heartbeat_at=now, expires_at=now + timedelta(seconds=ttl)) == 1
+
+
+def release_job_lock(job_id, owner):
+    JobLock.objects.filter(job_id=job_id, owner=owner).update(owner='', expires_at=None)
+
+
+def record_skipped_run(job_id):
+    mark_job_skipped()
+    locks = JobLock.objects.filter(job_id=job_id)
+    locks.update(skipped_count=F('skipped_count') + 1, last_skipped_at=timezone.now())
+    holder = locks.values_list('owner', 'expires_at').first()
+    logger.warning("%s: skipped, still running (lease %s until %s)", job_id, *(holder or ('unknown', None)))
+
+
+
+# -------------------------------------------------------------
+# Thread which extends the lease of a running job (every third of the lease lifetime, own database connection)
+# -------------------------------------------------------------
+class JobLockHeartbeat(threading.Thread):
+    def __init__(self, job_id, owner, ttl):
+        super().__init__(name=f"{job_id}-heartbeat", daemon=True)
+        self.job_id = job_id
+        self.owner = owner
+        self.ttl = ttl
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.ttl / 3):
+                if not extend_job_lock(self.job_id, self.owner, self.ttl):
+                    logger.warning("%s: lease %s was lost while the job was running", self.job_id, self.owner)
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+
+# -------------------------------------------------------------
+# Context manager which holds the lease of a job while it runs (yields False if another run holds it, the skip is recorded)
+# -------------------------------------------------------------
+@contextmanager
+def job_lock(job_id, ttl=None):
+    ttl = ttl or get_lock_ttl()
+    owner = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+
+    if uses_advisory_locks() and not try_advisory_lock(job_id):
+        record_skipped_run(job_id)
+        yield False
+        return
+    try:
+        if not acquire_job_lock(job_id, owner, ttl):
+            record_skipped_run(job_id)
+            yield False
+            return
+        heartbeat = JobLockHeartbeat(job_id, owner, ttl)
+        heartbeat.start()
+        try:
+            yield True
+        finally:
+            heartbeat.stop()
+            release_job_lock(job_id, owner)
+    finally:
+        if uses_advisory_locks():
+            advisory_unlock(job_id)
+
+
+
+# -------------------------------------------------------------
+# Decorator for scheduled jobs: the job runs only if no other run of it is active (returns None if skipped)
+# -------------------------------------------------------------
+def single_run(job_id, ttl=None):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with job_lock(job_id, ttl) as acquired:
+                if acquired:
+                    return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,164 @@
+import math
+import time
+import traceback
+from collections import Counter, defaultdict
+from datetime import timedelta
+from functools import wraps
+from asgiref.local import Local
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from .models import CacheVersion, JobLock, JobRun
+
+
+
+# State of the active job run (per thread / async context)
+_run_state = Local()
+
+
+
+# -------------------------------------------------------------
+# Helper function to read how many days job runs are kept
+# -------------------------------------------------------------
+def get_run_retention():
+    return getattr(settings, 'JOB_RUN_RETENTION', 30)
+
+
+
+# -------------------------------------------------------------
+# Collects the metrics of a job run: queries and written rows of this thread's connection and counters reported by the job
+# -------------------------------------------------------------
+class JobRunRecorder:
+    # Bookkeeping of the lock, run and cache version tables is not part of the job
+    ignored_tables = (JobLock._meta.db_table, JobRun._meta.db_table, CacheVersion._meta.db_table)
+
+    def __init__(self):
+        self.query_count = 0
+        self.query_time = 0.0
+        self.rows_processed = 0
+        self.counters = Counter()
+        self.skipped = False
+
+    def __call__(self, execute, sql, params, many, context):
+        # Database execute wrapper (see connection.execute_wrapper)
+        if any(table in sql for table in self.ignored_tables):
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.query_count += 1
+            self.query_time += time.perf_counter() - started
+            statement = sql.lstrip()[:6].upper()
+            if statement in ('INSERT', 'UPDATE', 'DELETE'):
+                rowcount = context['cursor'].rowcount
+                if rowcount <= 0 and statement == 'INSERT' and 'RETURNING' in sql and connection.vendor == 'sqlite':
+                    # SQLite reports no rowcount for INSERT ... RETURNING (one row per parameter set)
+                    rowcount = len(params) if many else 1
+                self.rows_processed += max(rowcount, 0)
+
+
+
+# -------------------------------------------------------------
+# Helper functions which report to the active job run (nothing happens outside of a job run)
+# -------------------------------------------------------------
+def count_job_metric(name, amount=1):
+    recorder = getattr(_run_state, 'recorder', None)
+    if recorder is not None:
+        recorder.counters[name] += amount
+
+
+def mark_job_skipped():
+    recorder = getattr(_run_state, 'recorder', None)
+    if recorder is not None:
+        recorder.skipped = True
+
+
+
+# -------------------------------------------------------------
+# Wraps a scheduled job so each run is stored as JobRun with duration, queries, written rows, emails and exception
+# -------------------------------------------------------------
+def track_job_run(func, job_id=None):
+    job_id = job_id or func.__name__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        run = JobRun.objects.create(job_id=job_id)
+        recorder = JobRunRecorder()
+        _run_state.recorder = recorder
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(recorder):
+                result = func(*args, **kwargs)
+            run.status = 'skipped' if recorder.skipped else 'succeeded'
+            return result
+        except Exception:
+            run.status = 'failed'
+            run.error = traceback.format_exc()
+            raise
+        finally:
+            _run_state.recorder = None
+            run.finished_at = timezone.now()
+            run.duration = time.perf_counter() - started
+            run.query_count = recorder.query_count
+            run.query_time = recorder.query_time
+            run.rows_processed = recorder.rows_processed
+            run.emails_sent = recorder.counters['emails_sent']
+            run.emails_queued = recorder.counters['emails_queued']
+            run.emails_failed = recorder.counters['emails_failed']
+            run.save()
+            # Runs older than the retention are removed (one DELETE on the index of the job)
+            JobRun.objects.filter(job_id=job_id, started_at__lt=run.finished_at - timedelta(days=get_run_retention())).delete()
+    return wrapper
+
+
+
+# -------------------------------------------------------------
+# Helper function which returns the percentile of a list of values (nearest rank, None for an empty list)
+# -------------------------------------------------------------
+def percentile(values, percent):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(math.ceil(percent / 100 * len(values)) - 1, 0)]
+
+
+
+# -------------------------------------------------------------
+# Returns the statistics of all jobs with runs in the retention period (p50/p95 durations, trend of the last week vs. the week before)
+# -------------------------------------------------------------
+def job_run_statistics():
+    now = timezone.now()
+    week_ago = now - timedelta(days=7)
+    two_weeks_ago = now - timedelta(days=14)
+
+    runs = defaultdict(list)
+    rows = JobRun.objects.filter(started_at__gte=now - timedelta(days=get_run_retention())).order_by('started_at').values(
+        'job_id', 'status', 'started_at', 'duration', 'query_count', 'query_time', 'rows_processed', 'emails_sent', 'emails_queued', 'emails_failed')
+    for row in rows:
+        runs[row['job_id']].append(row)
+
+    statistics = []
+    for job_id in sorted(runs):
+        job_runs = runs[job_id]
+        # Skipped and unfinished runs have no meaningful duration
+        finished = [run for run in job_runs if run['status'] in ('succeeded', 'failed')]
+        durations = [run['duration'] for run in finished]
+        current = percentile([run['duration'] for run in finished if run['started_at'] >= week_ago], 50)
+        previous = percentile([run['duration'] for run in finished if two_weeks_ago <= run['started_at'] < week_ago], 50)
+        statistics.append({
+            'job_id': job_id,
+            'runs': len(job_runs),
+            'failed': sum(run['status'] == 'failed' for run in job_runs),
+            'skipped': sum(run['status'] == 'skipped' for run in job_runs),
+            'last_run': job_runs[-1],
+            'p50': percentile(durations, 50),
+            'p95': percentile(durations, 95),
+            'avg_queries': sum(run['query_count'] for run in finished) / len(finished) if finished else None,
+            'avg_query_time': sum(run['query_time'] for run in finished) / len(finished) if finished else None,
+            'rows_processed': sum(run['rows_processed'] for run in finished),
+            'emails': sum(run['emails_sent'] + run['emails_queued'] for run in finished),
+            'trend_p50': current,
+            'trend_change': (current - previous) / previous * 100 if current is not None and previous else None,
+        })
+    return statistics
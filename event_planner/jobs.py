@@ -1,21 +1,37 @@
+import time
 import random
 from collections import defaultdict
-from django.db.models import Sum, Count
+from functools import partial
+from itertools import groupby
+from operator import attrgetter
+from django.db import transaction
+from django.db.models import Sum, Count, Exists, OuterRef, Q, F, Value, Prefetch
+from django.db.models.functions import Coalesce
 from datetime import date
-from django.core.mail import send_mail
 from django.conf import settings
 from datetime import datetime, timedelta
 from django.utils import timezone
 from django.urls import reverse
-from django.core.mail import EmailMultiAlternatives
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
+from django.core.mail import EmailMessage
 from django.contrib.auth.models import User
 from event_planner.job_config import JOB_CONFIG
 from .models import *
+from .score_engine import score_batch, bump_scores_version, apply_histories_created
+from .points_registry import get_role_points, get_gift_points
+from .score_index import ScoreIndex
+from .transitions import StatusTransition, run_transitions
+from .mail import mail_dispatch, send_mail, send_message, deliver_message, confirm_sent
+from .job_locks import single_run
+from .notifications import INVITATION_EMAIL, GIFT_SEARCH_INVITATION, GIFT_CONTRIBUTION_INVITATION
 
 
 
+# -------------------------------------------------------------
+# Number of user profiles written per query by store_user_scores
+# -------------------------------------------------------------
+STORE_SCORES_CHUNK_SIZE = 1000
+
+
 
 # -------------------------------------------------------------
 # Generate calender item
@@ -43,44 +59,93 @@ def generate_ics_for_event(event, points):
 
 
 
+# -------------------------------------------------------------
+# Marks tasks as overdue in bulk: one UPDATE of the tasks, bulk-created penalty records and one grouped score update
+# (same results as saving each task, see signals update__task_score and update_task_score_history)
+# -------------------------------------------------------------
+def mark_tasks_overdue(tasks):
+    if not tasks:
+        return
+    Task.objects.filter(pk__in=[task.pk for task in tasks]).update(
+        status='overdue',
+        points_awarded=Coalesce(F('points_awarded'), Value(0)) + F('penalty_points'),
+        updated_at=timezone.now(),
+    )
+
+    # One penalty record per task and assigned user (existing records get the current penalty points)
+    existing = {
+        (history.task_id, history.user_profile_id): history
+        for history in TaskScoreHistory.objects.filter(task__in=tasks, score_type='penalty')
+    }
+    new_histories = []
+    for task in tasks:
+        task.points_awarded = (task.points_awarded or 0) + task.penalty_points
+        task.status = 'overdue'
+        for user_profile in task.assigned_to.all():
+            history = existing.get((task.pk, user_profile.pk))
+            if history is None:
+                new_histories.append(TaskScoreHistory(
+                    task=task,
+                    user_profile=user_profile,
+                    score_type='penalty',
+                    points_change=task.penalty_points,
+                    note=f"Points deducted for late task '{task.title}' in event '{task.event}'.",
+                ))
+            elif history.points_change != task.penalty_points:
+                history.points_change = task.penalty_points
+                history.save()
+
+    TaskScoreHistory.objects.bulk_create(new_histories)
+    apply_histories_created(new_histories)
+
+
+
 # -------------------------------------------------------------
 # Checks if task is overdue, sets status (not for completed tasks), and sends mail to all responsible users
 # -------------------------------------------------------------
+@single_run('check_overdue_tasks')
+@mail_dispatch('check_overdue_tasks')
 def check_overdue_tasks():
     now = timezone.localtime(timezone.now())
     print("Overdue job runs at" , now)
-    # Query tasks that are overdue (due_date < now), not completed and not already marked as overdue
-    tasks_overdue = Task.objects.filter(due_date__lt=now).exclude(status__in=['completed', 'overdue'])
+    # Query tasks that are overdue (due_date < now), not completed and not already marked as overdue (locked until penalties are applied)
+    with transaction.atomic():
+        tasks_overdue = list(
+            Task.objects.select_for_update(of=('self',))
+            .filter(due_date__lt=now).exclude(status__in=['completed', 'overdue'])
+            .select_related('event')
+            .prefetch_related(Prefetch('assigned_to', queryset=UserProfile.objects.select_related('user')))
+        )
+        mark_tasks_overdue(tasks_overdue)
+
+    # Scores of all users (including the penalties) for the leaderboard comparison (loaded once per run)
+    score_index = ScoreIndex.build()
     
     for task in tasks_overdue:
-        task.status = 'overdue'
-        task.save()
-
         # Get all assigned users
-        assigned_users = list(task.assigned_to.all())
+        assigned_users = task.assigned_to.all()
 
         # For each assigned user, send email notification
         for user in assigned_users:
-            # Update task status to 'overdue'
-            current_score = user.total_score
+            current_score = score_index.get(user.pk).total_score
             # Calculate potential new score if task is completed (gaining base_points) or if failure persists (losing penalty_points)
             base_points = task.base_points or 0
             penalty_points = task.penalty_points or 0
             new_score_if_success = current_score + base_points 
             
             # Find closest competitor above and below in the leaderboard
-            competitor_above = UserProfile.objects.filter(total_score__gt=current_score).order_by('total_score').first()
-            competitor_below = UserProfile.objects.filter(total_score__lt=current_score).order_by('-total_score').first()
+            competitor_above = score_index.above(current_score)
+            competitor_below = score_index.below(current_score)
 
             # Build ranking comparison message based on the user's total_score
             ranking_message = ""
             if competitor_below and current_score < competitor_below.total_score and current_score + penalty_points >= competitor_below.total_score:
                 ranking_message += (
-                    f"As you have not completed the task on time, you will fall behind {competitor_below.user.username} on the leaderboard.\n"
+                    f"As you have not completed the task on time, you will fall behind {competitor_below.username} on the leaderboard.\n"
                 )
             if competitor_above and new_score_if_success > competitor_above.total_score:
                 ranking_message += (
-                    f"If you complete the task, you still can overtake {competitor_above.user.username} on the leaderboard.\n"
+                    f"If you complete the task, you still can overtake {competitor_above.username} on the leaderboard.\n"
                 )
             if not ranking_message:
                 ranking_message = "No significant change in your ranking is expected, but every effort counts – keep up the great work!!\n"
@@ -102,12 +167,15 @@ def check_overdue_tasks():
                 message=message,
                 from_email=settings.EMAIL_HOST_USER,
                 recipient_list=[user.user.email],
+                idempotency_key=f"check_overdue_tasks:{task.pk}:{task.due_date.isoformat()}:{user.pk}",
             )
 
 
 # -------------------------------------------------------------
 # Sends mail in a timeframe before task gets overdue to all responsible users
 # -------------------------------------------------------------
+@single_run('send_reminder_email')
+@mail_dispatch('send_reminder_email')
 def send_reminder_email():
     now = timezone.localtime(timezone.now())
     print("Reminder job runs at" , now)
@@ -128,6 +196,8 @@ def send_reminder_email():
         due_date__gte=window_start,
         due_date__lt=window_end,
     ).exclude(status__in=['completed', 'reminder_sent'])
+    # Scores of all users for the leaderboard comparison (loaded once per run)
+    score_index = ScoreIndex.build()
     
     # Iterate over tasks approaching deadline
     for task in tasks_remind:
@@ -142,7 +212,7 @@ def send_reminder_email():
         penalty_points = task.penalty_points or 0
 
         # Get all assigned users
-        assigned_users = list(task.assigned_to.all())
+        assigned_users = list(task.assigned_to.select_related('user'))
 
         # Iterate over users responsible for the task
         for user in assigned_users:
@@ -158,20 +228,20 @@ def send_reminder_email():
             new_score_if_success = current_score + base_points
             new_score_if_failure = current_score - penalty_points
             # Find the closest competitor above (with a higher score)
-            competitor_above = UserProfile.objects.filter(total_score__gt=current_score).order_by('total_score').first()
+            competitor_above = score_index.above(current_score)
             # Find the closest competitor below (with a lower score)
-            competitor_below = UserProfile.objects.filter(total_score__lt=current_score).order_by('-total_score').first()
+            competitor_below = score_index.below(current_score)
             # Determine what ranking change might occur
             ranking_message = ""
             if competitor_above and new_score_if_success > competitor_above.total_score:
                 ranking_message += (
                     f"If you complete this task, you'll overtake "
-                    f"{competitor_above.user.username} on the leaderboard.\n"
+                    f"{competitor_above.username} on the leaderboard.\n"
                 )
             if competitor_below and new_score_if_failure < competitor_below.total_score:
                 ranking_message += (
                     f"If you fail to complete this task on time, you might fall behind "
-                    f"{competitor_below.user.username} on the leaderboard.\n"
+                    f"{competitor_below.username} on the leaderboard.\n"
                 )
             if not ranking_message:
                 ranking_message = "No change in your rank is expected, but every task counts – keep up the great work!\n"
@@ -189,17 +259,21 @@ def send_reminder_email():
                 "Your 21 Celebrations System\n\n"
                 f"{ranking_message}"
             )
-            send_mail(subject, message, settings.EMAIL_HOST_USER, [user.user.email])
+            send_mail(subject, message, settings.EMAIL_HOST_USER, [user.user.email],
+                      idempotency_key=f"send_reminder_email:{task.pk}:{task.due_date.isoformat()}:{user.pk}")
 
-        # Mark task as reminder sent to avoid sending duplicate reminders
-        task.status = 'reminder'
-        task.save()
+        # Mark task as reminder sent to avoid sending duplicate reminders (a failed mail is sent again on the next run)
+        if confirm_sent():
+            task.status = 'reminder'
+            task.save()
 
 
 
 # -------------------------------------------------------------
 # Sends invitation mail to all active users when date, time, and location of event are set
 # -------------------------------------------------------------
+@single_run('send_invitation_email')
+@mail_dispatch('send_invitation_email')
 def send_invitation_email():
     now = timezone.localtime(timezone.now())
     print("Invitation job runs at" , now)
@@ -213,10 +287,12 @@ def send_invitation_email():
         date__gte=now.date(),
         invitation_sent=False
     )
+    # Scores of all users for the leaderboard comparison (loaded once per run)
+    score_index = ScoreIndex.build()
     
     for event in events:
         # For each event, send invitation email to all active users
-        profiles = UserProfile.objects.filter(is_inactive=False)
+        profiles = UserProfile.objects.filter(is_inactive=False).select_related('user')
         
         # Construct URL to dashboard
         if settings.DEBUG:
@@ -226,9 +302,13 @@ def send_invitation_email():
 
         attend_url = site_url + reverse('attend_from_mail', args=[event.id])
 
-        # Retrieve points for role from the RoleConfiguration model
-        config = RoleConfiguration.objects.filter(role='attendee').first()
-        attendance_points = config.points if config else 0
+        # Retrieve points for role from the points registry (RoleConfiguration)
+        attendance_points = get_role_points('attendee')
+
+        # Event part of the invitation and Outlook-compatible ICS file are rendered once per event
+        invitation = INVITATION_EMAIL.prepare(event=event, attendance_points=attendance_points, attend_url=attend_url)
+        subject = f"Invitation: {event.title} on {event.date}"
+        attachments = [("event.ics", generate_ics_for_event(event, attendance_points), "text/calendar")]
 
         for profile in profiles:
             user = profile.user
@@ -238,45 +318,34 @@ def send_invitation_email():
             new_score = current_score + attendance_points
 
             # Leaderboard comparison: get next user with higher score, and next with lower score
-            competitor_above = UserProfile.objects.filter(total_score__gt=current_score).order_by('total_score').first()
-            competitor_below = UserProfile.objects.filter(total_score__lt=current_score).order_by('-total_score').first()
+            competitor_above = score_index.above(current_score)
+            competitor_below = score_index.below(current_score)
 
             ranking_message = ""
             if competitor_above and new_score > competitor_above.total_score:
-                ranking_message += f"By attending, you'll overtake {competitor_above.user.username} on the leaderboard. "
+                ranking_message += f"By attending, you'll overtake {competitor_above.username} on the leaderboard. "
             if competitor_below and new_score < competitor_below.total_score:
-                ranking_message += f"If you don't attend, you risk falling behind {competitor_below.user.username} on the leaderboard. "
+                ranking_message += f"If you don't attend, you risk falling behind {competitor_below.username} on the leaderboard. "
             if not ranking_message:
                 ranking_message = "Your ranking remains stable, but every point counts!"
 
-            # Prepare email content using HTML template
-            context = {
-                'user': user,
-                'event': event,
-                'attendance_points': attendance_points,
-                'ranking_message': ranking_message,
-                'attend_url': attend_url,
-            }
-            html_content = render_to_string("email/invitation_email.html", context)
-            text_content = strip_tags(html_content)
-            subject = f"Invitation: {event.title} on {event.date}"
-            msg = EmailMultiAlternatives(subject, text_content, settings.EMAIL_HOST_USER, [user.email])
-            msg.attach_alternative(html_content, "text/html")
-            
-            # Attach Outlook-compatible ICS file
-            ics_content = generate_ics_for_event(event, attendance_points)
-            msg.attach("event.ics", ics_content, "text/calendar")
-            msg.send()
+            # Only username and ranking message are rendered per recipient
+            send_message(partial(invitation.build_message, subject, settings.EMAIL_HOST_USER, [user.email], attachments,
+                                 username=user.username, ranking_message=ranking_message),
+                         idempotency_key=f"send_invitation_email:{event.pk}:{profile.pk}")
         
-        # Mark the event as having sent invitations
-        event.invitation_sent = True
-        event.save()
+        # Mark the event as having sent invitations (a failed mail is sent again on the next run)
+        if confirm_sent():
+            event.invitation_sent = True
+            event.save()
 
 
 
 # -------------------------------------------------------------
 # Sends mail with invitation to propose and vote on gifts when search is created (except donee)
 # -------------------------------------------------------------
+@single_run('send_gift_search_invitation')
+@mail_dispatch('send_gift_search_invitation')
 def send_gift_search_invitation():
     now = timezone.localtime(timezone.now())
     print("Gift invitation job runs at" , now)
@@ -294,59 +363,43 @@ def send_gift_search_invitation():
         site_url = getattr(settings, "SITE_URL", "http://21celebrations.com")
 
     # Get points for proposal
-    config_proposer = GiftConfiguration.objects.filter(role='proposer').first()
-    points_proposer = config_proposer.points if config_proposer else 0
+    points_proposer = get_gift_points('proposer')
 
     # Get points for voting
-    config_voter = GiftConfiguration.objects.filter(role='voter').first()
-    points_voter = config_voter.points if config_voter else 0
+    points_voter = get_gift_points('voter')
 
     # Get points for winning
-    config_winner = GiftConfiguration.objects.filter(role='winner').first()
-    points_winner = config_winner.points if config_winner else 0
-
-    # Build points details message
-    points_message = (
-        "Points available for participating:\n"
-        f"- Propose a gift: {points_proposer} points\n"
-        f"- Vote on proposals: {points_voter} points\n"
-        f"- Winning the gift search: {points_winner} points\n\n"
-    )
+    points_winner = get_gift_points('winner')
 
     for gs in gift_searches:
         # Construct link to view gift search details
         gift_url = site_url + reverse("gift_search_detail", args=[gs.id])
         
         # Get all active users except donee
-        active_users = UserProfile.objects.filter(is_inactive=False).exclude(pk=gs.donee.pk)
+        active_users = UserProfile.objects.filter(is_inactive=False).exclude(pk=gs.donee.pk).select_related('user')
         
-        # Compose email message
+        # Compose email message (gift search part is rendered once)
+        subject = f"New Gift Search: {gs.title}"
+        invitation = GIFT_SEARCH_INVITATION.prepare(
+            gift_search=gs, gift_url=gift_url,
+            points_proposer=points_proposer, points_voter=points_voter, points_winner=points_winner)
         for profile in active_users:
-            subject = f"New Gift Search: {gs.title}"
-            message = (
-                f"Dear {profile.user.username},\n\n"
-                f"A new gift search '{gs.title}' has been created.\n"
-                f"Donee: {gs.donee.user.username}\n"
-                f"Purpose: {gs.purpose}\n\n"
-                "We invite you to propose a suitable gift for the donee and to vote on proposals.\n"
-                "By participating, you will earn points for your contributions!\n"
-                f"{points_message}"
-                f"Please note, the deadline for proposals and votes is: {gs.deadline}.\n\n"
-                f"View the details here: {gift_url}\n\n"
-                "Best regards,\n"
-                "Your 21 Celebrations System"
-            )
-            send_mail(subject, message, settings.EMAIL_HOST_USER, [profile.user.email])
+            message, _ = invitation.render(username=profile.user.username)
+            send_mail(subject, message, settings.EMAIL_HOST_USER, [profile.user.email],
+                      idempotency_key=f"send_gift_search_invitation:{gs.pk}:{profile.pk}")
         
-        # Mark gift search as processed
-        gs.invitation_sent = True
-        gs.save()
+        # Mark gift search as processed (a failed mail is sent again on the next run)
+        if confirm_sent():
+            gs.invitation_sent = True
+            gs.save()
 
 
 
 # -------------------------------------------------------------
 # Sends mail with invitation to contribute for gifts when contribution is created (except donee)
 # -------------------------------------------------------------
+@single_run('send_gift_contribution_invitation')
+@mail_dispatch('send_gift_contribution_invitation')
 def send_gift_contribution_invitation():
     now = timezone.localtime(timezone.now())
     print("Contribution invitation job runs at" , now)
@@ -371,38 +424,28 @@ def send_gift_contribution_invitation():
         gift_url = site_url + reverse("gift_contribution_list")
         
         # Get all active user profiles except donee
-        active_users = UserProfile.objects.filter(is_inactive=False).exclude(pk=gc.donee.pk)
+        active_users = UserProfile.objects.filter(is_inactive=False).exclude(pk=gc.donee.pk).select_related('user')
         
-        # Compose email message
+        # Compose email message (gift contribution part is rendered once)
+        subject = f"Invitation: Contribute to '{gc.title}'"
+        invitation = GIFT_CONTRIBUTION_INVITATION.prepare(gift_contribution=gc, gift_url=gift_url, conversion_rate=conversion_rate)
         for profile in active_users:
-            subject = f"Invitation: Contribute to '{gc.title}'"
-            message = (
-                f"Dear {profile.user.username},\n\n"
-                f"A new gift contribution opportunity has been created:\n\n"
-                f"Title: {gc.title}\n"
-                f"Description: {gc.description}\n"
-                f"Deadline: {gc.deadline}\n"
-                f"Collection Target: {gc.collection_target}\n"
-                f"Manager: {gc.manager.user.username}\n\n"
-                "You are invited to make a monetary contribution.\n"
-                f"Your contributions will be recognized with points at a conversion rate of {conversion_rate}.\n"
-                "This means the more you contribute, the more points you will earn.\n\n"
-                "Please note: All contributions must be paid to the manager once the contribution period ends.\n\n"
-                f"View full details here: {gift_url}\n\n"
-                "Best regards,\n"
-                "Your 21 Celebrations System"
-            )
-            send_mail(subject, message, settings.EMAIL_HOST_USER, [profile.user.email])
+            message, _ = invitation.render(username=profile.user.username)
+            send_mail(subject, message, settings.EMAIL_HOST_USER, [profile.user.email],
+                      idempotency_key=f"send_gift_contribution_invitation:{gc.pk}:{profile.pk}")
         
-        # Mark gift contribution as processed
-        gc.invitation_sent = True
-        gc.save()
+        # Mark gift contribution as processed (a failed mail is sent again on the next run)
+        if confirm_sent():
+            gc.invitation_sent = True
+            gc.save()
 
 
 
 # -------------------------------------------------------------
 # Sends mail in a timeframe before gift search expires to all active users (except donee)
 # -------------------------------------------------------------
+@single_run('gift_search_reminder')
+@mail_dispatch('gift_search_reminder')
 def gift_search_reminder():
     now = timezone.localtime(timezone.now())
     print("Gift search reminder job runs at", now)
@@ -438,16 +481,14 @@ def gift_search_reminder():
 
     for gs in gift_searches:
         # Get proposals for this gift search
-        gs_query = GiftProposal.objects.filter(gift_search=gs)
-        if gs_query.exists():
-            proposals = list(gs_query)
-            # Sort the list 
-            sorted_proposals = sorted(proposals, key=lambda proposal: proposal.votes.count(), reverse=True)
+        # Proposals sorted by vote count (counted in the same query)
+        sorted_proposals = list(GiftProposal.objects.filter(gift_search=gs).ranked())
+        if sorted_proposals:
             rank = 0
             proposals_summary = ""
             for proposal in sorted_proposals:
                 rank += 1
-                proposals_summary += f"{rank}. {proposal.title}: {proposal.votes.count()} votes\n"
+                proposals_summary += f"{rank}. {proposal.title}: {proposal.vote_count} votes\n"
 
         # Construct link to view gift search details
         gift_url = site_url + reverse("gift_search_detail", args=[gs.id])
@@ -470,17 +511,21 @@ def gift_search_reminder():
                 "Best regards,\n"
                 "Your 21 Celebrations System"
             )
-            send_mail(subject, message, settings.EMAIL_HOST_USER, [profile.user.email])
+            send_mail(subject, message, settings.EMAIL_HOST_USER, [profile.user.email],
+                      idempotency_key=f"gift_search_reminder:{gs.pk}:{profile.pk}")
         
-        # Mark this gift search as processed again
-        gs.reminder_sent = True
-        gs.save()
+        # Mark this gift search as processed again (a failed mail is sent again on the next run)
+        if confirm_sent():
+            gs.reminder_sent = True
+            gs.save()
 
 
 
 # -------------------------------------------------------------
 # Sends mail in a timeframe before gift contribution expires to all active users (except donee)
 # -------------------------------------------------------------
+@single_run('gift_contribution_reminder')
+@mail_dispatch('gift_contribution_reminder')
 def gift_contribution_reminder():
     now = timezone.localtime(timezone.now())
     print("Gift contribution reminder job runs at", now)
@@ -545,17 +590,22 @@ def gift_contribution_reminder():
                 "Best regards,\n"
                 "Your 21 Celebrations System"
             )
-            send_mail(subject, message, settings.EMAIL_HOST_USER, [profile.user.email])
+            send_mail(subject, message, settings.EMAIL_HOST_USER, [profile.user.email],
+                      idempotency_key=f"gift_contribution_reminder:{gc.pk}:{profile.pk}")
         
-        # Mark this gift search as processed again
-        gc.reminder_sent = True
-        gc.save()
+        # Mark this gift search as processed again (a failed mail is sent again on the next run)
+        if confirm_sent():
+            gc.reminder_sent = True
+            gc.save()
 
 
 
 # -------------------------------------------------------------
 # Sends mail with announcement of winner and winning gift proposal (except donee)
 # -------------------------------------------------------------
+@single_run('gift_search_results')
+@mail_dispatch('gift_search_results')
+@score_batch()
 def gift_search_results():
     now = timezone.localtime(timezone.now())
     print("Gift results job runs at" , now)
@@ -575,20 +625,15 @@ def gift_search_results():
     # Construct link to view closed searches
     gift_url = site_url + reverse("closed_gift_list")
 
-    for gs in gift_searches:
-        # Get top 3 proposals ordered by vote count
-        gs_query = GiftProposal.objects.filter(gift_search=gs)
-        if gs_query.exists():
-            proposals = list(gs_query)
-           # Sort the list 
-            sorted_proposals = sorted(proposals, key=lambda proposal: proposal.votes.count(), reverse=True)
+    for gs in gift_searches.select_related('leading_proposal'):
+        # Winner and top 3 proposals from the vote tallies
+        winner_proposal = gs.leading_proposal
+        if winner_proposal is not None:
             rank = 0
             proposals_summary = ""
-            for proposal in sorted_proposals[:3]:
+            for proposal in gs.ranked_proposals()[:3]:
                 rank += 1
-                proposals_summary += f"{rank}. {proposal.title}: {proposal.votes.count()} votes\n"
-                if rank == 1:
-                    winner_proposal = proposal
+                proposals_summary += f"{rank}. {proposal.title}: {proposal.vote_tally} votes\n"
         else:
             # No proposals found
             gs.final_results_sent = True
@@ -599,16 +644,13 @@ def gift_search_results():
         active_users = UserProfile.objects.filter(is_inactive=False).exclude(pk=gs.donee.pk)
 
         for profile in active_users:
-            # Check if user is proposer for top proposals
+            # Check if user is proposer of the winning proposal
             user_message = ""
-            for proposal in proposals:
-                if proposal.proposed_by == profile and proposal == winner_proposal:
-                    # Get points awarded from role configuration
-                    config = GiftConfiguration.objects.filter(role='winner').first()
-                    points_awarded = config.points if config else 0
-                    user_message = (f"Congratulations! Your proposal '{proposal.title}' received {proposal.votes.count()} votes "
-                                        f"and you were awarded {points_awarded} points.\n")
-                    break
+            if winner_proposal.proposed_by_id == profile.pk:
+                # Get points awarded from the points registry
+                points_awarded = get_gift_points('winner')
+                user_message = (f"Congratulations! Your proposal '{winner_proposal.title}' received {gs.leading_vote_count} votes "
+                                    f"and you were awarded {points_awarded} points.\n")
 
             # Check if user has voted for proposals
             aggregate = GiftScoreHistory.objects.filter(user_profile=profile, score_type='vote').aggregate(total=Sum('points_change'))
@@ -634,68 +676,79 @@ def gift_search_results():
                 "Your 21 Celebrations System\n\n"
             )
             # Send email
-            send_mail(subject, message, settings.EMAIL_HOST_USER, [profile.user.email])
+            send_mail(subject, message, settings.EMAIL_HOST_USER, [profile.user.email],
+                      idempotency_key=f"gift_search_results:{gs.pk}:{profile.pk}")
         
-        # Mark gift search as processed
-        gs.final_results_sent = True
-        gs.save()
+        # Mark gift search as processed (a failed mail is sent again on the next run)
+        if confirm_sent():
+            gs.final_results_sent = True
+            gs.save()
 
 
 
 # -------------------------------------------------------------
 # Stores user's scores once a day in the score history
 # -------------------------------------------------------------
+@single_run('store_user_scores')
 def store_user_scores():
     now = timezone.localtime(timezone.now())
     print("PastScore job runs at" , now)
+    started = time.monotonic()
     today = timezone.now().date()
     config = JOB_CONFIG['store_user_scores']
 
-    # Iterate over all user profiles
-    for profile in UserProfile.objects.all():
-        # Store today's scores in PastUserScores
-        try:
-            past_score = PastUserScores.objects.get(user=profile.user, score_date=today)
-            # Update with current scores
-            past_score.total_score = profile.total_score
-            past_score.task_score = profile.task_score
-            past_score.role_score = profile.role_score
-            past_score.gift_score = profile.gift_score
-            past_score.payment_score = profile.payment_score
-            past_score.save()
-        except PastUserScores.DoesNotExist:
-            # Create record for today if it doesn't exist
-            PastUserScores.objects.create(
-                user=profile.user,
-                score_date=today,
-                total_score=profile.total_score,
-                task_score=profile.task_score,
-                role_score=profile.role_score,
-                gift_score=profile.gift_score,
-                payment_score=profile.payment_score,
-            )
+    score_fields = ['total_score', 'task_score', 'role_score', 'gift_score', 'payment_score']
+    past_fields = ['task_score_past', 'role_score_past', 'gift_score_past', 'payment_score_past']
+
+    # Use configured interval in days
+    rank_interval = config.get('rank_change_interval', 30)
+    days_ago = today - timedelta(days=rank_interval)
+
+    # Fetch records from X days ago for all users at once: user id -> (task, role, gift, payment score)
+    past_records = {
+        user_id: scores
+        for user_id, *scores in PastUserScores.objects.filter(score_date=days_ago)
+        .values_list('user', 'task_score', 'role_score', 'gift_score', 'payment_score')
+    }
+
+    stored = 0
+    updated = 0
+    profiles = list(UserProfile.objects.order_by('pk').values_list('pk', 'user', *score_fields))
+    for start in range(0, len(profiles), STORE_SCORES_CHUNK_SIZE):
+        chunk = profiles[start:start + STORE_SCORES_CHUNK_SIZE]
+        # Store today's scores in PastUserScores (insert or update the record of today in one query)
+        PastUserScores.objects.bulk_create(
+            [PastUserScores(user_id=user_id, score_date=today, **dict(zip(score_fields, scores))) for _, user_id, *scores in chunk],
+            update_conflicts=True,
+            unique_fields=['user', 'score_date'],
+            update_fields=score_fields,
+        )
+        stored += len(chunk)
+
+        # Write scores from X days ago into the _past fields of profile (total is set here, bulk_update sends no pre_save signal)
+        past_profiles = []
+        for profile_id, user_id, *_ in chunk:
+            past_scores = past_records.get(user_id)
+            if past_scores is None:
+                # If no record is found, do nothing
+                continue
+            profile = UserProfile(pk=profile_id, **dict(zip(past_fields, past_scores)))
+            profile.total_score_past = sum(score or 0 for score in past_scores)
+            past_profiles.append(profile)
+        UserProfile.objects.bulk_update(past_profiles, past_fields + ['total_score_past'])
+        updated += len(past_profiles)
 
-        # Use configured interval in days
-        rank_interval = config.get('rank_change_interval', 30)
-        # Update UserProfile past fields using record from X days ago
-        days_ago = today - timedelta(days=rank_interval)
-        try:
-            past_record = PastUserScores.objects.get(user=profile.user, score_date=days_ago)
-            # Write scores into the _past fields of profile
-            profile.task_score_past = past_record.task_score
-            profile.role_score_past = past_record.role_score
-            profile.gift_score_past = past_record.gift_score
-            profile.payment_score_past = past_record.payment_score
-            profile.save()
-        except PastUserScores.DoesNotExist:
-            # If no record is found, do nothing
-            pass
+    # Scores and past scores have changed, cached leaderboards are outdated
+    bump_scores_version()
+    print(f"PastScore job stored {stored} scores and updated {updated} past scores in {time.monotonic() - started:.2f}s")
 
 
 
 # -------------------------------------------------------------
 # Creates birthday event when number of honorees is reached and sends email
 # -------------------------------------------------------------
+@single_run('create_birthday_event')
+@mail_dispatch('create_birthday_event')
 def create_birthday_event():
     now = timezone.localtime(timezone.now())
     print("Birtday job runs at" , now)
@@ -837,13 +890,16 @@ def create_birthday_event():
                 "Best regards,\n"
                 "Your 21 Celebrations System\n\n"
             )
-        send_mail(subject, message, settings.EMAIL_HOST_USER, [recipient_email])
+        send_mail(subject, message, settings.EMAIL_HOST_USER, [recipient_email],
+                  idempotency_key=f"create_birthday_event:{event.pk}:{profile.pk}")
 
 
 
 # -------------------------------------------------------------
 # Creates gift search event when user has a round birthday and sends email
 # -------------------------------------------------------------
+@single_run('create_round_birthday_gift_search')
+@mail_dispatch('create_round_birthday_gift_search')
 def create_round_birthday_gift_search():
     now = timezone.localtime(timezone.now())
     print("Gift search job runs at" , now)
@@ -904,16 +960,13 @@ def create_round_birthday_gift_search():
                 gift_url = site_url + reverse("gift_search_detail", args=[gs.id])
 
                 # Get points for proposal
-                config_proposer = GiftConfiguration.objects.filter(role='proposer').first()
-                points_proposer = config_proposer.points if config_proposer else 0
+                points_proposer = get_gift_points('proposer')
 
                 # Get points for voting
-                config_voter = GiftConfiguration.objects.filter(role='voter').first()
-                points_voter = config_voter.points if config_voter else 0
+                points_voter = get_gift_points('voter')
 
                 # Get points for winning
-                config_winner = GiftConfiguration.objects.filter(role='winner').first()
-                points_winner = config_winner.points if config_winner else 0
+                points_winner = get_gift_points('winner')
 
                 # Build points details message
                 points_message = (
@@ -942,13 +995,15 @@ def create_round_birthday_gift_search():
                 for recipient in recipients:
                     # Replace placeholder with recipient's username
                     message = base_message.replace("{username}", recipient.user.username)
-                    send_mail(subject, message, settings.EMAIL_HOST_USER, [recipient.user.email])
+                    send_mail(subject, message, settings.EMAIL_HOST_USER, [recipient.user.email],
+                              idempotency_key=f"create_round_birthday_gift_search:{gs.pk}:{recipient.pk}")
 
 
 
 # -------------------------------------------------------------
 # Sends mail with payment information to all user who spent money or pay for expenditures for event  (triggered from billing)
 # -------------------------------------------------------------
+@mail_dispatch('send_billing_email')
 def send_billing_email(user, event, task_payers, honoree_share, transactions):
     # Gather all user profile IDs from passed data
     user_ids = set()
@@ -1028,13 +1083,16 @@ def send_billing_email(user, event, task_payers, honoree_share, transactions):
             username = user_map[uid]['username']
             email = user_map[uid]['email']
             personalized_message = message.replace("{username}", username)
-            send_mail(subject, personalized_message, settings.EMAIL_HOST_USER, [email])
+            send_mail(subject, personalized_message, settings.EMAIL_HOST_USER, [email],
+                      idempotency_key=f"send_billing_email:{event.pk}:{uid}")
     
 
 
 # -------------------------------------------------------------
 # Sends mail with payment information to all user who contributed to gift contribution
 # -------------------------------------------------------------
+@mail_dispatch('send_gift_contribution_billing_email')
+@score_batch()
 def send_gift_contribution_billing_email():
     # Get closed gift contributions
     closed_gift_contributions = GiftContribution.objects.filter(status="closed")
@@ -1101,13 +1159,17 @@ def send_gift_contribution_billing_email():
                 "Your 21 Celebrations System\n\n"
             )
             subject = f"Billing Summary for Gift Contribution '{gc.title}'"
-            send_mail(subject, message, settings.EMAIL_HOST_USER, [recipient.user.email])
+            # (every closed contribution is billed once, even if the job sees it again)
+            send_mail(subject, message, settings.EMAIL_HOST_USER, [recipient.user.email],
+                      idempotency_key=f"send_gift_contribution_billing_email:{gc.pk}:{recipient.pk}")
 
 
 
 # -------------------------------------------------------------
 # Sends reminder mail for payments/transactions that are overdue
 # -------------------------------------------------------------
+@single_run('check_payment_reminder')
+@mail_dispatch('check_payment_reminder')
 def check_payment_reminder():
     now = timezone.localtime(timezone.now())
     print("Payment reminder job runs at" , now)
@@ -1161,65 +1223,117 @@ def check_payment_reminder():
             "Your 21 Celebrations System"
         )
         
-        send_mail(subject, message, settings.EMAIL_HOST_USER, [recipient.user.email])
+        # One reminder per transaction, status and day
+        send_mail(subject, message, settings.EMAIL_HOST_USER, [recipient.user.email],
+                  idempotency_key=f"check_payment_reminder:{transaction.pk}:{transaction.status}:{now.date().isoformat()}")
+
+
+
+# -------------------------------------------------------------
+# Sends the collected notifications of a closed digest window as one email per user
+# (while the digest is disabled, all collected notifications are sent at once)
+# -------------------------------------------------------------
+@single_run('send_digest_emails')
+@mail_dispatch('send_digest_emails')
+def send_digest_emails():
+    now = timezone.localtime(timezone.now())
+    print("Digest job runs at" , now)
+
+    # Notifications created before the start of the current window are sent
+    config = JOB_CONFIG['send_digest_emails']
+    notifications = DigestNotification.objects.all()
+    if config.get('enabled'):
+        if config.get('window', 'daily') == 'hourly':
+            window_start = now.replace(minute=0, second=0, microsecond=0)
+        else:
+            window_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        notifications = notifications.filter(created_at__lt=window_start)
+
+    notifications = list(notifications.order_by('recipient', 'created_at', 'pk'))
+    if not notifications:
+        return
+
+    sent = []
+    for recipient, entries in groupby(notifications, key=attrgetter('recipient')):
+        entries = list(entries)
+        last_pk = max(entry.pk for entry in entries)
+        if len(entries) == 1:
+            # A single notification is sent unchanged
+            subject, message = entries[0].subject, entries[0].body
+        else:
+            subject = f"Your 21 Celebrations digest: {len(entries)} notifications"
+            message = f"You have {len(entries)} new notifications.\n\n" + "\n\n".join(
+                f"--- {entry.subject} ---\n\n{entry.body}" for entry in entries
+            )
+        # Notifications of a failed send are kept for the next run (a rerun finds a queued digest by its key)
+        if deliver_message(EmailMessage(subject, message, settings.EMAIL_HOST_USER, [recipient]),
+                           idempotency_key=f"send_digest_emails:{recipient}:{last_pk}"):
+            sent.extend(entry.pk for entry in entries)
+
+    # Remove the sent notifications with one query
+    DigestNotification.objects.filter(pk__in=sent).delete()
+    print(f"{len(sent)} of {len(notifications)} notifications sent as digest")
+
+
+
+# -------------------------------------------------------------
+# Status transitions of events (later stages first, so an event moves at most one step per run)
+# -------------------------------------------------------------
+def event_status_transitions(today):
+    event_transactions = Transaction.objects.filter(event=OuterRef('pk'))
+    return [
+        # 'billed' → 'paid': when all transactions for event are confirmed
+        StatusTransition(Event, 'billed', 'paid',
+                         Exists(event_transactions) & ~Exists(event_transactions.exclude(status='confirmed'))),
+        # 'active' → 'completed': when event date is in past
+        StatusTransition(Event, 'active', 'completed', Q(date__lt=today)),
+        # 'planned' → 'active': when date, time, and location are set
+        StatusTransition(Event, 'planned', 'active',
+                         Q(date__isnull=False, time__isnull=False, location__isnull=False) & ~Q(location='')),
+    ]
 
 
 
 # -------------------------------------------------------------
 # Checks events and sets status automatically to 'active', 'completed', 'paid'
 # -------------------------------------------------------------
+@single_run('update_event_status')
+@score_batch()
 def update_event_status():
-    # 'planned' → 'active': when date, time, and location are set
-    # 'active' → 'completed': when  event date is in past
-    # 'billed' → 'paid': when all transactions for event are confirmed
-
+    started = time.monotonic()
     now = timezone.localtime(timezone.now())
     print("Update event status job runs at" , now)
-    today = now.date()
-    
-    # Process only events that are not canceled
-    events = Event.objects.exclude(status='canceled')
-    
-    for event in events:
-        if event.status == 'planned':
-            # Check if date, time, and location are set
-            if event.date and event.time and event.location:
-                event.status = 'active'
-                event.save()
-        
-        elif event.status == 'active':
-            # If event date is before today, mark it as completed
-            if event.date < today:
-                event.status = 'completed'
-                event.save()
-        
-        elif event.status == 'billed':
-            # Check if all associated transactions are confirmed
-            transactions = Transaction.objects.filter(event=event)
-            if transactions.exists():
-                if all(t.status == 'confirmed' for t in transactions):
-                    event.status = 'paid'
-                    event.save()
+
+    # One UPDATE per transition (canceled events have no transition)
+    counts = run_transitions(event_status_transitions(now.date()))
+    print(f"Event status transitions: {format_transition_counts(counts)} in {time.monotonic() - started:.2f}s")
 
 
 
 # -------------------------------------------------------------
 # Checks gift contributions and sets status automatically to 'closed' after deadline
 # -------------------------------------------------------------
+@single_run('update_contribution_status')
+@score_batch()
 def update_contribution_status():
-    # 'XXX' → 'closed': when deadline has passed
-
+    started = time.monotonic()
     now = timezone.localtime(timezone.now())
     print("Update contribution status job runs at" , now)
-    today = now.date()
-    
-    # Process only contributions that have reached deadline
-    contributions = GiftContribution.objects.filter(deadline__lte=today)
-    print(contributions)
-    for contribution in contributions:
-        if contribution.status == 'open':
-            contribution.status = "closed"
-            contribution.save()
-            # Call billing email
-            send_gift_contribution_billing_email()
 
+    # 'open' → 'closed': when deadline has passed (post_save creates the transactions of each closed contribution)
+    counts = run_transitions([
+        StatusTransition(GiftContribution, 'open', 'closed', Q(deadline__lte=now.date()), send_signals=True),
+    ])
+    print(f"Contribution status transitions: {format_transition_counts(counts)} in {time.monotonic() - started:.2f}s")
+
+    # Call billing email once for the closed contributions
+    if counts[('open', 'closed')]:
+        send_gift_contribution_billing_email()
+
+
+
+# -------------------------------------------------------------
+# Helper function to format the transitioned counts of a job run
+# -------------------------------------------------------------
+def format_transition_counts(counts):
+    return ", ".join(f"{source} → {target}: {count}" for (source, target), count in counts.items())
@@ -0,0 +1,380 @@
+import time
+import base64
+import logging
+from contextlib import ContextDecorator
+from datetime import timedelta
+from functools import partial
+from uuid import uuid4
+from asgiref.local import Local
+from django.conf import settings
+from django.core.mail import EmailMessage, EmailMultiAlternatives, get_connection
+from django.db.models import F
+from django.utils import timezone
+from .job_config import JOB_CONFIG
+from .models import EmailOutbox, DigestNotification
+from .job_runs import count_job_metric
+
+
+
+logger = logging.getLogger(__name__)
+
+# State of the active mail dispatch (per thread / async context)
+_dispatch_state = Local()
+
+
+
+# -------------------------------------------------------------
+# Helper functions to read the dispatch settings (messages per batch, messages per second (0 is unlimited), reconnects per message)
+# -------------------------------------------------------------
+def get_batch_size():
+    return getattr(settings, 'MAIL_BATCH_SIZE', 50)
+
+
+def get_rate_limit():
+    return getattr(settings, 'MAIL_RATE_LIMIT', 0)
+
+
+def get_max_retries():
+    return getattr(settings, 'MAIL_MAX_RETRIES', 1)
+
+
+
+# -------------------------------------------------------------
+# Helper functions to read the outbox settings (enqueue instead of sending, attempts per email, backoff and lease of a worker in seconds)
+# -------------------------------------------------------------
+def outbox_enabled():
+    return getattr(settings, 'MAIL_USE_OUTBOX', False)
+
+
+def get_outbox_max_attempts():
+    return getattr(settings, 'MAIL_OUTBOX_MAX_ATTEMPTS', 5)
+
+
+def get_outbox_backoff():
+    return getattr(settings, 'MAIL_OUTBOX_BACKOFF', 60)
+
+
+def get_outbox_lease():
+    return getattr(settings, 'MAIL_OUTBOX_LEASE', 300)
+
+
+
+# -------------------------------------------------------------
+# Sends queued messages in batches through one reused connection, builds messages lazily and reports the throughput
+# -------------------------------------------------------------
+class MailDispatcher:
+    def __init__(self, name, batch_size=None, rate_limit=None, max_retries=None):
+        self.name = name
+        self.batch_size = batch_size or get_batch_size()
+        self.rate_limit = get_rate_limit() if rate_limit is None else rate_limit
+        self.max_retries = get_max_retries() if max_retries is None else max_retries
+        self.connection = None
+        self.queue = []
+        self.sent = 0
+        self.failed = 0
+        self.unconfirmed_failures = 0
+        self.started = None
+        self.last_error = ''
+
+    def add(self, build):
+        # A message or a callable which builds the message when its batch is sent
+        self.queue.append(build)
+        if len(self.queue) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        batch, self.queue = self.queue, []
+        for build in batch:
+            self.deliver(build() if callable(build) else build)
+
+    def deliver(self, message):
+        # Sends one message through the shared connection and counts the result
+        if self.started is None:
+            self.started = time.monotonic()
+        self.wait_for_rate_limit()
+        if self.send(message):
+            self.sent += 1
+            count_job_metric('emails_sent')
+            return True
+        self.failed += 1
+        self.unconfirmed_failures += 1
+        count_job_metric('emails_failed')
+        return False
+
+    def send(self, message):
+        # Messages of a batch share the connection, on failure (also when connecting) the connection is reopened and the message sent again
+        for attempt in range(self.max_retries + 1):
+            try:
+                if self.connection is None:
+                    self.connection = get_connection(fail_silently=False)
+                    self.connection.open()
+                message.connection = self.connection
+                self.connection.send_messages([message])
+                return True
+            except Exception as error:
+                logger.warning("%s: sending mail to %s failed (attempt %s): %s", self.name, message.to, attempt + 1, error)
+                self.last_error = str(error)
+                self.reconnect()
+        return False
+
+    def reconnect(self):
+        # The connection is opened again by the next attempt
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+        self.connection = None
+
+    def wait_for_rate_limit(self):
+        if not self.rate_limit:
+            return
+        # Earliest time of the next message at the configured messages per second
+        next_send = self.started + (self.sent + self.failed) / self.rate_limit
+        delay = next_send - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def confirm(self):
+        # Sends the queued messages and returns if all messages since the last confirmation were delivered
+        self.flush()
+        failures, self.unconfirmed_failures = self.unconfirmed_failures, 0
+        return not failures
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+        self.report()
+
+    def report(self):
+        if self.started is None:
+            return
+        duration = time.monotonic() - self.started
+        throughput = (self.sent + self.failed) / duration if duration else 0
+        logger.info("%s: %s mails sent, %s failed in %.2fs (%.1f mails/sec)", self.name, self.sent, self.failed, duration, throughput)
+
+
+
+# -------------------------------------------------------------
+# Returns the dispatcher of the active mail dispatch (None outside of a dispatch)
+# -------------------------------------------------------------
+def _active_dispatcher():
+    return getattr(_dispatch_state, 'dispatcher', None)
+
+
+
+# -------------------------------------------------------------
+# Context manager / decorator which collects the mails of a job run and sends them with one dispatcher (nested dispatches join the outermost one)
+# -------------------------------------------------------------
+class mail_dispatch(ContextDecorator):
+    def __init__(self, name, **options):
+        self.name = name
+        self.options = options
+
+    def __enter__(self):
+        if _active_dispatcher() is None:
+            _dispatch_state.dispatcher = MailDispatcher(self.name, **self.options)
+            _dispatch_state.depth = 0
+        _dispatch_state.depth += 1
+        return _active_dispatcher()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _dispatch_state.depth -= 1
+        if _dispatch_state.depth == 0:
+            dispatcher = _dispatch_state.dispatcher
+            _dispatch_state.dispatcher = None
+            dispatcher.close()
+        return False
+
+
+
+# -------------------------------------------------------------
+# Helper functions which store an attachment as JSON list [filename, content, mimetype, encoding] (binary content as base64)
+# -------------------------------------------------------------
+def encode_attachment(filename, content, mimetype):
+    if isinstance(content, bytes):
+        return [filename, base64.b64encode(content).decode('ascii'), mimetype, 'base64']
+    return [filename, content, mimetype, 'text']
+
+
+def decode_attachment(filename, content, mimetype, encoding='text'):
+    # Entries enqueued before the encoding was stored have three elements (text content)
+    if encoding == 'base64':
+        content = base64.b64decode(content)
+    return filename, content, mimetype
+
+
+
+# -------------------------------------------------------------
+# Writes a message to the email outbox with one INSERT (inside the transaction of the caller, an existing idempotency key is skipped)
+# -------------------------------------------------------------
+def enqueue_message(message, idempotency_key=None):
+    html_body = next((content for content, mimetype in getattr(message, 'alternatives', []) if mimetype == 'text/html'), '')
+    attachments = [encode_attachment(*attachment) for attachment in message.attachments]
+    EmailOutbox.objects.bulk_create([EmailOutbox(
+        idempotency_key=idempotency_key or uuid4().hex,
+        subject=message.subject,
+        body=message.body,
+        html_body=html_body,
+        from_email=message.from_email,
+        to=list(message.to),
+        attachments=attachments,
+    )], ignore_conflicts=True)
+    count_job_metric('emails_queued')
+
+
+
+# -------------------------------------------------------------
+# Builds the message of an outbox entry
+# -------------------------------------------------------------
+def build_outbox_message(entry):
+    message = EmailMultiAlternatives(entry.subject, entry.body, entry.from_email, entry.to)
+    if entry.html_body:
+        message.attach_alternative(entry.html_body, "text/html")
+    for attachment in entry.attachments:
+        message.attach(*decode_attachment(*attachment))
+    return message
+
+
+
+# -------------------------------------------------------------
+# Claims due outbox entries for one worker (the lease makes them invisible to other workers until it expires)
+# -------------------------------------------------------------
+def claim_outbox_entries(limit):
+    now = timezone.now()
+    lease_until = now + timedelta(seconds=get_outbox_lease())
+    candidates = EmailOutbox.objects.filter(status='pending', next_attempt_at__lte=now).order_by('next_attempt_at', 'pk')[:limit]
+    claimed = []
+    for entry in candidates:
+        # Conditional update: only one worker wins an entry
+        if EmailOutbox.objects.filter(pk=entry.pk, status='pending', attempts=entry.attempts).update(
+                attempts=F('attempts') + 1, next_attempt_at=lease_until):
+            entry.attempts += 1
+            claimed.append(entry)
+    return claimed
+
+
+
+# -------------------------------------------------------------
+# Sends an outbox entry and stores the result (failed entries are retried with exponential backoff)
+# -------------------------------------------------------------
+def deliver_outbox_entry(dispatcher, entry):
+    if dispatcher.deliver(build_outbox_message(entry)):
+        EmailOutbox.objects.filter(pk=entry.pk).update(status='sent', sent_at=timezone.now(), last_error='')
+        return True
+    if entry.attempts >= get_outbox_max_attempts():
+        EmailOutbox.objects.filter(pk=entry.pk).update(status='failed', last_error=dispatcher.last_error)
+    else:
+        delay = get_outbox_backoff() * 2 ** (entry.attempts - 1)
+        EmailOutbox.objects.filter(pk=entry.pk).update(
+            next_attempt_at=timezone.now() + timedelta(seconds=delay), last_error=dispatcher.last_error)
+    return False
+
+
+
+# -------------------------------------------------------------
+# Sends all due outbox entries through one dispatcher and returns the number of processed entries
+# -------------------------------------------------------------
+def drain_outbox(name='send_outbox', batch_size=None):
+    dispatcher = MailDispatcher(name, batch_size=batch_size)
+    processed = 0
+    try:
+        while True:
+            entries = claim_outbox_entries(dispatcher.batch_size)
+            if not entries:
+                break
+            for entry in entries:
+                deliver_outbox_entry(dispatcher, entry)
+            processed += len(entries)
+    finally:
+        dispatcher.close()
+    return processed
+
+
+
+# -------------------------------------------------------------
+# Helper function to check if the notifications of a job are collected for the digest (configured in JOB_CONFIG)
+# -------------------------------------------------------------
+def digest_enabled(job_name):
+    config = JOB_CONFIG.get('send_digest_emails', {})
+    return config.get('enabled', False) and job_name in config.get('jobs', [])
+
+
+
+# -------------------------------------------------------------
+# Stores a plain text message for the digest of its recipients (messages with HTML or attachments are sent on their own)
+# -------------------------------------------------------------
+def collect_for_digest(message, job_name):
+    if message.attachments or getattr(message, 'alternatives', None):
+        return False
+    DigestNotification.objects.bulk_create([
+        DigestNotification(recipient=recipient, job=job_name, subject=message.subject, body=message.body)
+        for recipient in message.to
+    ])
+    count_job_metric('emails_queued')
+    return True
+
+
+
+# -------------------------------------------------------------
+# Sends a message through the digest or the outbox if enabled, otherwise through the active dispatch (sent immediately outside of a dispatch)
+# -------------------------------------------------------------
+def send_message(build, idempotency_key=None):
+    # Notifications of digest jobs are collected instead of sent
+    dispatcher = _active_dispatcher()
+    if dispatcher is not None and digest_enabled(dispatcher.name):
+        build = build() if callable(build) else build
+        if collect_for_digest(build, dispatcher.name):
+            return 1
+    if outbox_enabled():
+        enqueue_message(build() if callable(build) else build, idempotency_key)
+        return 1
+    if dispatcher is None:
+        message = build() if callable(build) else build
+        sent = message.send()
+        count_job_metric('emails_sent', sent)
+        return sent
+    dispatcher.add(build)
+    return 1
+
+
+
+# -------------------------------------------------------------
+# Sends the queued messages of the active dispatch and returns if every message since the last confirmation was delivered
+# (collected for the digest or written to the outbox counts as delivered, outside of a dispatch a failed send raises)
+# -------------------------------------------------------------
+def confirm_sent():
+    dispatcher = _active_dispatcher()
+    return dispatcher is None or dispatcher.confirm()
+
+
+
+# -------------------------------------------------------------
+# Replacement of django.core.mail.send_mail which sends through the outbox or the active dispatch
+# -------------------------------------------------------------
+def send_mail(subject, message, from_email, recipient_list, idempotency_key=None):
+    return send_message(partial(EmailMessage, subject, message, from_email, recipient_list), idempotency_key)
+
+
+
+# -------------------------------------------------------------
+# Sends a message at once (or writes it to the outbox if enabled) and returns if it was accepted
+# (for callers which remove their own records only after a successful send, the digest is bypassed)
+# -------------------------------------------------------------
+def deliver_message(build, idempotency_key=None):
+    message = build() if callable(build) else build
+    if outbox_enabled():
+        enqueue_message(message, idempotency_key)
+        return True
+    dispatcher = _active_dispatcher()
+    if dispatcher is not None:
+        return dispatcher.deliver(message)
+    dispatcher = MailDispatcher('deliver_message')
+    try:
+        return dispatcher.deliver(message)
+    finally:
+        dispatcher.close()
@@ -0,0 +1,44 @@
+import time
+from datetime import date, time as event_time
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+from django.utils.html import strip_tags
+from event_planner.models import Event
+from event_planner.notifications import INVITATION_EMAIL
+
+
+
+# -------------------------------------------------------------
+# Command which measures the per-recipient render cost of the invitation email (full rendering vs. prepared notification)
+# -------------------------------------------------------------
+class Command(BaseCommand):
+    help = "Compares the per-recipient render cost of the invitation email with and without prepared notification templates."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, default=1000, help="Number of rendered recipients per variant.")
+
+    def handle(self, *args, **options):
+        recipients = max(options['recipients'], 1)
+        # Unsaved event, no database access is needed for rendering
+        event = Event(title="Benchmark Event", date=date(2025, 6, 21), time=event_time(18, 0), location="Town Hall")
+        shared = {'event': event, 'attendance_points': 10, 'attend_url': "http://127.0.0.1:8000/attend/1/"}
+        ranking_message = "By attending, you'll overtake someone on the leaderboard."
+
+        # Full rendering of the template and strip_tags for every recipient
+        started = time.perf_counter()
+        for index in range(recipients):
+            context = dict(shared, recipient={'username': f"user{index}", 'ranking_message': ranking_message})
+            html = render_to_string("email/invitation_email.html", context)
+            strip_tags(html)
+        full = (time.perf_counter() - started) / recipients
+
+        # Shared part rendered once, only recipient fields substituted
+        started = time.perf_counter()
+        invitation = INVITATION_EMAIL.prepare(**shared)
+        for index in range(recipients):
+            invitation.render(username=f"user{index}", ranking_message=ranking_message)
+        prepared = (time.perf_counter() - started) / recipients
+
+        self.stdout.write(f"Full rendering:     {full * 1e6:.1f} µs per recipient")
+        self.stdout.write(f"Prepared rendering: {prepared * 1e6:.1f} µs per recipient")
+        self.stdout.write(self.style.SUCCESS(f"{recipients} recipients, {full / prepared:.1f}x faster per recipient."))
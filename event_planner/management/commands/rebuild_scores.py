@@ -0,0 +1,122 @@
+import time
+from itertools import islice
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum, Q, Exists, OuterRef
+from django.db.models.functions import Coalesce
+from event_planner.models import UserProfile, ScoreLedger
+from event_planner.score_engine import SCORE_CATEGORIES, bump_scores_version
+
+
+
+# -------------------------------------------------------------
+# Command which recalculates the scores and score ledger of all (or selected) users from the score histories
+# -------------------------------------------------------------
+class Command(BaseCommand):
+    help = "Recalculates task, role, gift, payment and total score and the score ledger of users from the score histories."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', nargs='+', metavar='USERNAME', help="Only rebuild the scores of these users.")
+        parser.add_argument('--dry-run', action='store_true', help="Print the differences without saving them.")
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Number of user profiles loaded and updated per query.")
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        dry_run = options['dry_run']
+        started = time.monotonic()
+
+        profiles = UserProfile.objects.all()
+        if options['users']:
+            profiles = profiles.filter(user__username__in=options['users'])
+
+        # One GROUP BY query per history table: {category: {user profile id: sum of points}}
+        expected = {}
+        for category, (model, points_field, _) in SCORE_CATEGORIES.items():
+            history = model.objects.all()
+            if options['users']:
+                history = history.filter(user_profile__in=profiles)
+            expected[category] = dict(
+                history.values_list('user_profile').annotate(total=Sum(points_field)).order_by().iterator(chunk_size=chunk_size)
+            )
+
+        score_fields = [score_field for _, _, score_field in SCORE_CATEGORIES.values()]
+        update_fields = score_fields + ['total_score']
+        processed = 0
+        changed = []
+        updated = 0
+
+        with transaction.atomic():
+            for profile in profiles.select_related('user').only('pk', 'user__username', *update_fields).order_by('pk').iterator(chunk_size=chunk_size):
+                processed += 1
+                differences = []
+                for category, (_, _, score_field) in SCORE_CATEGORIES.items():
+                    score = expected[category].get(profile.pk) or 0
+                    if getattr(profile, score_field) != score:
+                        differences.append(f"{score_field} {getattr(profile, score_field)} -> {score}")
+                        setattr(profile, score_field, score)
+                total_score = sum(getattr(profile, score_field) for score_field in score_fields)
+                if profile.total_score != total_score:
+                    differences.append(f"total_score {profile.total_score} -> {total_score}")
+                    profile.total_score = total_score
+                if not differences:
+                    continue
+
+                if dry_run:
+                    self.stdout.write(f"{profile.user.username}: {', '.join(differences)}")
+                changed.append(profile)
+                # Write changed profiles in chunks (bulk_update skips the pre_save signal, total score is set above)
+                if len(changed) >= chunk_size:
+                    updated += self.save_profiles(changed, update_fields, dry_run)
+                    changed = []
+            updated += self.save_profiles(changed, update_fields, dry_run)
+            if updated and not dry_run:
+                # bulk_update sends no signals, cached leaderboards are outdated
+                bump_scores_version()
+            # Ledger is repaired in the same transaction, it never disagrees with the rebuilt profiles
+            removed, created = self.rebuild_ledger(profiles, bool(options['users']), chunk_size, dry_run)
+
+        elapsed = time.monotonic() - started
+        rate = processed / elapsed if elapsed else processed
+        action = "would be updated" if dry_run else "updated"
+        self.stdout.write(self.style.SUCCESS(
+            f"{processed} user profiles checked, {updated} {action} in {elapsed:.2f}s ({rate:.0f} rows/sec)."
+        ))
+        ledger_action = "would be" if dry_run else "were"
+        self.stdout.write(f"Score ledger: {removed} stale entries {ledger_action} removed, {created} entries {ledger_action} inserted.")
+
+    def save_profiles(self, profiles, update_fields, dry_run):
+        if profiles and not dry_run:
+            UserProfile.objects.bulk_update(profiles, update_fields)
+        return len(profiles)
+
+    def rebuild_ledger(self, profiles, selected_users, chunk_size, dry_run):
+        # Set based per history table: entries without a matching history record are deleted with one query,
+        # only missing entries are inserted (an unchanged ledger costs one DELETE and one SELECT per table)
+        removed = created = 0
+        for category, (model, points_field, _) in SCORE_CATEGORIES.items():
+            source_type = ContentType.objects.get_for_model(model)
+            history = model.objects.annotate(ledger_points=Coalesce(points_field, 0))
+            entries = ScoreLedger.objects.filter(source_type=source_type)
+            if selected_users:
+                # Entries of the users and of their history records (also records which were moved to them)
+                history = history.filter(user_profile__in=profiles)
+                entries = entries.filter(Q(user_profile__in=profiles) | Q(source_id__in=history.values('pk')))
+            matching = history.filter(pk=OuterRef('source_id'), user_profile=OuterRef('user_profile'),
+                                      ledger_points=OuterRef('points'), timestamp=OuterRef('timestamp'))
+            stale = entries.exclude(Q(category=category) & Exists(matching))
+            removed += stale.count() if dry_run else stale.delete()[0]
+
+            missing = history.exclude(Exists(ScoreLedger.objects.filter(source_type=source_type, source_id=OuterRef('pk'))))
+            if dry_run:
+                # Stale entries would be deleted first and inserted again
+                created += missing.count() + stale.filter(source_id__in=history.values('pk')).count()
+                continue
+            rows = missing.values_list('pk', 'user_profile', 'ledger_points', 'timestamp').order_by('pk').iterator(chunk_size=chunk_size)
+            while batch := list(islice(rows, chunk_size)):
+                created += len(ScoreLedger.objects.bulk_create([
+                    ScoreLedger(source_type=source_type, source_id=source_id, user_profile_id=profile_id,
+                                category=category, points=points, timestamp=timestamp)
+                    for source_id, profile_id, points, timestamp in batch
+                ]))
+        return removed, created
@@ -0,0 +1,27 @@
+import signal
+import threading
+from django.core.management.base import BaseCommand
+from event_planner.scheduler import scheduler, start_scheduler, shutdown_scheduler
+
+
+
+# -------------------------------------------------------------
+# Command which runs the scheduled jobs (one dedicated process next to the web server, stopped with SIGINT or SIGTERM)
+# -------------------------------------------------------------
+class Command(BaseCommand):
+    help = "Runs the scheduled jobs in this process until it receives SIGINT or SIGTERM."
+
+    def handle(self, *args, **options):
+        stopped = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda signum, frame: stopped.set())
+
+        start_scheduler()
+        self.stdout.write(self.style.SUCCESS(f"Scheduler started with {len(scheduler.get_jobs())} jobs."))
+        # Jobs run in the scheduler thread, the main thread waits for the stop signal
+        while not stopped.wait(1):
+            pass
+
+        self.stdout.write("Stopping scheduler, waiting for running jobs...")
+        shutdown_scheduler(wait=True)
+        self.stdout.write(self.style.SUCCESS("Scheduler stopped."))
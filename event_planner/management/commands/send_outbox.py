@@ -0,0 +1,41 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import connection
+from event_planner.mail import drain_outbox
+
+
+
+# -------------------------------------------------------------
+# Command which sends the emails of the outbox (runs as separate worker process next to the web server and the scheduler)
+# -------------------------------------------------------------
+class Command(BaseCommand):
+    help = "Sends pending emails of the outbox with retries and exponential backoff."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Send all due emails and exit instead of polling.")
+        parser.add_argument('--workers', type=int, default=1, help="Number of threads which send emails in parallel (one connection each).")
+        parser.add_argument('--batch-size', type=int, default=None, help="Number of emails claimed per query (default MAIL_BATCH_SIZE).")
+        parser.add_argument('--interval', type=float, default=10, help="Seconds between two polls of the outbox.")
+
+    def handle(self, *args, **options):
+        workers = max(options['workers'], 1)
+        while True:
+            if workers == 1:
+                processed = drain_outbox(batch_size=options['batch_size'])
+            else:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    futures = [executor.submit(self.drain, index, options['batch_size']) for index in range(workers)]
+                    processed = sum(future.result() for future in futures)
+            if processed:
+                self.stdout.write(self.style.SUCCESS(f"{processed} outbox emails processed."))
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+
+    def drain(self, index, batch_size):
+        try:
+            return drain_outbox(name=f"send_outbox[{index}]", batch_size=batch_size)
+        finally:
+            # Each thread has its own database connection
+            connection.close()
@@ -0,0 +1,28 @@
+from .score_engine import score_batch
+from .job_config import refresh_job_config
+
+
+
+# -------------------------------------------------------------
+# Middleware which runs each request in a score batch (scores of a user are recalculated once per request)
+# -------------------------------------------------------------
+class ScoreBatchMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with score_batch():
+            return self.get_response(request)
+
+
+
+# -------------------------------------------------------------
+# Middleware which picks up job settings saved by other processes (the JSON file is checked at most once per interval)
+# -------------------------------------------------------------
+class JobConfigMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        refresh_job_config()
+        return self.get_response(request)
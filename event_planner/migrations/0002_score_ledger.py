@@ -0,0 +1,59 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+# Score histories which are written through to the score ledger: (model name, points field, category)
+SCORE_HISTORIES = [
+    ('TaskScoreHistory', 'points_change', 'task'),
+    ('RoleScoreHistory', 'points_awarded', 'role'),
+    ('GiftScoreHistory', 'points_change', 'gift'),
+    ('PaymentScoreHistory', 'points_awarded', 'payment'),
+]
+
+
+# Copies the existing score histories into the ledger
+def backfill_score_ledger(apps, schema_editor):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    ScoreLedger = apps.get_model('event_planner', 'ScoreLedger')
+
+    for model_name, points_field, category in SCORE_HISTORIES:
+        model = apps.get_model('event_planner', model_name)
+        source_type, _ = ContentType.objects.get_or_create(app_label='event_planner', model=model_name.lower())
+        entries = []
+        for source_id, profile_id, points, timestamp in model.objects.values_list('pk', 'user_profile', points_field, 'timestamp').iterator():
+            entries.append(ScoreLedger(
+                user_profile_id=profile_id, source_type=source_type, source_id=source_id,
+                category=category, points=points or 0, timestamp=timestamp,
+            ))
+        ScoreLedger.objects.bulk_create(entries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('event_planner', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScoreLedger',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_id', models.PositiveIntegerField()),
+                ('category', models.CharField(choices=[('task', 'Task'), ('role', 'Role'), ('gift', 'Gift'), ('payment', 'Payment')], max_length=10)),
+                ('points', models.IntegerField()),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('source_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+                ('user_profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='score_ledger', to='event_planner.userprofile')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user_profile', 'timestamp'], name='event_plann_user_pr_7c107a_idx'), models.Index(fields=['category', 'timestamp'], name='event_plann_categor_821cd9_idx')],
+                'unique_together': {('source_type', 'source_id')},
+            },
+        ),
+        migrations.RunPython(backfill_score_ledger, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Counts the up votes of the existing proposals and determines the leader of each gift search
+def backfill_vote_tallies(apps, schema_editor):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    Vote = apps.get_model('vote', 'Vote')
+    GiftProposal = apps.get_model('event_planner', 'GiftProposal')
+    GiftSearch = apps.get_model('event_planner', 'GiftSearch')
+
+    content_type = ContentType.objects.filter(app_label='event_planner', model='giftproposal').first()
+    tallies = {}
+    if content_type is not None:
+        votes = Vote.objects.filter(content_type=content_type, action=0).values('object_id').annotate(count=models.Count('pk'))
+        tallies = {row['object_id']: row['count'] for row in votes}
+
+    proposals = list(GiftProposal.objects.order_by('gift_search', 'pk'))
+    leaders = {}
+    for proposal in proposals:
+        proposal.vote_tally = tallies.get(proposal.pk, 0)
+        leader = leaders.get(proposal.gift_search_id)
+        if leader is None or proposal.vote_tally > leader.vote_tally:
+            leaders[proposal.gift_search_id] = proposal
+    GiftProposal.objects.bulk_update(proposals, ['vote_tally'], batch_size=1000)
+
+    searches = list(GiftSearch.objects.filter(pk__in=leaders))
+    for search in searches:
+        search.leading_proposal = leaders[search.pk]
+        search.leading_vote_count = leaders[search.pk].vote_tally
+    GiftSearch.objects.bulk_update(searches, ['leading_proposal', 'leading_vote_count'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event_planner', '0004_digest_notification'),
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('vote', '0004_auto_20170110_1150'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='giftproposal',
+            name='vote_tally',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='giftsearch',
+            name='leading_proposal',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='event_planner.giftproposal'),
+        ),
+        migrations.AddField(
+            model_name='giftsearch',
+            name='leading_vote_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='giftproposal',
+            index=models.Index(fields=['gift_search', '-vote_tally', 'id'], name='gift_proposal_ranking_idx'),
+        ),
+        migrations.RunPython(backfill_vote_tallies, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event_planner', '0005_gift_vote_tally'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='event',
+            name='date',
+            field=models.DateField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='giftcontribution',
+            name='deadline',
+            field=models.DateField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='giftsearch',
+            name='deadline',
+            field=models.DateField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='task',
+            name='due_date',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
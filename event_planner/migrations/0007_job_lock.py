@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event_planner', '0006_calendar_date_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobLock',
+            fields=[
+                ('job_id', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('owner', models.CharField(blank=True, max_length=255)),
+                ('acquired_at', models.DateTimeField(blank=True, null=True)),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True)),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+                ('skipped_count', models.PositiveIntegerField(default=0)),
+                ('last_skipped_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event_planner', '0008_job_run'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CacheVersion',
+            fields=[
+                ('key', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('version', models.PositiveBigIntegerField(default=1)),
+                ('modified', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
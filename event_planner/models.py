@@ -1,11 +1,16 @@
+from collections import defaultdict
 from decimal import Decimal
-from django.db import models
+from django.db import models, router, transaction, DatabaseError
 from django.conf import settings
 from django.dispatch import receiver
 from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db.models import Sum
-from vote.models import VoteModel
+from django.db.models import Sum, Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.auth import get_user_model
+from vote.models import UP, Vote, VoteModel
 
 
 
@@ -17,6 +22,82 @@ User = settings.AUTH_USER_MODEL
 
 
 
+# -------------------------------------------------------------
+# Mixin which keeps fields that are maintained with UPDATE queries out of regular saves (a stale instance must not overwrite them)
+# -------------------------------------------------------------
+class DenormalizedFieldsMixin:
+    # Names of the denormalized fields (defined by each model)
+    denormalized_fields = ()
+
+    def save(self, *args, **kwargs):
+        # Deferred denormalized fields are left out by Django itself, update_fields of the caller are kept
+        deferred = self.get_deferred_fields()
+        denormalized = [self._meta.get_field(name).attname for name in self.denormalized_fields]
+        if (self._state.adding or kwargs.get('force_insert') or kwargs.get('update_fields') is not None
+                or all(attname in deferred for attname in denormalized)):
+            return super().save(*args, **kwargs)
+        # Loaded fields only, a save does not fetch deferred fields
+        update_fields = [field.name for field in self._meta.concrete_fields
+                         if not field.primary_key and field.attname not in deferred and field.attname not in denormalized]
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        try:
+            # Inside a transaction the failed UPDATE is rolled back to a savepoint, the transaction stays usable
+            with transaction.atomic(using=using, savepoint=transaction.get_connection(using).in_atomic_block):
+                super().save(*args, update_fields=update_fields, **kwargs)
+        except DatabaseError as error:
+            # Database errors are subclasses, only the UPDATE of a deleted record raises DatabaseError itself
+            if type(error) is not DatabaseError:
+                raise
+            # The deleted record is inserted again like on a regular save
+            super().save(*args, **kwargs)
+
+
+
+# -------------------------------------------------------------
+# Mixin which remembers the values of selected fields as they were loaded from (or last saved to) the database
+# -------------------------------------------------------------
+class TrackedFieldsMixin:
+    # Names of the fields whose original values are kept (defined by each model)
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._store_tracked_values()
+        return instance
+
+    def _store_tracked_values(self):
+        # Deferred fields are not loaded and therefore not tracked
+        tracked_values = {}
+        for field_name in self.tracked_fields:
+            attname = self._meta.get_field(field_name).attname
+            if attname in self.__dict__:
+                tracked_values[field_name] = self.__dict__[attname]
+        self._tracked_values = tracked_values
+
+    def has_original_value(self, field_name):
+        return field_name in getattr(self, '_tracked_values', {})
+
+    def get_original_value(self, field_name, default=None):
+        return getattr(self, '_tracked_values', {}).get(field_name, default)
+
+    def get_original_values(self, *field_names):
+        # Instances which were not loaded from the database fall back to one query (None if the record does not exist)
+        if all(self.has_original_value(field_name) for field_name in field_names):
+            return {field_name: self.get_original_value(field_name) for field_name in field_names}
+        return type(self)._default_manager.filter(pk=self.pk).values(*field_names).first()
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._store_tracked_values()
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Saved values are the reference for the next change
+        self._store_tracked_values()
+
+
+
 # -------------------------------------------------------------
 # Model for extending the user properties
 # -------------------------------------------------------------
@@ -70,7 +151,10 @@ class PastUserScores(models.Model):
 # -------------------------------------------------------------
 # Model with details for an event including status, tracking and participant roles
 # -------------------------------------------------------------
-class Event(models.Model): 
+class Event(TrackedFieldsMixin, models.Model): 
+    # Original values let signals and jobs detect status changes without re-fetching the event
+    tracked_fields = ('status',)
+
     # Define different event types
     EVENT_TYPES = [
         ('birthday', 'Birthday'),
@@ -95,7 +179,7 @@ class Event(models.Model):
     title = models.CharField(max_length=255, null=False, blank=False)
     description = models.TextField(blank=True)
     event_type = models.CharField(max_length=50, choices=EVENT_TYPES, default='other')
-    date = models.DateField(null=True, blank=True)
+    date = models.DateField(null=True, blank=True, db_index=True)
     time = models.TimeField(null=True, blank=True)
     location = models.CharField(max_length=255, blank=True)
     invitation_sent = models.BooleanField(default=False)
@@ -192,7 +276,10 @@ class EventParticipant(models.Model):
 # -------------------------------------------------------------
 # Model which stores history of scores per role of a participant (through EventParticipant)
 # -------------------------------------------------------------
-class RoleScoreHistory(models.Model):
+class RoleScoreHistory(TrackedFieldsMixin, models.Model):
+    # Original values are needed to apply score changes as deltas
+    tracked_fields = ('user_profile', 'points_awarded')
+
     # Define different roles for events
     ROLE_CHOICES = [
         ('organizer', 'Organizer'),
@@ -257,7 +344,10 @@ class TaskTemplate(models.Model):
 # -------------------------------------------------------------
 # Model which associates tasks with an event and users. It can optionally be based on a task template (through TaskTemplate model)
 # -------------------------------------------------------------
-class Task(models.Model):
+class Task(TrackedFieldsMixin, models.Model):
+    # Original values let the pre_save signal detect status changes without re-fetching the task
+    tracked_fields = ('status', 'points_awarded')
+
     # Relations of a task
     event = models.ForeignKey('Event', on_delete=models.CASCADE, related_name='tasks')
     assigned_to = models.ManyToManyField('UserProfile', related_name='tasks', blank=True)
@@ -282,7 +372,7 @@ class Task(models.Model):
     )
 
     # Status tracking of a task
-    due_date = models.DateTimeField(null=True, blank=True)
+    due_date = models.DateTimeField(null=True, blank=True, db_index=True)
     STATUS_CHOICES = [
         ('pending', 'Pending'),
         ('in_progress', 'In Progress'),
@@ -356,7 +446,10 @@ class Task(models.Model):
 # -------------------------------------------------------------
 # Model which stores history of score changes per task and user (through Task and UserProfile)
 # -------------------------------------------------------------
-class TaskScoreHistory(models.Model):
+class TaskScoreHistory(TrackedFieldsMixin, models.Model):
+    # Original values are needed to apply score changes as deltas
+    tracked_fields = ('user_profile', 'points_change')
+
     # Define different score types for events
     SCORE_TYPE_CHOICES = [
         ('task', 'Task'),
@@ -420,11 +513,14 @@ class GiftConfiguration(models.Model):
 # -------------------------------------------------------------
 # Model which stores meta information for gift search
 # -------------------------------------------------------------
-class GiftSearch(models.Model):
+class GiftSearch(DenormalizedFieldsMixin, TrackedFieldsMixin, models.Model):
+    # Original values let the pre_save signal detect the end of the search without re-fetching it
+    tracked_fields = ('final_results_sent',)
+
     title = models.CharField(max_length=50)
     purpose = models.CharField(max_length=255)
     donee = models.ForeignKey('UserProfile', on_delete=models.CASCADE, related_name='gift_searches_received')
-    deadline = models.DateField()
+    deadline = models.DateField(db_index=True)
     created_by = models.ForeignKey('UserProfile', on_delete=models.CASCADE, related_name='gift_searches_created')
     created_at = models.DateTimeField(auto_now_add=True)
     
@@ -433,15 +529,79 @@ class GiftSearch(models.Model):
     reminder_sent = models.BooleanField(default=False) 
     is_auto_generated = models.BooleanField(default=False)  
 
+    # Most voted proposal (ties in order of creation) and its votes, maintained by the vote signals
+    leading_proposal = models.ForeignKey('GiftProposal', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='+')
+    leading_vote_count = models.PositiveIntegerField(default=0, editable=False)
+
+    denormalized_fields = ('leading_proposal', 'leading_vote_count')
+
     def __str__(self):
         return f"{self.title} for {self.donee}"
 
+    def ranked_proposals(self):
+        # Proposals by their vote tallies (most voted first, ties in order of creation)
+        return self.proposals.order_by('-vote_tally', 'pk')
+
+    def refresh_leader(self):
+        leader = self.ranked_proposals().first()
+        self.leading_proposal = leader
+        self.leading_vote_count = leader.vote_tally if leader else 0
+        GiftSearch.objects.filter(pk=self.pk).update(leading_proposal=leader, leading_vote_count=self.leading_vote_count)
+
+
+
+# -------------------------------------------------------------
+# Attaches the sorted usernames of all voters to each proposal (one query for any number of proposals)
+# -------------------------------------------------------------
+def attach_voters(proposals):
+    proposals = list(proposals)
+    if not proposals:
+        return proposals
+    content_type = ContentType.objects.get_for_model(proposals[0])
+    usernames = get_user_model().objects.filter(pk=OuterRef('user_id')).values('username')[:1]
+    votes = (Vote.objects.filter(content_type=content_type, object_id__in=[proposal.pk for proposal in proposals])
+             .annotate(username=Subquery(usernames)).filter(username__isnull=False)
+             .order_by('username').values_list('object_id', 'username').distinct())
+    voters = defaultdict(list)
+    for object_id, username in votes:
+        voters[object_id].append(username)
+    for proposal in proposals:
+        proposal.voters = voters[proposal.pk]
+    return proposals
+
+
+
+# -------------------------------------------------------------
+# Queryset of gift proposals which counts votes in the database instead of per proposal
+# -------------------------------------------------------------
+class GiftProposalQuerySet(models.QuerySet):
+    def _up_votes(self):
+        # Number of up votes of the outer proposal (same as proposal.votes.count())
+        votes = (Vote.objects.filter(content_type=ContentType.objects.get_for_model(self.model), object_id=OuterRef('pk'), action=UP)
+                 .order_by().values('object_id').annotate(count=Count('pk')).values('count'))
+        return Coalesce(Subquery(votes), 0)
+
+    def with_votes(self):
+        return self.annotate(vote_count=self._up_votes())
+
+    def refresh_vote_tallies(self):
+        # Recounts the stored tallies of all proposals in one UPDATE
+        return self.update(vote_tally=self._up_votes())
+
+    def ranked(self):
+        # Most voted first, ties in order of creation
+        return self.with_votes().order_by('-vote_count', 'pk')
+
+    def with_voters(self):
+        # Fetches the proposals with the usernames of their voters as proposal.voters (returns a list, one query for all voters)
+        return attach_voters(self)
+
 
 
 # -------------------------------------------------------------
 # Model which stores proposals for gift searches with voting
 # -------------------------------------------------------------
-class GiftProposal(VoteModel, models.Model):
+class GiftProposal(DenormalizedFieldsMixin, VoteModel, models.Model):
     gift_search = models.ForeignKey(GiftSearch, on_delete=models.CASCADE, related_name='proposals')
     title = models.CharField(max_length=255)
     description = models.TextField()
@@ -449,16 +609,52 @@ class GiftProposal(VoteModel, models.Model):
     link = models.URLField(blank=True, null=True)
     proposed_by = models.ForeignKey('UserProfile', on_delete=models.CASCADE, related_name='gift_proposals')
     created_at = models.DateTimeField(auto_now_add=True)
+    # Number of up votes, maintained by the vote signals
+    vote_tally = models.PositiveIntegerField(default=0, editable=False)
+    denormalized_fields = ('vote_tally',)
+
+    objects = GiftProposalQuerySet.as_manager()
+
+    class Meta:
+        indexes = [models.Index(fields=['gift_search', '-vote_tally', 'id'], name='gift_proposal_ranking_idx')]
     
     def __str__(self):
         return self.title
 
 
 
+# -------------------------------------------------------------
+# Updates the leader of a gift search, optionally after recounting the votes of one proposal (in one transaction)
+# -------------------------------------------------------------
+def refresh_gift_search_leader(search_id, proposal_id=None):
+    with transaction.atomic():
+        # Lock the gift search so concurrent votes update the leader one after another
+        gift_search = GiftSearch.objects.select_for_update().filter(pk=search_id).first()
+        if gift_search is None:
+            return
+        if proposal_id is not None:
+            GiftProposal.objects.filter(pk=proposal_id).refresh_vote_tallies()
+        gift_search.refresh_leader()
+
+
+
+# -------------------------------------------------------------
+# Recounts the votes of a proposal and updates the leader of its gift search
+# -------------------------------------------------------------
+def refresh_vote_tally(proposal_id):
+    search_id = GiftProposal.objects.filter(pk=proposal_id).values_list('gift_search_id', flat=True).first()
+    if search_id is not None:
+        refresh_gift_search_leader(search_id, proposal_id)
+
+
+
 # -------------------------------------------------------------
 # Model which stores history of gift scores per gift and user (through Gift and UserProfile)
 # -------------------------------------------------------------
-class GiftScoreHistory(models.Model):
+class GiftScoreHistory(TrackedFieldsMixin, models.Model):
+    # Original values are needed to apply score changes as deltas
+    tracked_fields = ('user_profile', 'points_change')
+
     # Define different score types for gifts
     SCORE_TYPE_CHOICES = [
         ('proposal', 'Proposal'),
@@ -505,7 +701,10 @@ class GiftScoreHistory(models.Model):
 # -------------------------------------------------------------
 #  Model which stores meta information for gift contributions
 # -------------------------------------------------------------
-class GiftContribution(models.Model):
+class GiftContribution(TrackedFieldsMixin, models.Model):
+    # Original values let signals and jobs detect status changes without re-fetching the contribution
+    tracked_fields = ('status',)
+
     STATUS_CHOICES = (
         ('open', 'Open'),
         ('closed', 'Closed'),
@@ -515,7 +714,7 @@ class GiftContribution(models.Model):
     description = models.TextField()
     donee = models.ForeignKey('UserProfile', on_delete=models.CASCADE, related_name='gift_contributions_received')
     manager = models.ForeignKey('UserProfile', on_delete=models.CASCADE, related_name='gift_contributions_managed')
-    deadline = models.DateField()
+    deadline = models.DateField(db_index=True)
     collection_target = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='open')
     created_at = models.DateTimeField(auto_now_add=True)
@@ -556,7 +755,10 @@ class Contribution(models.Model):
 # -------------------------------------------------------------
 # Model which stores payment transactions
 # -------------------------------------------------------------
-class Transaction(models.Model):
+class Transaction(TrackedFieldsMixin, models.Model):
+    # Original values let the signals detect status changes without re-fetching the transaction
+    tracked_fields = ('status',)
+
     TRANSACTION_TYPE_CHOICES = [
         ('task', 'Task'),
         ('event', 'Event'),
@@ -599,7 +801,10 @@ class Transaction(models.Model):
 # -------------------------------------------------------------
 # Model which stores history of payment scores per payment and user (through Transaction and UserProfile)
 # -------------------------------------------------------------
-class PaymentScoreHistory(models.Model):
+class PaymentScoreHistory(TrackedFieldsMixin, models.Model):
+    # Original values are needed to apply score changes as deltas
+    tracked_fields = ('user_profile', 'points_awarded')
+
     # Define different types for payments
     SCORE_TYPE_CHOICES = [
         ('task', 'Task'),
@@ -644,3 +849,166 @@ class PaymentScoreHistory(models.Model):
                 return f"{self.user_profile} awarded {self.points_awarded} for {self.event.title} on {self.timestamp.strftime('%Y-%m-%d %H:%M')}"
             if self.score_type == 'gift':
                 return f"{self.user_profile} awarded {self.points_awarded} for {self.gift_contribution.title} on {self.timestamp.strftime('%Y-%m-%d %H:%M')}"
+
+
+
+# -------------------------------------------------------------
+# Model which stores all score changes of the four score histories in one table (written through by the score engine)
+# -------------------------------------------------------------
+class ScoreLedger(models.Model):
+    # Define score categories (one per score history)
+    CATEGORY_CHOICES = [
+        ('task', 'Task'),
+        ('role', 'Role'),
+        ('gift', 'Gift'),
+        ('payment', 'Payment'),
+    ]
+
+    # Relations to user profile and to the score history record (source)
+    user_profile = models.ForeignKey('UserProfile', on_delete=models.CASCADE, related_name='score_ledger')
+    source_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    source_id = models.PositiveIntegerField()
+    source = GenericForeignKey('source_type', 'source_id')
+
+    # Attributes of the score change
+    category = models.CharField(max_length=10, choices=CATEGORY_CHOICES)
+    points = models.IntegerField()
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ('source_type', 'source_id')
+        indexes = [
+            models.Index(fields=['user_profile', 'timestamp']),
+            models.Index(fields=['category', 'timestamp']),
+        ]
+
+    def __str__(self):
+        return f"{self.user_profile} | {self.category}: {self.points} pts on {self.timestamp.strftime('%Y-%m-%d %H:%M')}"
+
+
+
+# -------------------------------------------------------------
+# Model which stores outgoing emails until the outbox worker has sent them (send_outbox command)
+# -------------------------------------------------------------
+class EmailOutbox(models.Model):
+    # Define status choices
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    # Same key is enqueued only once (e.g. one reminder per task and user)
+    idempotency_key = models.CharField(max_length=255, unique=True)
+
+    # Content of the email (attachments are stored as [filename, content, mimetype])
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=255)
+    to = models.JSONField(default=list)
+    attachments = models.JSONField(default=list)
+
+    # Delivery state (next_attempt_at is also the lease of a worker which sends the email)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.to)} ({self.status})"
+
+
+
+# -------------------------------------------------------------
+# Model which collects notifications of the digest jobs until they are sent as one digest email per user (send_digest_emails job)
+# -------------------------------------------------------------
+class DigestNotification(models.Model):
+    recipient = models.EmailField()
+    job = models.CharField(max_length=50)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.subject} to {self.recipient} ({self.job})"
+
+
+
+# -------------------------------------------------------------
+# Model which stores the lease of a scheduled job (one run at a time across threads and processes, see job_locks)
+# -------------------------------------------------------------
+class JobLock(models.Model):
+    job_id = models.CharField(max_length=100, primary_key=True)
+
+    # Current lease (owner is empty and expires_at is null while the job is not running)
+    owner = models.CharField(max_length=255, blank=True)
+    acquired_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    # Runs which were skipped because the job was still running
+    skipped_count = models.PositiveIntegerField(default=0)
+    last_skipped_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.job_id} ({'held by ' + self.owner if self.owner else 'free'})"
+
+
+
+# -------------------------------------------------------------
+# Model which stores one run of a scheduled job with its metrics (recorded by job_runs.track_job_run)
+# -------------------------------------------------------------
+class JobRun(models.Model):
+    # Define status choices
+    STATUS_CHOICES = [
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+        ('skipped', 'Skipped'),
+    ]
+
+    job_id = models.CharField(max_length=100)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='running')
+    started_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Duration and time spent in database queries in seconds
+    duration = models.FloatField(null=True, blank=True)
+    query_count = models.PositiveIntegerField(default=0)
+    query_time = models.FloatField(default=0)
+    # Rows written by INSERT, UPDATE and DELETE queries of the job
+    rows_processed = models.PositiveIntegerField(default=0)
+    # Emails delivered by the job, handed to the outbox or digest, and failed deliveries
+    emails_sent = models.PositiveIntegerField(default=0)
+    emails_queued = models.PositiveIntegerField(default=0)
+    emails_failed = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['job_id', 'started_at']),
+            models.Index(fields=['started_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.job_id} at {self.started_at.strftime('%Y-%m-%d %H:%M')} ({self.status})"
+
+
+
+# -------------------------------------------------------------
+# Model which stores a version counter of cached data (shared by all processes, see cache_versions)
+# -------------------------------------------------------------
+class CacheVersion(models.Model):
+    key = models.CharField(max_length=100, primary_key=True)
+    version = models.PositiveBigIntegerField(default=1)
+    modified = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.key}: {self.version}"
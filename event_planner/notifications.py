@@ -0,0 +1,98 @@
+from functools import lru_cache
+from django.core.mail import EmailMultiAlternatives
+from django.template import TemplateDoesNotExist
+from django.template.loader import get_template
+from django.utils.html import escape
+
+
+
+# Marks the position of a per-recipient field in the shared rendering (control character which never occurs in templates)
+RECIPIENT_MARKER = '\x1f'
+
+
+
+# -------------------------------------------------------------
+# Returns the compiled template (loaded and compiled once per process, None if the template does not exist)
+# -------------------------------------------------------------
+@lru_cache(maxsize=None)
+def get_compiled_template(template_name):
+    try:
+        return get_template(template_name)
+    except TemplateDoesNotExist:
+        return None
+
+
+
+# -------------------------------------------------------------
+# Rendering of a template with the shared context, split into literal parts and per-recipient fields
+# -------------------------------------------------------------
+class PreparedPart:
+    def __init__(self, rendered, escape_values):
+        parts = rendered.split(RECIPIENT_MARKER)
+        self.literals = parts[0::2]
+        self.fields = parts[1::2]
+        self.escape_values = escape_values
+
+    def render(self, recipient):
+        # Only the per-recipient fields are substituted
+        output = [self.literals[0]]
+        for field, literal in zip(self.fields, self.literals[1:]):
+            value = str(recipient[field])
+            output.append(escape(value) if self.escape_values else value)
+            output.append(literal)
+        return ''.join(output)
+
+
+
+# -------------------------------------------------------------
+# Notification rendered once per job run with the shared context (e.g. event or gift search), completed per recipient
+# -------------------------------------------------------------
+class PreparedNotification:
+    def __init__(self, text, html=None):
+        self.text = text
+        self.html = html
+
+    def render(self, **recipient):
+        text = self.text.render(recipient)
+        html = self.html.render(recipient) if self.html else None
+        return text, html
+
+    def build_message(self, subject, from_email, recipient_list, attachments=(), **recipient):
+        text, html = self.render(**recipient)
+        message = EmailMultiAlternatives(subject, text, from_email, recipient_list)
+        if html:
+            message.attach_alternative(html, "text/html")
+        for filename, content, mimetype in attachments:
+            message.attach(filename, content, mimetype)
+        return message
+
+
+
+# -------------------------------------------------------------
+# Notification template: email/<name>.txt (plain text, required) and email/<name>.html (optional alternative)
+# Per-recipient fields are used as {{ recipient.<field> }} and inserted without filters
+# -------------------------------------------------------------
+class NotificationTemplate:
+    def __init__(self, name, recipient_fields):
+        self.name = name
+        self.recipient_fields = recipient_fields
+
+    def prepare(self, **context):
+        # Per-recipient fields are rendered as markers and substituted later
+        context['recipient'] = {field: f'{RECIPIENT_MARKER}{field}{RECIPIENT_MARKER}' for field in self.recipient_fields}
+        text_template = get_compiled_template(f'email/{self.name}.txt')
+        html_template = get_compiled_template(f'email/{self.name}.html')
+        if text_template is None:
+            raise TemplateDoesNotExist(f'email/{self.name}.txt')
+        text = PreparedPart(text_template.render(context), escape_values=False)
+        html = PreparedPart(html_template.render(context), escape_values=True) if html_template else None
+        return PreparedNotification(text, html)
+
+
+
+# -------------------------------------------------------------
+# Notification templates of the jobs
+# -------------------------------------------------------------
+INVITATION_EMAIL = NotificationTemplate('invitation_email', ['username', 'ranking_message'])
+GIFT_SEARCH_INVITATION = NotificationTemplate('gift_search_invitation', ['username'])
+GIFT_CONTRIBUTION_INVITATION = NotificationTemplate('gift_contribution_invitation', ['username'])
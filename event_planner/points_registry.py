@@ -0,0 +1,76 @@
+from dataclasses import dataclass, field
+from django.db import transaction
+from .cache_versions import POINTS_REGISTRY_VERSION_KEY, get_version, increase_version
+from .models import RoleConfiguration, GiftConfiguration
+
+
+
+# -------------------------------------------------------------
+# Points of the event roles (RoleConfiguration) and gift roles (GiftConfiguration) loaded at a registry version
+# -------------------------------------------------------------
+@dataclass(frozen=True)
+class PointsRegistry:
+    version: int
+    role_points: dict = field(default_factory=dict)
+    gift_points: dict = field(default_factory=dict)
+
+    def get_role_points(self, role):
+        return self.role_points.get(role, 0)
+
+    def get_gift_points(self, role):
+        return self.gift_points.get(role, 0)
+
+
+# Registry of this process (None until first use or after invalidation)
+_registry = None
+
+
+
+# -------------------------------------------------------------
+# Returns the registry of this process, it is loaded from the database only if missing or outdated
+# (the version is shared by all processes, changes of another process are seen within CACHE_VERSION_TIMEOUT seconds)
+# -------------------------------------------------------------
+def get_points_registry():
+    global _registry
+    version = get_version(POINTS_REGISTRY_VERSION_KEY)
+    if _registry is None or _registry.version != version:
+        _registry = PointsRegistry(
+            version=version,
+            role_points=dict(RoleConfiguration.objects.values_list('role', 'points')),
+            gift_points=dict(GiftConfiguration.objects.values_list('role', 'points')),
+        )
+    return _registry
+
+
+
+# -------------------------------------------------------------
+# Returns the points of an event role (0 if the role is not configured)
+# -------------------------------------------------------------
+def get_role_points(role):
+    return get_points_registry().get_role_points(role)
+
+
+
+# -------------------------------------------------------------
+# Returns the points of a gift role (0 if the role is not configured)
+# -------------------------------------------------------------
+def get_gift_points(role):
+    return get_points_registry().get_gift_points(role)
+
+
+
+# -------------------------------------------------------------
+# Drops the registry of this process (reloaded on next access)
+# -------------------------------------------------------------
+def clear_points_registry():
+    global _registry
+    _registry = None
+
+
+
+# -------------------------------------------------------------
+# Drops the registry of this process and, after commit, notifies the other processes by increasing the version
+# -------------------------------------------------------------
+def invalidate_points_registry():
+    clear_points_registry()
+    transaction.on_commit(lambda: increase_version(POINTS_REGISTRY_VERSION_KEY))
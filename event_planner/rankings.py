@@ -0,0 +1,137 @@
+import time
+from django.core.cache import cache
+from django.db.models import F, Window
+from django.db.models.functions import Rank
+from .models import UserProfile
+from .score_engine import get_scores_version
+
+
+
+# -------------------------------------------------------------
+# Ranking categories: current score field and past score field of the user profile
+# -------------------------------------------------------------
+RANKING_CATEGORIES = {
+    'total': ('total_score', 'total_score_past'),
+    'role': ('role_score', 'role_score_past'),
+    'task': ('task_score', 'task_score_past'),
+    'gift': ('gift_score', 'gift_score_past'),
+    'payment': ('payment_score', 'payment_score_past'),
+}
+
+
+
+# -------------------------------------------------------------
+# Leaderboard snapshots: lifetime, lock lifetime while a snapshot is built and waiting for a snapshot built by another request
+# -------------------------------------------------------------
+SNAPSHOT_TIMEOUT = 60 * 60 * 24
+SNAPSHOT_LOCK_TIMEOUT = 30
+SNAPSHOT_WAIT_STEPS = 50
+SNAPSHOT_WAIT_INTERVAL = 0.1
+
+
+
+# -------------------------------------------------------------
+# Helper function to determine arrow direction based on current vs. past values
+# -------------------------------------------------------------
+def get_arrow(current, past):
+    if current > past:
+        return "up"
+    elif current < past:
+        return "down"
+    else:
+        return "right"
+
+
+
+# -------------------------------------------------------------
+# Returns active user profiles annotated with current and past rank of the given categories (RANK() keeps ties on the same rank)
+# -------------------------------------------------------------
+def ranked_profiles(categories=None):
+    annotations = {}
+    for category in categories or RANKING_CATEGORIES:
+        score_field, past_field = RANKING_CATEGORIES[category]
+        annotations[f'{category}_rank'] = Window(expression=Rank(), order_by=F(score_field).desc())
+        annotations[f'{category}_past_rank'] = Window(expression=Rank(), order_by=F(past_field).desc())
+    return UserProfile.objects.filter(is_inactive=False).select_related('user').annotate(**annotations)
+
+
+
+# -------------------------------------------------------------
+# Helper function which builds the leaderboard entry of a ranked profile for a category
+# -------------------------------------------------------------
+def build_entry(profile, category):
+    # Arrows of all categories are shown for each entry
+    for arrow_category, (score_field, past_field) in RANKING_CATEGORIES.items():
+        setattr(profile, f'{arrow_category}_arrow', get_arrow(getattr(profile, score_field), getattr(profile, past_field)))
+
+    current_rank = getattr(profile, f'{category}_rank')
+    previous_rank = getattr(profile, f'{category}_past_rank')
+    return {
+        'user': profile,
+        'current_rank': current_rank,
+        'previous_rank': previous_rank,
+        'rank_change': previous_rank - current_rank,  # positive means improvement
+        'arrow': getattr(profile, f'{category}_arrow'),
+    }
+
+
+
+# -------------------------------------------------------------
+# Returns the leaderboard of a category (optionally one page given by offset and limit) with one query
+# (only the current and past rank of the category are computed, one query per shown category)
+# -------------------------------------------------------------
+def get_leaderboard(category, offset=0, limit=None):
+    profiles = ranked_profiles([category]).order_by(f'{category}_rank', 'pk')
+    if limit is not None:
+        profiles = profiles[offset:offset + limit]
+    elif offset:
+        profiles = profiles[offset:]
+    return [build_entry(profile, category) for profile in profiles]
+
+
+
+# -------------------------------------------------------------
+# Returns the leaderboard entries of a category ranked around the given user profile ("rank around me")
+# -------------------------------------------------------------
+def get_leaderboard_around(user_profile, category, radius=2):
+    if user_profile.is_inactive:
+        # Inactive users are not ranked
+        return []
+    score_field, _ = RANKING_CATEGORIES[category]
+    rank_field = f'{category}_rank'
+    # Rank of the user is the number of active users with a higher score plus one (filters on other fields would be applied before the window)
+    own_rank = UserProfile.objects.filter(is_inactive=False, **{f'{score_field}__gt': getattr(user_profile, score_field)}).count() + 1
+    profiles = ranked_profiles([category]).filter(**{
+        f'{rank_field}__gte': own_rank - radius,
+        f'{rank_field}__lte': own_rank + radius,
+    }).order_by(rank_field, 'pk')
+    return [build_entry(profile, category) for profile in profiles]
+
+
+
+# -------------------------------------------------------------
+# Returns a cached leaderboard snapshot for the current scores version (built once, concurrent requests wait for it)
+# -------------------------------------------------------------
+def get_leaderboard_snapshot(name, build):
+    key = f'event_planner:leaderboard:{get_scores_version()}:{name}'
+    snapshot = cache.get(key)
+    if snapshot is not None:
+        return snapshot
+
+    # Only the request which gets the lock builds the snapshot
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, True, SNAPSHOT_LOCK_TIMEOUT):
+        try:
+            snapshot = build()
+            cache.set(key, snapshot, SNAPSHOT_TIMEOUT)
+        finally:
+            cache.delete(lock_key)
+        return snapshot
+
+    # Wait for the snapshot of the other request, build it without cache if it takes too long
+    for _ in range(SNAPSHOT_WAIT_STEPS):
+        time.sleep(SNAPSHOT_WAIT_INTERVAL)
+        snapshot = cache.get(key)
+        if snapshot is not None:
+            return snapshot
+    return build()
@@ -1,170 +1,238 @@
 import atexit
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from django.conf import settings
 from .jobs import check_overdue_tasks, send_reminder_email, store_user_scores, send_invitation_email,\
       create_birthday_event, gift_search_results, send_gift_search_invitation, gift_search_reminder,\
         create_round_birthday_gift_search, check_payment_reminder, update_event_status, send_gift_contribution_invitation,\
-        gift_contribution_reminder, update_contribution_status
-from event_planner.job_config import JOB_CONFIG
+        gift_contribution_reminder, update_contribution_status, send_digest_emails
+from event_planner.job_config import JOB_CONFIG, refresh_job_config, get_config_check_interval
+from event_planner.job_runs import track_job_run
 
 
 
+# -------------------------------------------------------------
+# Scheduler of this process (importing this module does not start it)
+# -------------------------------------------------------------
 scheduler = BackgroundScheduler()
 
+
+
+# -------------------------------------------------------------
+# Scheduled jobs with the unit of their interval setting
+# -------------------------------------------------------------
+SCHEDULED_JOBS = {
+    'check_overdue_tasks': (check_overdue_tasks, 'minutes'),            # overdue tasks
+    'send_reminder_email': (send_reminder_email, 'hours'),              # task becoming overdue reminder
+    'send_invitation_email': (send_invitation_email, 'hours'),          # event invitation email
+    'send_gift_search_invitation': (send_gift_search_invitation, 'hours'),
+    'gift_search_reminder': (gift_search_reminder, 'hours'),
+    'gift_search_results': (gift_search_results, 'hours'),
+    'send_gift_contribution_invitation': (send_gift_contribution_invitation, 'hours'),
+    'gift_contribution_reminder': (gift_contribution_reminder, 'hours'),
+    'create_birthday_event': (create_birthday_event, 'hours'),
+    'create_round_birthday_gift_search': (create_round_birthday_gift_search, 'hours'),
+    'check_payment_reminder': (check_payment_reminder, 'days'),         # payment overdue reminder
+    'store_user_scores': (store_user_scores, 'hours'),                  # historical data
+    'update_event_status': (update_event_status, 'hours'),
+    'update_contribution_status': (update_contribution_status, 'hours'),
+    'send_digest_emails': (send_digest_emails, 'hours'),
+}
+
+
+
+# -------------------------------------------------------------
+# Run policy of the scheduled jobs (each value can be overridden in the job's JOB_CONFIG entry)
+# -------------------------------------------------------------
+DEFAULT_JOB_POLICY = {
+    'max_instances': 1,             # runs of a job never overlap in this process
+    'coalesce': True,               # runs missed while the process was busy or down run once
+    'misfire_grace_time': 300,      # seconds a run may start late, later runs are skipped
+}
+
+
+
+# Trigger settings and run policy each job was scheduled with (per process)
+_scheduled_jobs = {}
+
+
+
+# -------------------------------------------------------------
+# Returns the trigger settings of a job from the job configuration (None if the job is disabled)
+# 'cron' (crontab expression) and 'time_window' ({'start': 'HH:MM', 'end': 'HH:MM'}, daily at a random time in the window)
+# replace the interval, 'jitter' delays each run by up to the given seconds
+# -------------------------------------------------------------
+def get_trigger_settings(job_id):
+    config = JOB_CONFIG.get(job_id, {})
+    if not config.get('enabled'):
+        return None
+    trigger = {'jitter': config.get('jitter') or None}
+    if config.get('cron'):
+        trigger['cron'] = config['cron']
+    elif config.get('time_window'):
+        trigger['time_window'] = (config['time_window']['start'], config['time_window']['end'])
+    else:
+        trigger[SCHEDULED_JOBS[job_id][1]] = config['interval']
+    return trigger
+
+
+
+# -------------------------------------------------------------
+# Returns the run policy of a job from the job configuration
+# -------------------------------------------------------------
+def get_job_policy(job_id):
+    config = JOB_CONFIG.get(job_id, {})
+    return {key: config.get(key, default) for key, default in DEFAULT_JOB_POLICY.items()}
+
+
+
+# -------------------------------------------------------------
+# Helper function which converts a time of day ('HH:MM') to seconds after midnight
+# -------------------------------------------------------------
+def parse_time_of_day(value):
+    hour, minute = (int(part) for part in value.split(':'))
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError(f"Invalid time of day: {value}")
+    return hour * 3600 + minute * 60
+
+
+
+# -------------------------------------------------------------
+# Converts the day of week field of a crontab expression (0 and 7 are Sunday) to weekday names for APScheduler (0 is Monday)
+# -------------------------------------------------------------
+CRONTAB_WEEKDAYS = ['sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+
+
+def convert_crontab_day_of_week(field):
+    if field == '*':
+        return field
+    days = []
+    for part in field.split(','):
+        values, _, step = part.partition('/')
+        if values != '*' and not values.replace('-', '').isdigit():
+            # Weekday names mean the same in both notations
+            days.append(part)
+            continue
+        if values == '*':
+            first, last = 0, 6
+        else:
+            first, _, last = values.partition('-')
+            first = int(first)
+            last = int(last) if last else (7 if step else first)
+        if not (0 <= first <= last <= 7):
+            raise ValueError(f"Invalid day of week: {part}")
+        for day in range(first, last + 1, int(step) if step else 1):
+            if CRONTAB_WEEKDAYS[day] not in days:
+                days.append(CRONTAB_WEEKDAYS[day])
+    return ','.join(days)
+
+
+
+# -------------------------------------------------------------
+# Creates the APScheduler trigger for trigger settings (cron and time windows in the time zone of the site)
+# -------------------------------------------------------------
+def build_trigger(trigger):
+    jitter = trigger['jitter']
+    if 'cron' in trigger:
+        fields = trigger['cron'].split()
+        if len(fields) != 5:
+            raise ValueError(f"Invalid cron expression: {trigger['cron']}")
+        minute, hour, day, month, day_of_week = fields
+        return CronTrigger(minute=minute, hour=hour, day=day, month=month, day_of_week=convert_crontab_day_of_week(day_of_week),
+                           timezone=settings.TIME_ZONE, jitter=jitter)
+    if 'time_window' in trigger:
+        start, end = (parse_time_of_day(value) for value in trigger['time_window'])
+        # Windows may span midnight, the jitter spreads the runs over the window
+        window = (end - start) % 86400
+        return CronTrigger(hour=start // 3600, minute=start % 3600 // 60, timezone=settings.TIME_ZONE, jitter=window or jitter)
+    intervals = {unit: value for unit, value in trigger.items() if unit != 'jitter'}
+    return IntervalTrigger(**intervals, timezone=settings.TIME_ZONE, jitter=jitter)
+
+
+
+# -------------------------------------------------------------
+# Brings the scheduled jobs in line with the job configuration and returns the ids of the changed jobs
+# (only jobs with changed trigger settings or run policy are added, rescheduled, modified or removed, each run is recorded as JobRun)
+# -------------------------------------------------------------
 def schedule_jobs():
-    # Remove all jobs if they exist
-    for job in scheduler.get_jobs():
-        print("Removed: ", job.id)    
-        scheduler.remove_job(job.id)
-
-    # Schedule job for overdue tasks
-    if JOB_CONFIG['check_overdue_tasks']['enabled']:
-        job = scheduler.add_job(
-            check_overdue_tasks,
-            trigger='interval',
-            minutes=JOB_CONFIG['check_overdue_tasks']['interval'],
-            id='check_overdue_tasks'
-        )
-        print("Started: ", job.id)
-
-    # Schedule job for task becomimg overdue reminder
-    if JOB_CONFIG['send_reminder_email']['enabled']:
-        job = scheduler.add_job(
-            send_reminder_email,
-            trigger='interval',
-            hours=JOB_CONFIG['send_reminder_email']['interval'],
-            id='send_reminder_email'
-        )
-        print("Started: ", job.id)
-
-    # Schedule job for event invitation email
-    if JOB_CONFIG['send_invitation_email']['enabled']:
-        job = scheduler.add_job(
-            send_invitation_email,
-            trigger='interval',
-            hours=JOB_CONFIG['send_invitation_email']['interval'],
-            id='send_invitation_email'
-        )
-        print("Started: ", job.id)
-
-    # Schedule job for gift search invitation email
-    if JOB_CONFIG['send_gift_search_invitation']['enabled']:
-        job = scheduler.add_job(
-            send_gift_search_invitation,
-            trigger='interval',
-            hours=JOB_CONFIG['send_gift_search_invitation']['interval'],
-            id='send_gift_search_invitation'
-        )
-        print("Started: ", job.id)
-
-    # Schedule job for gift search reminder
-    if JOB_CONFIG['gift_search_reminder']['enabled']:
-        job = scheduler.add_job(
-            gift_search_reminder,
-            trigger='interval',
-            hours=JOB_CONFIG['gift_search_reminder']['interval'],
-            id='gift_search_reminder'
-        )
-        print("Started: ", job.id)
-
-    # Schedule job for gift search results email
-    if JOB_CONFIG['gift_search_results']['enabled']:
-        job = scheduler.add_job(
-            gift_search_results,
-            trigger='interval',
-            hours=JOB_CONFIG['gift_search_results']['interval'],
-            id='gift_search_results'
-        )
-        print("Started: ", job.id)
-
-    # Schedule job for gift contribution invitation email
-    if JOB_CONFIG['send_gift_contribution_invitation']['enabled']:
-        job = scheduler.add_job(
-            send_gift_contribution_invitation,
-            trigger='interval',
-            hours=JOB_CONFIG['send_gift_contribution_invitation']['interval'],
-            id='send_gift_contribution_invitation'
-        )
-        print("Started: ", job.id)
-
-    # Schedule job for gift contribution reminder
-    if JOB_CONFIG['gift_contribution_reminder']['enabled']:
-        job = scheduler.add_job(
-            gift_contribution_reminder,
-            trigger='interval',
-            hours=JOB_CONFIG['gift_contribution_reminder']['interval'],
-            id='gift_contribution_reminder'
-        )
-        print("Started: ", job.id)
-
-    # Schedule job for birthday event
-    if JOB_CONFIG['create_birthday_event']['enabled']:
-        job = scheduler.add_job(
-            create_birthday_event,
-            trigger='interval',
-            hours=JOB_CONFIG['create_birthday_event']['interval'],
-            id='create_birthday_event'
-        )
-        print("Started: ", job.id)
-
-    # Schedule job for birthday gift search
-    if JOB_CONFIG['create_round_birthday_gift_search']['enabled']:
-        job = scheduler.add_job(
-            create_round_birthday_gift_search,
-            trigger='interval',
-            hours=JOB_CONFIG['create_round_birthday_gift_search']['interval'],
-            id='create_round_birthday_gift_search'
-        )
-        print("Started: ", job.id)
-
-    # Schedule job for payment overdue reminder
-    if JOB_CONFIG['check_payment_reminder']['enabled']:
-        job = scheduler.add_job(
-            check_payment_reminder,
-            trigger='interval',
-            days=JOB_CONFIG['check_payment_reminder']['interval'],   # days
-            id='check_payment_reminder'
-        )
-        print("Started: ", job.id)
-
-    # Schedule job for historical data
-    if JOB_CONFIG['store_user_scores']['enabled']:
-        job = scheduler.add_job(
-            store_user_scores,
-            trigger='interval',
-            hours=JOB_CONFIG['store_user_scores']['interval'],
-            id='store_user_scores'
-        )
-        print("Started: ", job.id)
-
-    # Schedule job for event status changes
-    if JOB_CONFIG['update_event_status']['enabled']:
-        job = scheduler.add_job(
-            update_event_status,
-            trigger='interval',
-            hours=JOB_CONFIG['update_event_status']['interval'],  # hours
-            id='update_event_status'
-        )
-        print("Started: ", job.id)
-
-    # Schedule job for event status changes
-    if JOB_CONFIG['update_contribution_status']['enabled']:
-        job = scheduler.add_job(
-            update_contribution_status,
-            trigger='interval',
-            hours=JOB_CONFIG['update_contribution_status']['interval'],  # hours
-            id='update_contribution_status'
-        )
-        print("Started: ", job.id)
-
-# Initial scheduling
-schedule_jobs()
-
-# Start scheduler, module-level flag to prevent double-starting
-if not hasattr(scheduler, '_has_been_started'):
+    changed = []
+    for job_id, (func, _) in SCHEDULED_JOBS.items():
+        job = scheduler.get_job(job_id)
+        scheduled_trigger, scheduled_policy = _scheduled_jobs.get(job_id, (None, None))
+        try:
+            trigger = get_trigger_settings(job_id)
+            policy = get_job_policy(job_id)
+            if trigger is None:
+                if job is None:
+                    continue
+                scheduler.remove_job(job_id)
+                print("Removed: ", job_id)
+            elif job is None:
+                scheduler.add_job(track_job_run(func), trigger=build_trigger(trigger), id=job_id, **policy)
+                print("Started: ", job_id)
+            elif (trigger, policy) != (scheduled_trigger, scheduled_policy):
+                # Other settings (lead times, thresholds) are read by the job itself on each run
+                if trigger != scheduled_trigger:
+                    scheduler.reschedule_job(job_id, trigger=build_trigger(trigger))
+                if policy != scheduled_policy:
+                    scheduler.modify_job(job_id, **policy)
+                print("Rescheduled: ", job_id)
+            else:
+                continue
+        except (ValueError, TypeError, KeyError) as e:
+            # An invalid schedule of one job keeps the other jobs (and the job's previous schedule) running
+            print(f"Invalid schedule for {job_id}:", e)
+            continue
+        _scheduled_jobs[job_id] = (trigger, policy)
+        changed.append(job_id)
+
+    # Notifications collected while the digest was enabled are sent once when it is disabled
+    if 'send_digest_emails' in changed and _scheduled_jobs['send_digest_emails'][0] is None:
+        scheduler.add_job(track_job_run(send_digest_emails), id='flush_digest_emails', replace_existing=True)
+        print("Flushing: ", 'send_digest_emails')
+    return changed
+
+
+
+# -------------------------------------------------------------
+# Reloads the job configuration if another process saved it and reschedules the changed jobs
+# (runs as internal job of the scheduler every JOB_CONFIG_CHECK_INTERVAL seconds)
+# -------------------------------------------------------------
+def sync_job_config():
+    if refresh_job_config(force=True):
+        return schedule_jobs()
+    return []
+
+
+
+# -------------------------------------------------------------
+# Schedules the jobs again after a change of the job configuration (only a running scheduler has jobs to replace)
+# -------------------------------------------------------------
+def reschedule_jobs():
+    if scheduler.running:
+        schedule_jobs()
+
+
+
+# -------------------------------------------------------------
+# Starts the scheduler in a background thread of this process (the run_scheduler command or SCHEDULER_AUTOSTART)
+# -------------------------------------------------------------
+def start_scheduler():
+    if scheduler.running:
+        return
+    refresh_job_config(force=True)
+    schedule_jobs()
+    scheduler.add_job(sync_job_config, trigger='interval', seconds=get_config_check_interval(), id='sync_job_config', replace_existing=True)
     scheduler.start()
-    scheduler._has_been_started = True
+    # Shut down scheduler when exiting the app
+    atexit.register(shutdown_scheduler)
 
-# Shut down scheduler when exiting the app
-atexit.register(lambda: scheduler.shutdown())
 
 
+# -------------------------------------------------------------
+# Stops the scheduler, running jobs are finished first
+# -------------------------------------------------------------
+def shutdown_scheduler(wait=True):
+    if scheduler.running:
+        scheduler.shutdown(wait=wait)
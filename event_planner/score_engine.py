@@ -0,0 +1,356 @@
+import logging
+from collections import defaultdict
+from contextlib import ContextDecorator
+from asgiref.local import Local
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import F, Sum, Value, Case, When, IntegerField
+from .cache_versions import SCORES_VERSION_KEY, get_version, get_version_modified, increase_version_on_change
+from .models import UserProfile, TaskScoreHistory, RoleScoreHistory, GiftScoreHistory, PaymentScoreHistory, ScoreLedger
+
+
+
+logger = logging.getLogger(__name__)
+
+# State of the active score batch (per thread / async context)
+_batch_state = Local()
+
+
+
+# -------------------------------------------------------------
+# Number of user profiles updated per query by apply_score_deltas
+# -------------------------------------------------------------
+SCORE_DELTAS_CHUNK_SIZE = 500
+
+
+
+# -------------------------------------------------------------
+# Score categories: history model, points field of the history model and score field of the user profile
+# -------------------------------------------------------------
+SCORE_CATEGORIES = {
+    'task': (TaskScoreHistory, 'points_change', 'task_score'),
+    'role': (RoleScoreHistory, 'points_awarded', 'role_score'),
+    'gift': (GiftScoreHistory, 'points_change', 'gift_score'),
+    'payment': (PaymentScoreHistory, 'points_awarded', 'payment_score'),
+}
+
+
+
+# -------------------------------------------------------------
+# Helper function to find the score category of a history model
+# -------------------------------------------------------------
+def get_score_category(history_model):
+    for category, (model, _, _) in SCORE_CATEGORIES.items():
+        if model is history_model:
+            return category
+    raise ValueError(f"{history_model.__name__} is not a score history model.")
+
+
+
+# -------------------------------------------------------------
+# Helper function to check if the opt-in verify mode is enabled (re-aggregates after each delta)
+# -------------------------------------------------------------
+def verify_mode_enabled():
+    return getattr(settings, 'SCORE_ENGINE_VERIFY', False)
+
+
+
+# -------------------------------------------------------------
+# Returns the global scores version (cached leaderboards are built for one version)
+# -------------------------------------------------------------
+def get_scores_version():
+    return get_version(SCORES_VERSION_KEY)
+
+
+
+# -------------------------------------------------------------
+# Returns the time of the last change of the global scores version (None if unknown)
+# -------------------------------------------------------------
+def get_scores_modified():
+    return get_version_modified(SCORES_VERSION_KEY)
+
+
+
+# -------------------------------------------------------------
+# Increases the global scores version after scores have changed
+# -------------------------------------------------------------
+def bump_scores_version():
+    increase_version_on_change(SCORES_VERSION_KEY)
+
+
+
+# -------------------------------------------------------------
+# Adds the signed delta to the category score and the total score of a user in one atomic UPDATE
+# -------------------------------------------------------------
+def apply_score_delta(user_profile, category, delta):
+    if not delta:
+        return
+    _, _, score_field = SCORE_CATEGORIES[category]
+    profile_id = user_profile.pk if isinstance(user_profile, UserProfile) else user_profile
+
+    # Inside a score batch the delta is collected and applied with the other deltas when the batch is flushed
+    pending_deltas = _active_batch()
+    if pending_deltas is not None:
+        pending_deltas[(profile_id, category)] += delta
+        return
+
+    # F() expressions let the database add the delta, concurrent awards cannot overwrite each other
+    UserProfile.objects.filter(pk=profile_id).update(**{
+        score_field: F(score_field) + delta,
+        'total_score': F('total_score') + delta,
+    })
+    bump_scores_version()
+
+    # Keep a loaded profile instance in line with the database
+    if isinstance(user_profile, UserProfile):
+        setattr(user_profile, score_field, (getattr(user_profile, score_field) or 0) + delta)
+        user_profile.total_score = (user_profile.total_score or 0) + delta
+
+    if verify_mode_enabled():
+        for drift in verify_scores(user_profiles=[profile_id], categories=[category]):
+            logger.warning("Score drift for user profile %s in %s score: stored %s, expected %s", *drift)
+
+
+
+# -------------------------------------------------------------
+# Adds the signed deltas {user profile id: delta} of one category to the scores of many users
+# (one grouped UPDATE per SCORE_DELTAS_CHUNK_SIZE users, all chunks in one transaction)
+# -------------------------------------------------------------
+def apply_score_deltas(deltas, category):
+    deltas = {profile_id: delta for profile_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    _, _, score_field = SCORE_CATEGORIES[category]
+
+    pending_deltas = _active_batch()
+    if pending_deltas is not None:
+        for profile_id, delta in deltas.items():
+            pending_deltas[(profile_id, category)] += delta
+        return
+
+    items = list(deltas.items())
+    with transaction.atomic():
+        for start in range(0, len(items), SCORE_DELTAS_CHUNK_SIZE):
+            chunk = dict(items[start:start + SCORE_DELTAS_CHUNK_SIZE])
+
+            def delta_of_row():
+                return Case(*[When(pk=profile_id, then=Value(delta)) for profile_id, delta in chunk.items()],
+                            default=Value(0), output_field=IntegerField())
+
+            UserProfile.objects.filter(pk__in=chunk).update(**{
+                score_field: F(score_field) + delta_of_row(),
+                'total_score': F('total_score') + delta_of_row(),
+            })
+    bump_scores_version()
+
+
+
+# -------------------------------------------------------------
+# Applies history records created with bulk_create (no signals): ledger entries and score deltas in bulk
+# -------------------------------------------------------------
+def apply_histories_created(histories):
+    if not histories:
+        return
+    model = type(histories[0])
+    category = get_score_category(model)
+    _, points_field, _ = SCORE_CATEGORIES[category]
+    source_type = ContentType.objects.get_for_model(model)
+
+    ScoreLedger.objects.bulk_create([
+        ScoreLedger(source_type=source_type, source_id=history.pk, user_profile_id=history.user_profile_id,
+                    category=category, points=getattr(history, points_field) or 0, timestamp=history.timestamp)
+        for history in histories
+    ])
+    deltas = {}
+    for history in histories:
+        deltas[history.user_profile_id] = deltas.get(history.user_profile_id, 0) + (getattr(history, points_field) or 0)
+    apply_score_deltas(deltas, category)
+
+    if verify_mode_enabled():
+        for drift in verify_scores(user_profiles=list(deltas), categories=[category]):
+            logger.warning("Score drift for user profile %s in %s score: stored %s, expected %s", *drift)
+
+
+
+# -------------------------------------------------------------
+# Helper function which returns the user profile of a history record (loaded instance if cached, otherwise the id)
+# -------------------------------------------------------------
+def _history_user_profile(instance):
+    if type(instance).user_profile.is_cached(instance):
+        return instance.user_profile
+    return instance.user_profile_id
+
+
+
+# -------------------------------------------------------------
+# Applies the change of a saved history record (new record or changed points/user) as delta
+# -------------------------------------------------------------
+def apply_history_saved(instance, created):
+    category = get_score_category(type(instance))
+    _, points_field, _ = SCORE_CATEGORIES[category]
+    new_points = getattr(instance, points_field) or 0
+    write_ledger_entry(instance, category, created)
+
+    if created:
+        apply_score_delta(_history_user_profile(instance), category, new_points)
+        return
+
+    # Without the original values the delta is unknown, fall back to a full re-aggregation
+    if not (instance.has_original_value(points_field) and instance.has_original_value('user_profile')):
+        recalculate_score(instance.user_profile, category)
+        return
+
+    old_points = instance.get_original_value(points_field) or 0
+    old_profile_id = instance.get_original_value('user_profile')
+    if old_profile_id == instance.user_profile_id:
+        apply_score_delta(_history_user_profile(instance), category, new_points - old_points)
+    else:
+        # Record moved to another user: remove points from old user, add points to new user
+        apply_score_delta(old_profile_id, category, -old_points)
+        apply_score_delta(_history_user_profile(instance), category, new_points)
+
+
+
+# -------------------------------------------------------------
+# Removes the points of a deleted history record as negative delta
+# -------------------------------------------------------------
+def apply_history_deleted(instance):
+    category = get_score_category(type(instance))
+    _, points_field, _ = SCORE_CATEGORIES[category]
+    delete_ledger_entry(instance)
+    # Values stored in database are relevant, not unsaved changes of the instance
+    points = instance.get_original_value(points_field, getattr(instance, points_field)) or 0
+    profile_id = instance.get_original_value('user_profile', instance.user_profile_id)
+    if profile_id == instance.user_profile_id:
+        apply_score_delta(_history_user_profile(instance), category, -points)
+    else:
+        apply_score_delta(profile_id, category, -points)
+
+
+
+# -------------------------------------------------------------
+# Writes a history record through to the score ledger (one ledger entry per history record)
+# -------------------------------------------------------------
+def write_ledger_entry(instance, category, created=False):
+    _, points_field, _ = SCORE_CATEGORIES[category]
+    source_type = ContentType.objects.get_for_model(type(instance))
+    values = {
+        'user_profile_id': instance.user_profile_id,
+        'category': category,
+        'points': getattr(instance, points_field) or 0,
+        'timestamp': instance.timestamp,
+    }
+    # New history records get their entry with one INSERT
+    if created:
+        ScoreLedger.objects.create(source_type=source_type, source_id=instance.pk, **values)
+        return
+    # Changed history records update their entry, records without entry (e.g. created by bulk_create) get one
+    if not ScoreLedger.objects.filter(source_type=source_type, source_id=instance.pk).update(**values):
+        ScoreLedger.objects.create(source_type=source_type, source_id=instance.pk, **values)
+
+
+
+# -------------------------------------------------------------
+# Removes the ledger entry of a deleted history record
+# -------------------------------------------------------------
+def delete_ledger_entry(instance):
+    source_type = ContentType.objects.get_for_model(type(instance))
+    ScoreLedger.objects.filter(source_type=source_type, source_id=instance.pk).delete()
+
+
+
+# -------------------------------------------------------------
+# Recalculates the category score of a user by summing up all point changes of the history (full re-aggregation)
+# -------------------------------------------------------------
+def recalculate_score(user_profile, category):
+    model, points_field, score_field = SCORE_CATEGORIES[category]
+    # Deltas collected so far are part of the aggregate, they must not be applied again when the batch is flushed
+    pending_deltas = _active_batch()
+    if pending_deltas is not None:
+        pending_deltas.pop((user_profile.pk, category), None)
+    aggregate = model.objects.filter(user_profile=user_profile).aggregate(total=Sum(points_field))
+    total = aggregate['total'] if aggregate['total'] is not None else 0
+    # Save calculated points to profile of the user
+    setattr(user_profile, score_field, total)
+    user_profile.save(update_fields=[score_field, 'total_score', 'total_score_past'])
+
+
+
+# -------------------------------------------------------------
+# Re-aggregates the history and reports drift as tuples (user profile id, category, stored score, expected score)
+# -------------------------------------------------------------
+def verify_scores(user_profiles=None, categories=None):
+    categories = categories or list(SCORE_CATEGORIES)
+    profiles = UserProfile.objects.all()
+    if user_profiles is not None:
+        profiles = profiles.filter(pk__in=[p.pk if isinstance(p, UserProfile) else p for p in user_profiles])
+    stored = {row['pk']: row for row in profiles.values('pk', 'task_score', 'role_score', 'gift_score', 'payment_score')}
+
+    drifts = []
+    for category in categories:
+        model, points_field, score_field = SCORE_CATEGORIES[category]
+        # One grouped query per category for all requested users
+        expected = dict(
+            model.objects.filter(user_profile__in=stored.keys())
+            .values_list('user_profile')
+            .annotate(total=Sum(points_field))
+            .order_by()
+        )
+        for profile_id, row in stored.items():
+            expected_score = expected.get(profile_id) or 0
+            if row[score_field] != expected_score:
+                drifts.append((profile_id, category, row[score_field], expected_score))
+    return drifts
+
+
+
+# -------------------------------------------------------------
+# Helper function which returns the pending deltas {(user profile id, category): delta} of the active score batch (None outside a batch)
+# -------------------------------------------------------------
+def _active_batch():
+    return getattr(_batch_state, 'pending_deltas', None)
+
+
+
+# -------------------------------------------------------------
+# Score batch (decorator and context manager): collects score deltas and applies them once after commit
+# -------------------------------------------------------------
+class score_batch(ContextDecorator):
+    def __enter__(self):
+        # Nested batches join the outermost batch
+        depth = getattr(_batch_state, 'depth', 0)
+        if depth == 0:
+            _batch_state.pending_deltas = defaultdict(int)
+        _batch_state.depth = depth + 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _batch_state.depth -= 1
+        if _batch_state.depth > 0:
+            return False
+        pending_deltas = _batch_state.pending_deltas
+        _batch_state.pending_deltas = None
+        # Runs immediately in autocommit mode, is dropped if the surrounding transaction is rolled back
+        if pending_deltas:
+            transaction.on_commit(lambda: flush_score_deltas(pending_deltas))
+        return False
+
+
+
+# -------------------------------------------------------------
+# Applies the collected deltas with one grouped UPDATE per category (same delta semantics as outside a batch)
+# -------------------------------------------------------------
+def flush_score_deltas(pending_deltas):
+    deltas_by_category = defaultdict(dict)
+    for (profile_id, category), delta in pending_deltas.items():
+        deltas_by_category[category][profile_id] = delta
+    # One transaction for all categories, the scores version is increased once
+    with transaction.atomic():
+        for category, deltas in deltas_by_category.items():
+            apply_score_deltas(deltas, category)
+
+    if verify_mode_enabled():
+        profile_ids = {profile_id for profile_id, _ in pending_deltas}
+        for drift in verify_scores(user_profiles=profile_ids, categories=list(deltas_by_category)):
+            logger.warning("Score drift for user profile %s in %s score: stored %s, expected %s", *drift)
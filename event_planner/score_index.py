@@ -0,0 +1,58 @@
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from .models import UserProfile
+
+
+
+# -------------------------------------------------------------
+# Entry of the score index (sorted by total score, then by profile id)
+# -------------------------------------------------------------
+ScoreNeighbour = namedtuple('ScoreNeighbour', ['total_score', 'profile_id', 'username'])
+
+
+
+# -------------------------------------------------------------
+# In-memory index of the total scores of all users which finds the closest competitors by bisection
+# -------------------------------------------------------------
+class ScoreIndex:
+    def __init__(self, entries):
+        self._entries = sorted(entries)
+        self._scores = [entry.total_score for entry in self._entries]
+        self._by_profile = {entry.profile_id: entry for entry in self._entries}
+
+    @classmethod
+    def build(cls):
+        # One query for all users (built once per job run)
+        rows = UserProfile.objects.values_list('total_score', 'pk', 'user__username')
+        return cls(ScoreNeighbour(*row) for row in rows)
+
+    def get(self, profile_id):
+        return self._by_profile.get(profile_id)
+
+    def above(self, score):
+        # Closest competitor with a higher score
+        index = bisect_right(self._scores, score)
+        return self._entries[index] if index < len(self._entries) else None
+
+    def below(self, score):
+        # Closest competitor with a lower score
+        index = bisect_left(self._scores, score)
+        return self._entries[index - 1] if index > 0 else None
+
+    def update(self, profile_id, total_score):
+        # Keeps the index in line with scores changed during the job run
+        old_entry = self._by_profile.get(profile_id)
+        if old_entry is not None:
+            if old_entry.total_score == total_score:
+                return
+            index = bisect_left(self._entries, old_entry)
+            del self._entries[index]
+            del self._scores[index]
+            username = old_entry.username
+        else:
+            username = UserProfile.objects.filter(pk=profile_id).values_list('user__username', flat=True).first()
+        new_entry = ScoreNeighbour(total_score, profile_id, username)
+        index = bisect_right(self._entries, new_entry)
+        self._entries.insert(index, new_entry)
+        self._scores.insert(index, total_score)
+        self._by_profile[profile_id] = new_entry
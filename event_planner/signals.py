@@ -2,10 +2,13 @@ import math
 from decimal import Decimal
 from django.db.models.signals import post_save, pre_save, post_delete
 from django.dispatch import receiver
-from django.db.models import Sum, Count
 from django.utils import timezone
+from django.contrib.contenttypes.models import ContentType
 from event_planner.job_config import JOB_CONFIG
 from .models import *
+from .score_engine import apply_history_saved, apply_history_deleted, recalculate_score, bump_scores_version
+from .points_registry import get_role_points, get_gift_points, invalidate_points_registry
+from .cache_versions import CALENDAR_VERSION_KEY, increase_version_on_change
 from vote.models import Vote
 
 
@@ -71,20 +74,22 @@ def update__task_score(sender, instance, **kwargs):
             instance.status = 'overdue'
             instance.points_awarded = instance.penalty_points or 0
     else:
-        # If record is not new, retrieve it before value changes
-        instance_presave = Task.objects.get(pk=instance.pk)
+        # If record is not new, compare with the values loaded from the database
+        original = instance.get_original_values('status', 'points_awarded') or {}
+        old_status = original.get('status')
+        old_points = original.get('points_awarded') or 0
         # If status is changing from non-completed to completed, update completed_at and points
-        if instance_presave.status != 'completed' and instance.status == 'completed':
-            instance.points_awarded = (instance_presave.points_awarded or 0) + (instance.base_points or 0)
+        if old_status != 'completed' and instance.status == 'completed':
+            instance.points_awarded = old_points + (instance.base_points or 0)
             instance.completed_at = timezone.now()
         # If status is changing from completed to something else, clear completed_at and remove points
-        elif instance_presave.status == 'completed' and instance.status != 'completed':
-            instance.points_awarded = (instance_presave.points_awarded or 0) - (instance.base_points or 0)
+        elif old_status == 'completed' and instance.status != 'completed':
+            instance.points_awarded = old_points - (instance.base_points or 0)
             instance.completed_at = None
         # If status is changing from non-overdue to overdue, assign penalty points
         # Note: Once task was overdue, penalty cannot be removed
-        elif instance_presave.status != 'overdue' and instance.status == 'overdue':
-            instance.points_awarded = (instance_presave.points_awarded or 0) + (instance.penalty_points or 0)
+        elif old_status != 'overdue' and instance.status == 'overdue':
+            instance.points_awarded = old_points + (instance.penalty_points or 0)
         # If task is overdue, change status and deduct penalty points
         elif  instance.due_date and instance.due_date < timezone.now():
             # Assign penalty points
@@ -155,12 +160,8 @@ def update_task_score_history(sender, instance, created, **kwargs):
 # Helper function to calculate the task score of a user by summing up all point changes from TaskScoreHistory
 # -------------------------------------------------------------
 def update_task_score(user_profile):
-    # Calculate the sum of all points_change values for the given user profile
-    aggregate = TaskScoreHistory.objects.filter(user_profile=user_profile).aggregate(total=Sum('points_change'))
-    total = aggregate['total'] if aggregate['total'] is not None else 0
-    # Save calculated points to profile of the user
-    user_profile.task_score = total
-    user_profile.save(update_fields=['task_score', 'total_score', 'total_score_past'])
+    # Full re-aggregation (the signals below apply deltas instead)
+    recalculate_score(user_profile, 'task')
 
 
 
@@ -169,8 +170,8 @@ def update_task_score(user_profile):
 # -------------------------------------------------------------
 @receiver(post_save, sender=TaskScoreHistory)
 def update_task_score_on_save(sender, instance, created, **kwargs):
-    # Recalculate the task score
-    update_task_score(instance.user_profile)
+    # Apply the change of points to the task score
+    apply_history_saved(instance, created)
 
 
 
@@ -179,8 +180,8 @@ def update_task_score_on_save(sender, instance, created, **kwargs):
 # -------------------------------------------------------------
 @receiver(post_delete, sender=TaskScoreHistory)
 def update_task_score_on_delete(sender, instance, **kwargs):
-    # Recalculate the task score
-    update_task_score(instance.user_profile)
+    # Remove the points of the record from the task score
+    apply_history_deleted(instance)
 
 
 
@@ -193,9 +194,8 @@ def update_task_score_on_delete(sender, instance, **kwargs):
 @receiver(post_save, sender=EventParticipant)
 def update_role_score_history(sender, instance, created, **kwargs):
     if created:
-        # Retrieve points for role from RoleConfiguration model
-        config = RoleConfiguration.objects.filter(role=instance.role).first()
-        points = config.points if config else 0
+        # Retrieve points for role from the points registry (RoleConfiguration)
+        points = get_role_points(instance.role)
         
         # Create history record for this role assignment
         RoleScoreHistory.objects.create(
@@ -212,12 +212,8 @@ def update_role_score_history(sender, instance, created, **kwargs):
 # Helper function to calculate the role score of a user by summing up all point changes from RoleScoreHistory
 # -------------------------------------------------------------
 def update_role_score(user_profile):
-    # Calculate the sum of all points_awarded values for the given user profile
-    aggregate = RoleScoreHistory.objects.filter(user_profile=user_profile).aggregate(total=Sum('points_awarded'))
-    total = aggregate['total'] if aggregate['total'] is not None else 0
-    # Save calculated points to profile of the user
-    user_profile.role_score = total
-    user_profile.save(update_fields=['role_score', 'total_score', 'total_score_past'])
+    # Full re-aggregation (the signals below apply deltas instead)
+    recalculate_score(user_profile, 'role')
 
 
 
@@ -226,8 +222,8 @@ def update_role_score(user_profile):
 # -------------------------------------------------------------
 @receiver(post_save, sender=RoleScoreHistory)
 def update_role_score_on_save(sender, instance, created, **kwargs):
-    # Recalculate the role score
-    update_role_score(instance.user_profile)
+    # Apply the change of points to the role score
+    apply_history_saved(instance, created)
 
 
 
@@ -236,8 +232,8 @@ def update_role_score_on_save(sender, instance, created, **kwargs):
 # -------------------------------------------------------------
 @receiver(post_delete, sender=RoleScoreHistory)
 def update_role_score_on_delete(sender, instance, **kwargs):
-    # Recalculate the role score
-    update_role_score(instance.user_profile)
+    # Remove the points of the record from the role score
+    apply_history_deleted(instance)
 
 
 
@@ -248,9 +244,8 @@ def update_role_score_on_delete(sender, instance, **kwargs):
 # -------------------------------------------------------------
 @receiver(post_save, sender=Vote)
 def update_gift_score_history_on_vote(sender, instance, created, **kwargs):
-    # Retrieve points for role from GiftConfiguration model
-    config = GiftConfiguration.objects.filter(role='voter').first()
-    points = config.points if config else 0
+    # Retrieve points for role from the points registry (GiftConfiguration)
+    points = get_gift_points('voter')
     user_profile = UserProfile.objects.get(user_id=instance.user_id)
     gift_proposal = GiftProposal.objects.get(id=instance.object_id)
 
@@ -272,27 +267,54 @@ def update_gift_score_history_on_vote(sender, instance, created, **kwargs):
 
 
 
+# -------------------------------------------------------------
+# Signal triggered every time a Gift vote is created/edited or deleted (vote tally and leader of the gift search)
+# -------------------------------------------------------------
+@receiver(post_save, sender=Vote)
+@receiver(post_delete, sender=Vote)
+def update_vote_tally_on_vote(sender, instance, **kwargs):
+    if instance.content_type_id == ContentType.objects.get_for_model(GiftProposal).pk:
+        refresh_vote_tally(instance.object_id)
+
+
+
+# -------------------------------------------------------------
+# Signal triggered every time a Gift proposal is created (the first proposal leads without votes)
+# -------------------------------------------------------------
+@receiver(post_save, sender=GiftProposal)
+def update_gift_search_leader_on_proposal(sender, instance, created, **kwargs):
+    if created:
+        refresh_gift_search_leader(instance.gift_search_id)
+
+
+
+# -------------------------------------------------------------
+# Signal triggered every time a Gift proposal is deleted
+# -------------------------------------------------------------
+@receiver(post_delete, sender=GiftProposal)
+def update_gift_search_leader_on_proposal_delete(sender, instance, **kwargs):
+    refresh_gift_search_leader(instance.gift_search_id)
+
+
+
 # -------------------------------------------------------------
 # Signal triggered every time a Gift Search has ended or been processed
 # -------------------------------------------------------------
 @receiver(pre_save, sender=GiftSearch)
 def update_gift_score_history_on_winner(sender, instance, **kwargs):
     if instance.pk and instance.final_results_sent == True:
-        # If record is not new, retrieve it before value changes
-        instance_presave = GiftSearch.objects.get(pk=instance.pk)
+        # If record is not new, compare with the value loaded from the database
+        original = instance.get_original_values('final_results_sent') or {}
         # If status is changing from non-completed to completed, award points
-        if instance_presave.final_results_sent == False and instance.final_results_sent == True:
-            # Retrieve points for role from GiftConfiguration model
-            config = GiftConfiguration.objects.filter(role='winner').first()
-            points = config.points if config else 0
+        if original.get('final_results_sent') == False and instance.final_results_sent == True:
+            # Retrieve points for role from the points registry (GiftConfiguration)
+            points = get_gift_points('winner')
 
             # Retrieve proposal with maximum points
-            gs_query = GiftProposal.objects.filter(gift_search=instance)
-            if gs_query.exists():
-                proposals = list(gs_query)
-                # Sort the list 
-                sorted_proposals = sorted(proposals, key=lambda proposal: proposal.votes.count(), reverse=True)
-                winner_proposal = sorted_proposals[0]
+            # Leader as maintained by the vote signals (the instance may have been loaded before the last vote)
+            winner_id = GiftSearch.objects.filter(pk=instance.pk).values_list('leading_proposal', flat=True).first()
+            winner_proposal = GiftProposal.objects.select_related('proposed_by').filter(pk=winner_id).first()
+            if winner_proposal is not None:
                 user_profile = winner_proposal.proposed_by
 
                 # Create history record for this role
@@ -306,10 +328,10 @@ def update_gift_score_history_on_winner(sender, instance, **kwargs):
                 )
 
     elif instance.pk and instance.final_results_sent == False:
-        # If record is not new, retrieve it before value changes
-        instance_presave = GiftSearch.objects.get(pk=instance.pk)
+        # If record is not new, compare with the value loaded from the database
+        original = instance.get_original_values('final_results_sent') or {}
         # If status is changing from completed to non-completed, remove points
-        if instance_presave.final_results_sent == True and instance.final_results_sent == False:
+        if original.get('final_results_sent') == True and instance.final_results_sent == False:
             # Retrieve all proposals
             proposals = GiftProposal.objects.filter(gift_search=instance)
             for proposal in proposals:
@@ -330,9 +352,8 @@ def update_gift_score_history_on_winner(sender, instance, **kwargs):
 @receiver(post_save, sender=GiftProposal)
 def update_gift_score_history_on_proposal(sender, instance, created, **kwargs):
     if created:
-        # Retrieve points for role from GiftConfiguration model
-        config = GiftConfiguration.objects.filter(role='proposer').first()
-        points = config.points if config else 0
+        # Retrieve points for role from the points registry (GiftConfiguration)
+        points = get_gift_points('proposer')
 
         # Create history record for this role
         GiftScoreHistory.objects.create(
@@ -386,12 +407,8 @@ def update_transactions_from_gift_contribution(sender, instance, **kwargs):
 # Helper function to calculate the gift score of a user by summing up all point changes from GiftScoreHistory
 # -------------------------------------------------------------
 def update_gift_score(user_profile):
-    # Calculate the sum of all points_change values for the given user profile
-    aggregate = GiftScoreHistory.objects.filter(user_profile=user_profile).aggregate(total=Sum('points_change'))
-    total = aggregate['total'] if aggregate['total'] is not None else 0
-    # Save calculated points to profile of the user
-    user_profile.gift_score = total
-    user_profile.save(update_fields=['gift_score', 'total_score', 'total_score_past'])
+    # Full re-aggregation (the signals below apply deltas instead)
+    recalculate_score(user_profile, 'gift')
 
 
 
@@ -400,8 +417,8 @@ def update_gift_score(user_profile):
 # -------------------------------------------------------------
 @receiver(post_save, sender=GiftScoreHistory)
 def update_gift_score_on_save(sender, instance, created, **kwargs):
-    # Recalculate the gift score
-    update_gift_score(instance.user_profile)
+    # Apply the change of points to the gift score
+    apply_history_saved(instance, created)
 
 
 
@@ -410,8 +427,8 @@ def update_gift_score_on_save(sender, instance, created, **kwargs):
 # -------------------------------------------------------------
 @receiver(post_delete, sender=GiftScoreHistory)
 def update_gift_score_on_delete(sender, instance, **kwargs):
-    # Recalculate the gift score
-    update_gift_score(instance.user_profile)
+    # Remove the points of the record from the gift score
+    apply_history_deleted(instance)
 
 
 
@@ -424,11 +441,9 @@ def update_gift_score_on_delete(sender, instance, **kwargs):
 @receiver(pre_save, sender=Transaction)
 def capture_old_transaction_status(sender, instance, **kwargs):
     if instance.pk:
-        try:
-            old_instance = Transaction.objects.get(pk=instance.pk)
-            instance._old_status = old_instance.status
-        except Transaction.DoesNotExist:
-            instance._old_status = None
+        # Status as loaded from the database (None if the record does not exist yet)
+        original = instance.get_original_values('status')
+        instance._old_status = original['status'] if original else None
     else:
         instance._old_status = None
 
@@ -581,12 +596,8 @@ def delete_payment_score_history_on_payment_delete(sender, instance, **kwargs):
 # Helper function to calculate the payment score of a user by summing up all point changes from PaymentScoreHistory
 # -------------------------------------------------------------
 def update_payment_score(user_profile):
-    # Calculate the sum of all points_awarded values for the given user profile
-    aggregate = PaymentScoreHistory.objects.filter(user_profile=user_profile).aggregate(total=Sum('points_awarded'))
-    total = aggregate['total'] if aggregate['total'] is not None else 0
-    # Save calculated points to profile of the user
-    user_profile.payment_score = total
-    user_profile.save(update_fields=['payment_score', 'total_score', 'total_score_past'])
+    # Full re-aggregation (the signals below apply deltas instead)
+    recalculate_score(user_profile, 'payment')
 
 
 
@@ -595,8 +606,8 @@ def update_payment_score(user_profile):
 # -------------------------------------------------------------
 @receiver(post_save, sender=PaymentScoreHistory)
 def update_payment_score_on_save(sender, instance, created, **kwargs):
-    # Recalculate the payment score
-    update_payment_score(instance.user_profile)
+    # Apply the change of points to the payment score
+    apply_history_saved(instance, created)
 
 
 
@@ -605,8 +616,10 @@ def update_payment_score_on_save(sender, instance, created, **kwargs):
 # -------------------------------------------------------------
 @receiver(post_delete, sender=PaymentScoreHistory)
 def update_payment_score_on_delete(sender, instance, **kwargs):
-    # Recalculate the payment score
-    update_payment_score(instance.user_profile)
+    # Remove the points of the record from the payment score
+    apply_history_deleted(instance)
+
+
 
 
 
@@ -615,3 +628,56 @@ def update_payment_score_on_delete(sender, instance, **kwargs):
 
 
 
+
+
+# -------------------------------------------------------------
+# POINTS REGISTRY
+# -------------------------------------------------------------
+# Signal triggered every time a RoleConfiguration or GiftConfiguration record is saved or deleted
+# -------------------------------------------------------------
+@receiver(post_save, sender=RoleConfiguration)
+@receiver(post_delete, sender=RoleConfiguration)
+@receiver(post_save, sender=GiftConfiguration)
+@receiver(post_delete, sender=GiftConfiguration)
+def invalidate_points_registry_on_change(sender, **kwargs):
+    # Configured points are reloaded on next access
+    invalidate_points_registry()
+
+
+
+
+# -------------------------------------------------------------
+# SCORES VERSION
+# -------------------------------------------------------------
+# Signal triggered every time a UserProfile or PastUserScores record is saved or deleted
+# -------------------------------------------------------------
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+@receiver(post_save, sender=PastUserScores)
+@receiver(post_delete, sender=PastUserScores)
+def bump_scores_version_on_change(sender, **kwargs):
+    # Cached leaderboards are rebuilt on next access
+    bump_scores_version()
+
+
+
+
+# -------------------------------------------------------------
+# CALENDAR VERSION
+# -------------------------------------------------------------
+# Signal triggered every time a record shown in the calendar feed is saved or deleted
+# -------------------------------------------------------------
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+@receiver(post_save, sender=GiftSearch)
+@receiver(post_delete, sender=GiftSearch)
+@receiver(post_save, sender=GiftContribution)
+@receiver(post_delete, sender=GiftContribution)
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def bump_calendar_version_on_change(sender, update_fields=None, **kwargs):
+    # Score updates of a user profile do not change the calendar (only the birthday is shown)
+    if sender is UserProfile and update_fields is not None and 'birthday' not in update_fields:
+        return
+    # Cached calendar entries are rebuilt on next access
+    increase_version_on_change(CALENDAR_VERSION_KEY)
@@ -0,0 +1,15 @@
+import pytest
+from django.core.cache import cache
+from event_planner import points_registry
+
+
+
+# --- Fixtures ---
+@pytest.fixture(autouse=True)
+def clear_caches():
+    # Data of a test is rolled back without signals, registry and cached leaderboards must not keep it
+    points_registry.clear_points_registry()
+    cache.clear()
+    yield
+    points_registry.clear_points_registry()
+    cache.clear()
@@ -0,0 +1,387 @@
+import pytest
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.utils import timezone
+from event_planner.models import *
+from event_planner import jobs
+from event_planner.score_index import ScoreIndex
+from event_planner.mail import mail_dispatch, send_mail
+from event_planner.score_engine import verify_scores
+from event_planner.job_locks import extend_job_lock, job_lock
+from event_planner.job_runs import count_job_metric, job_run_statistics, percentile, track_job_run
+
+
+
+User = get_user_model()
+
+
+# --- Fixtures ---
+@pytest.fixture
+def create_userprofile(db):
+    def make_userprofile(username="testuser", **scores):
+        user = User.objects.create(username=username)
+        profile = UserProfile.objects.get(user=user)
+        for field, value in scores.items():
+            setattr(profile, field, value)
+        profile.save()
+        return profile
+    return make_userprofile
+
+
+@pytest.fixture(autouse=True)
+def override_job_config(monkeypatch):
+    monkeypatch.setitem(jobs.JOB_CONFIG, 'store_user_scores', {'enabled': True, 'interval': 24, 'rank_change_interval': 30})
+
+
+# --- Tests for store_user_scores ---
+@pytest.mark.django_db
+def test_store_user_scores_upserts_and_sets_past_scores(create_userprofile, monkeypatch):
+    monkeypatch.setattr(jobs, "STORE_SCORES_CHUNK_SIZE", 1)
+    today = timezone.now().date()
+    profile = create_userprofile("store_a", task_score=5, role_score=3)
+    other = create_userprofile("store_b", gift_score=7)
+    # Existing record of today is updated, record from 30 days ago is used for past scores
+    PastUserScores.objects.create(user=profile.user, score_date=today, total_score=1, task_score=1)
+    PastUserScores.objects.create(
+        user=profile.user, score_date=today - timedelta(days=30),
+        total_score=6, task_score=2, role_score=1, gift_score=2, payment_score=1)
+
+    jobs.store_user_scores()
+
+    stored = PastUserScores.objects.get(user=profile.user, score_date=today)
+    assert (stored.total_score, stored.task_score, stored.role_score) == (8, 5, 3)
+    assert PastUserScores.objects.get(user=other.user, score_date=today).gift_score == 7
+    profile.refresh_from_db()
+    other.refresh_from_db()
+    assert (profile.task_score_past, profile.role_score_past, profile.gift_score_past, profile.payment_score_past) == (2, 1, 2, 1)
+    assert profile.total_score_past == 6
+    # Without record from 30 days ago past scores are unchanged
+    assert other.total_score_past == 0
+
+
+# --- Tests for the score index ---
+@pytest.mark.django_db
+def test_score_index_finds_closest_competitors(create_userprofile):
+    create_userprofile("index_low", task_score=5)
+    create_userprofile("index_mid", task_score=10)
+    create_userprofile("index_tie", task_score=10)
+    high = create_userprofile("index_high", task_score=20)
+    score_index = ScoreIndex.build()
+    assert score_index.above(10).username == "index_high"
+    assert score_index.below(10).username == "index_low"
+    assert score_index.above(20) is None
+    assert score_index.below(5) is None
+
+    # Changed scores move the user within the index
+    score_index.update(high.pk, 1)
+    assert score_index.above(10) is None
+    assert score_index.below(5).username == "index_high"
+
+
+# --- Tests for idempotent job emails ---
+@pytest.mark.django_db
+def test_job_rerun_does_not_enqueue_emails_twice(create_userprofile, monkeypatch, settings):
+    settings.MAIL_USE_OUTBOX = True
+    monkeypatch.setitem(jobs.JOB_CONFIG, 'check_payment_reminder', {'enabled': True, 'overdue_threshold': 7})
+    monkeypatch.setitem(jobs.JOB_CONFIG, 'send_digest_emails', {'enabled': False})
+    payer = create_userprofile("reminder_payer")
+    payee = create_userprofile("reminder_payee")
+    payer.user.email = "payer@example.com"
+    payer.user.save()
+    transaction = Transaction.objects.create(from_user=payer, to_user=payee, amount=10, type="event", status="billed")
+    Transaction.objects.filter(pk=transaction.pk).update(created_at=timezone.now() - timedelta(days=1))
+
+    # A second run on the same day finds the queued reminder by its idempotency key
+    jobs.check_payment_reminder()
+    jobs.check_payment_reminder()
+    assert list(EmailOutbox.objects.values_list('idempotency_key', flat=True)) == [
+        f"check_payment_reminder:{transaction.pk}:billed:{timezone.localdate().isoformat()}"]
+
+
+@pytest.mark.django_db
+def test_failed_invitation_is_sent_again_on_next_run(create_userprofile, monkeypatch, settings):
+    settings.MAIL_USE_OUTBOX = False
+    settings.MAIL_MAX_RETRIES = 0
+    monkeypatch.setitem(jobs.JOB_CONFIG, 'send_digest_emails', {'enabled': False})
+    donee = create_userprofile("invitation_donee")
+    guest = create_userprofile("invitation_guest")
+    gift_search = GiftSearch.objects.create(title="Gift", purpose="Birthday", donee=donee, created_by=donee,
+                                            deadline=timezone.now().date() + timedelta(days=7))
+    settings.EMAIL_BACKEND = 'event_planner.tests.test_mail.UnreachableBackend'
+    jobs.send_gift_search_invitation()
+    gift_search.refresh_from_db()
+    assert not gift_search.invitation_sent
+
+    settings.EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+    jobs.send_gift_search_invitation()
+    gift_search.refresh_from_db()
+    assert gift_search.invitation_sent
+    assert [message.to for message in mail.outbox] == [[guest.user.email]]
+
+
+
+# --- Tests for digest emails ---
+@pytest.mark.django_db
+def test_digest_collects_notifications_and_sends_one_email_per_user(monkeypatch, settings):
+    settings.MAIL_USE_OUTBOX = False
+    monkeypatch.setitem(jobs.JOB_CONFIG, 'send_digest_emails', {'enabled': True, 'window': 'hourly', 'jobs': ['check_payment_reminder']})
+    with mail_dispatch('check_payment_reminder'):
+        for i in range(3):
+            send_mail(f"Reminder {i}", f"Body {i}", "from@example.com", ["alice@example.com"])
+        send_mail("Reminder", "Only one", "from@example.com", ["bob@example.com"])
+    # Jobs without digest send immediately
+    with mail_dispatch('send_invitation_email'):
+        send_mail("Invitation", "Body", "from@example.com", ["alice@example.com"])
+    assert [message.subject for message in mail.outbox] == ["Invitation"]
+    assert DigestNotification.objects.count() == 4
+
+    # Notifications of the current window are kept
+    jobs.send_digest_emails()
+    assert len(mail.outbox) == 1
+
+    DigestNotification.objects.update(created_at=timezone.now() - timedelta(hours=2))
+    jobs.send_digest_emails()
+    digest = next(message for message in mail.outbox if message.to == ["alice@example.com"] and message.subject != "Invitation")
+    assert digest.subject == "Your 21 Celebrations digest: 3 notifications"
+    assert "--- Reminder 0 ---" in digest.body and "Body 2" in digest.body
+    single = next(message for message in mail.outbox if message.to == ["bob@example.com"])
+    assert (single.subject, single.body) == ("Reminder", "Only one")
+    assert not DigestNotification.objects.exists()
+
+
+@pytest.mark.django_db
+def test_digest_keeps_notifications_of_failed_sends(monkeypatch, settings):
+    settings.MAIL_USE_OUTBOX = False
+    settings.MAIL_MAX_RETRIES = 0
+    monkeypatch.setitem(jobs.JOB_CONFIG, 'send_digest_emails', {'enabled': True, 'window': 'hourly', 'jobs': []})
+    DigestNotification.objects.create(recipient="alice@example.com", job="check_payment_reminder", subject="Reminder", body="Body",
+                                      created_at=timezone.now() - timedelta(hours=2))
+    settings.EMAIL_BACKEND = 'event_planner.tests.test_mail.UnreachableBackend'
+    jobs.send_digest_emails()
+    assert DigestNotification.objects.count() == 1
+
+    # The next run sends the kept notification
+    settings.EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+    jobs.send_digest_emails()
+    assert [message.subject for message in mail.outbox] == ["Reminder"]
+    assert not DigestNotification.objects.exists()
+
+
+@pytest.mark.django_db
+def test_disabled_digest_sends_all_collected_notifications(monkeypatch, settings):
+    settings.MAIL_USE_OUTBOX = False
+    monkeypatch.setitem(jobs.JOB_CONFIG, 'send_digest_emails', {'enabled': False, 'window': 'daily', 'jobs': []})
+    # Notifications of the current window are sent as well
+    DigestNotification.objects.create(recipient="alice@example.com", job="check_payment_reminder", subject="Reminder", body="Body")
+    jobs.send_digest_emails()
+    assert [message.subject for message in mail.outbox] == ["Reminder"]
+    assert not DigestNotification.objects.exists()
+
+
+# --- Tests for status transitions ---
+@pytest.mark.django_db
+def test_update_event_status_moves_each_event_one_step(create_userprofile):
+    today = timezone.now().date()
+    payer = create_userprofile("transition_payer")
+    payee = create_userprofile("transition_payee")
+    planned = Event.objects.create(title="Planned", status='planned', date=today - timedelta(days=1), time=timezone.now().time(), location="Hall")
+    unplanned = Event.objects.create(title="Unplanned", status='planned', date=today, location="")
+    active = Event.objects.create(title="Active", status='active', date=today - timedelta(days=1))
+    billed = Event.objects.create(title="Billed", status='billed', date=today)
+    open_billed = Event.objects.create(title="Open billed", status='billed', date=today)
+    empty_billed = Event.objects.create(title="Empty billed", status='billed', date=today)
+    Transaction.objects.create(from_user=payer, to_user=payee, event=billed, status='confirmed')
+    Transaction.objects.create(from_user=payer, to_user=payee, event=open_billed, status='confirmed')
+    Transaction.objects.create(from_user=payer, to_user=payee, event=open_billed, status='paid')
+
+    jobs.update_event_status()
+
+    statuses = dict(Event.objects.values_list('title', 'status'))
+    # Planned event with a past date becomes active only (completed in the next run)
+    assert statuses["Planned"] == 'active'
+    assert statuses["Unplanned"] == 'planned'
+    assert statuses["Active"] == 'completed'
+    assert statuses["Billed"] == 'paid'
+    assert statuses["Open billed"] == 'billed'
+    assert statuses["Empty billed"] == 'billed'
+
+
+@pytest.mark.django_db
+def test_update_contribution_status_closes_and_bills_once(create_userprofile, monkeypatch):
+    today = timezone.now().date()
+    manager = create_userprofile("transition_manager")
+    contributor = create_userprofile("transition_contributor")
+    donee = create_userprofile("transition_donee")
+    expired = GiftContribution.objects.create(title="Expired", description="", donee=donee, manager=manager, deadline=today - timedelta(days=1))
+    running = GiftContribution.objects.create(title="Running", description="", donee=donee, manager=manager, deadline=today + timedelta(days=1))
+    Contribution.objects.create(gift_contribution=expired, contributor=contributor, value=10)
+    billing_runs = []
+    monkeypatch.setattr(jobs, "send_gift_contribution_billing_email", lambda: billing_runs.append(True))
+
+    jobs.update_contribution_status()
+
+    expired.refresh_from_db()
+    running.refresh_from_db()
+    assert (expired.status, running.status) == ('closed', 'open')
+    # Side effects (transactions of the post_save signal) only for the closed contribution
+    assert Transaction.objects.filter(gift_contribution=expired, from_user=contributor, status='billed').count() == 1
+    assert not Transaction.objects.filter(gift_contribution=running).exists()
+    assert billing_runs == [True]
+
+
+# --- Tests for bulk overdue processing ---
+def create_overdue_scenario(create_userprofile, prefix):
+    # Same tasks and users for each prefix: shared assignees, preset points and an outdated penalty record
+    event = Event.objects.create(title=f"{prefix} Event")
+    alice = create_userprofile(f"{prefix}_alice", role_score=7)
+    bob = create_userprofile(f"{prefix}_bob")
+    future = timezone.now() + timedelta(days=1)
+    first = Task.objects.create(event=event, title=f"{prefix} first", due_date=future, penalty_points=-5)
+    second = Task.objects.create(event=event, title=f"{prefix} second", due_date=future, penalty_points=-3, points_awarded=2)
+    third = Task.objects.create(event=event, title=f"{prefix} third", due_date=future, penalty_points=0)
+    first.assigned_to.set([alice, bob])
+    second.assigned_to.set([alice])
+    third.assigned_to.set([bob])
+    TaskScoreHistory.objects.create(task=second, user_profile=alice, score_type='penalty', points_change=-1)
+    Task.objects.filter(pk__in=[first.pk, second.pk, third.pk]).update(due_date=timezone.now() - timedelta(hours=1))
+    return [first, second, third], [alice, bob]
+
+
+def overdue_results(tasks, profiles):
+    # Results without the prefix of the scenario
+    profile_results = [
+        (profile.task_score, profile.total_score, sum(ScoreLedger.objects.filter(user_profile=profile, category='task').values_list('points', flat=True)))
+        for profile in UserProfile.objects.filter(pk__in=[p.pk for p in profiles]).order_by('pk')
+    ]
+    task_results = list(Task.objects.filter(pk__in=[t.pk for t in tasks]).order_by('pk').values_list('status', 'points_awarded'))
+    history_results = sorted(
+        TaskScoreHistory.objects.filter(task__in=tasks).values_list('task__title', 'user_profile__user__username', 'score_type', 'points_change')
+    )
+    history_results = [(title.split(" ", 1)[1], username.split("_", 1)[1], *rest) for title, username, *rest in history_results]
+    return profile_results, task_results, history_results
+
+
+@pytest.mark.django_db
+def test_bulk_overdue_matches_per_row_saves(create_userprofile):
+    row_tasks, row_profiles = create_overdue_scenario(create_userprofile, "row")
+    bulk_tasks, bulk_profiles = create_overdue_scenario(create_userprofile, "bulk")
+
+    # Per-row path: save each task (signals)
+    for task in Task.objects.filter(pk__in=[t.pk for t in row_tasks]):
+        task.status = 'overdue'
+        task.save()
+
+    # Bulk path
+    jobs.mark_tasks_overdue(list(
+        Task.objects.filter(pk__in=[t.pk for t in bulk_tasks]).select_related('event').prefetch_related('assigned_to')
+    ))
+
+    assert overdue_results(row_tasks, row_profiles) == overdue_results(bulk_tasks, bulk_profiles)
+    assert verify_scores(user_profiles=bulk_profiles, categories=['task']) == []
+    assert ScoreLedger.objects.filter(user_profile__in=bulk_profiles, category='task').count() == 4
+
+
+@pytest.mark.django_db
+def test_check_overdue_tasks_applies_penalties_and_mails(create_userprofile, settings):
+    settings.MAIL_USE_OUTBOX = False
+    tasks, (alice, bob) = create_overdue_scenario(create_userprofile, "job")
+    User.objects.filter(pk__in=[alice.user_id, bob.user_id]).update(email="user@example.com")
+
+    jobs.check_overdue_tasks()
+
+    alice.refresh_from_db()
+    assert (alice.task_score, alice.total_score) == (-8, -1)
+    assert set(Task.objects.filter(pk__in=[t.pk for t in tasks]).values_list('status', flat=True)) == {'overdue'}
+    # One mail per task and assignee
+    assert len(mail.outbox) == 4
+
+
+# --- Tests for job locks ---
+@pytest.mark.django_db
+def test_job_lock_skips_overlapping_run():
+    with job_lock('test_job') as first:
+        with job_lock('test_job') as second:
+            pass
+    assert (first, second) == (True, False)
+    lock = JobLock.objects.get(job_id='test_job')
+    assert (lock.owner, lock.expires_at, lock.skipped_count) == ('', None, 1)
+    assert lock.last_skipped_at is not None
+    # Released lease is acquired again
+    with job_lock('test_job') as third:
+        assert third
+
+
+@pytest.mark.django_db
+def test_job_lock_takes_over_expired_lease():
+    JobLock.objects.create(job_id='test_job', owner='crashed', expires_at=timezone.now() - timedelta(seconds=1))
+    with job_lock('test_job') as acquired:
+        assert acquired
+        lock = JobLock.objects.get(job_id='test_job')
+        assert lock.owner != 'crashed'
+        assert lock.expires_at > timezone.now()
+        assert extend_job_lock('test_job', lock.owner, 60)
+        assert not extend_job_lock('test_job', 'crashed', 60)
+
+
+@pytest.mark.django_db
+def test_scheduled_job_is_skipped_while_running(create_userprofile):
+    create_userprofile("locked", task_score=5)
+    JobLock.objects.create(job_id='store_user_scores', owner='other', expires_at=timezone.now() + timedelta(minutes=5))
+    jobs.store_user_scores()
+    assert not PastUserScores.objects.exists()
+    assert JobLock.objects.get(job_id='store_user_scores').skipped_count == 1
+
+
+# --- Tests for job runs ---
+@pytest.mark.django_db
+def test_job_run_records_queries_rows_and_emails():
+    def fill_events():
+        Event.objects.create(title="Tracked", date=timezone.localdate())
+        Event.objects.update(description="updated")
+        count_job_metric('emails_queued', 3)
+        return "done"
+
+    assert track_job_run(fill_events)() == "done"
+    # Outside of a job run nothing is counted
+    count_job_metric('emails_queued')
+    run = JobRun.objects.get(job_id='fill_events')
+    assert run.status == 'succeeded'
+    assert (run.query_count, run.rows_processed, run.emails_queued) == (2, 2, 3)
+    assert run.duration >= 0 and run.finished_at is not None
+
+
+@pytest.mark.django_db
+def test_job_run_records_failures_and_skips(create_userprofile):
+    def broken_job():
+        raise ValueError("broken")
+
+    with pytest.raises(ValueError):
+        track_job_run(broken_job)()
+    run = JobRun.objects.get(job_id='broken_job')
+    assert run.status == 'failed'
+    assert "ValueError: broken" in run.error
+
+    JobLock.objects.create(job_id='store_user_scores', owner='other', expires_at=timezone.now() + timedelta(minutes=5))
+    track_job_run(jobs.store_user_scores)()
+    assert JobRun.objects.get(job_id='store_user_scores').status == 'skipped'
+
+
+@pytest.mark.django_db
+def test_job_run_statistics_and_retention(settings):
+    settings.JOB_RUN_RETENTION = 30
+    now = timezone.now()
+    for days, duration in [(1, 1.0), (2, 3.0), (3, 2.0), (8, 1.0), (9, 1.0)]:
+        JobRun.objects.create(job_id='stats_job', status='succeeded', started_at=now - timedelta(days=days), duration=duration, query_count=4)
+    JobRun.objects.create(job_id='stats_job', status='skipped', started_at=now)
+    old = JobRun.objects.create(job_id='stats_job', status='succeeded', started_at=now - timedelta(days=40), duration=50.0)
+
+    [statistics] = job_run_statistics()
+    assert (statistics['runs'], statistics['skipped'], statistics['failed']) == (6, 1, 0)
+    assert (statistics['p50'], statistics['p95'], statistics['avg_queries']) == (1.0, 3.0, 4)
+    assert (statistics['trend_p50'], statistics['trend_change']) == (2.0, 100.0)
+    assert percentile([], 50) is None
+
+    # A new run of the job removes runs older than the retention
+    track_job_run(lambda: None, job_id='stats_job')()
+    assert not JobRun.objects.filter(pk=old.pk).exists()
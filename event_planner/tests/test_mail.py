@@ -0,0 +1,215 @@
+import pytest
+from datetime import timedelta
+from io import StringIO
+from django.core import mail
+from django.core.mail import EmailMessage, EmailMultiAlternatives
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from event_planner.mail import MailDispatcher, mail_dispatch, send_mail, send_message, confirm_sent, drain_outbox, get_outbox_lease
+from event_planner.models import EmailOutbox
+
+
+
+# --- Test backends ---
+class CountingBackend(EmailBackend):
+    opened = 0
+
+    def open(self):
+        CountingBackend.opened += 1
+        return True
+
+
+class UnreachableBackend(EmailBackend):
+    def open(self):
+        raise ConnectionRefusedError("connection refused")
+
+
+class FlakyBackend(EmailBackend):
+    failures = 0
+
+    def send_messages(self, messages):
+        if FlakyBackend.failures:
+            FlakyBackend.failures -= 1
+            raise ConnectionError("connection lost")
+        return super().send_messages(messages)
+
+
+# --- Fixtures ---
+@pytest.fixture(autouse=True)
+def send_without_outbox(settings):
+    settings.MAIL_USE_OUTBOX = False
+
+
+@pytest.fixture
+def use_outbox(settings):
+    settings.MAIL_USE_OUTBOX = True
+
+
+# --- Tests for the mail dispatcher ---
+def test_dispatch_uses_one_connection(settings):
+    settings.EMAIL_BACKEND = 'event_planner.tests.test_mail.CountingBackend'
+    CountingBackend.opened = 0
+    with mail_dispatch('test_job', batch_size=2):
+        for i in range(5):
+            send_mail(f"Subject {i}", "Body", "from@example.com", [f"user{i}@example.com"])
+        # Full batches are sent, the rest is queued
+        assert len(mail.outbox) == 4
+    assert len(mail.outbox) == 5
+    assert CountingBackend.opened == 1
+
+
+def test_nested_dispatch_joins_outer_dispatch(settings):
+    @mail_dispatch('inner_job')
+    def notify():
+        send_mail("Subject", "Body", "from@example.com", ["user@example.com"])
+
+    with mail_dispatch('outer_job') as dispatcher:
+        notify()
+        notify()
+        assert mail.outbox == []
+    assert dispatcher.sent == 2
+
+
+def test_messages_are_built_lazily():
+    built = []
+
+    def build():
+        built.append(True)
+        return EmailMessage("Subject", "Body", "from@example.com", ["user@example.com"])
+
+    dispatcher = MailDispatcher('lazy_job', batch_size=10)
+    dispatcher.add(build)
+    assert built == []
+    dispatcher.close()
+    assert built == [True]
+    assert len(mail.outbox) == 1
+
+
+def test_dispatch_reconnects_and_counts_failures(settings, caplog):
+    settings.EMAIL_BACKEND = 'event_planner.tests.test_mail.FlakyBackend'
+    # First message succeeds after one reconnect, second one fails after all retries
+    FlakyBackend.failures = 1
+    caplog.set_level('INFO', logger='event_planner.mail')
+    dispatcher = MailDispatcher('flaky_job', max_retries=1)
+    dispatcher.add(EmailMessage("First", "Body", "from@example.com", ["a@example.com"]))
+    dispatcher.flush()
+    FlakyBackend.failures = 2
+    dispatcher.add(EmailMessage("Second", "Body", "from@example.com", ["b@example.com"]))
+    dispatcher.close()
+    assert (dispatcher.sent, dispatcher.failed) == (1, 1)
+    assert [message.subject for message in mail.outbox] == ["First"]
+    assert "flaky_job: 1 mails sent, 1 failed" in caplog.text
+
+
+
+def test_confirm_sent_reports_failed_messages(settings):
+    settings.EMAIL_BACKEND = 'event_planner.tests.test_mail.FlakyBackend'
+    FlakyBackend.failures = 0
+    with mail_dispatch('confirm_job', max_retries=0):
+        send_mail("First", "Body", "from@example.com", ["a@example.com"])
+        assert confirm_sent()
+        FlakyBackend.failures = 1
+        send_mail("Second", "Body", "from@example.com", ["b@example.com"])
+        assert not confirm_sent()
+        # Failures are reported once
+        assert confirm_sent()
+    assert [message.subject for message in mail.outbox] == ["First"]
+
+def test_send_mail_outside_dispatch_is_sent_immediately():
+    send_mail("Subject", "Body", "from@example.com", ["user@example.com"])
+    assert len(mail.outbox) == 1
+
+
+# --- Tests for the email outbox ---
+@pytest.mark.django_db
+def test_enqueue_is_one_insert_and_idempotent(use_outbox):
+    with CaptureQueriesContext(connection) as queries:
+        send_mail("Subject", "Body", "from@example.com", ["user@example.com"], idempotency_key="job:1:1")
+    assert len(queries) == 1
+    assert queries[0]['sql'].startswith('INSERT')
+    send_mail("Subject", "Body", "from@example.com", ["user@example.com"], idempotency_key="job:1:1")
+    assert EmailOutbox.objects.count() == 1
+    assert mail.outbox == []
+
+
+
+@pytest.mark.django_db
+def test_job_mails_with_same_key_collapse_in_outbox(use_outbox):
+    with mail_dispatch('test_job'):
+        for _ in range(2):
+            send_mail("Reminder", "Body", "from@example.com", ["a@example.com"], idempotency_key="test_job:1:1")
+            send_mail("Reminder", "Body", "from@example.com", ["b@example.com"], idempotency_key="test_job:1:2")
+    assert sorted(EmailOutbox.objects.values_list('idempotency_key', flat=True)) == ["test_job:1:1", "test_job:1:2"]
+    assert mail.outbox == []
+
+
+def test_idempotency_keys_are_ignored_without_outbox():
+    # Default: mails are sent directly, nothing remembers the keys
+    with mail_dispatch('test_job'):
+        for _ in range(2):
+            send_mail("Reminder", "Body", "from@example.com", ["a@example.com"], idempotency_key="test_job:1:1")
+    assert len(mail.outbox) == 2
+
+@pytest.mark.django_db
+def test_drain_outbox_sends_pending_emails(use_outbox):
+    message = EmailMultiAlternatives("Invitation", "Text", "from@example.com", ["user@example.com"])
+    message.attach_alternative("<p>Text</p>", "text/html")
+    message.attach("event.ics", "BEGIN:VCALENDAR", "text/calendar")
+    message.attach("logo.png", b"\x89PNG\x00\xff", "image/png")
+    send_message(message)
+    send_mail("Reminder", "Body", "from@example.com", ["other@example.com"])
+
+    assert drain_outbox() == 2
+    assert sorted(sent.subject for sent in mail.outbox) == ["Invitation", "Reminder"]
+    invitation = next(sent for sent in mail.outbox if sent.subject == "Invitation")
+    assert invitation.alternatives == [("<p>Text</p>", "text/html")]
+    # Binary attachments are stored as base64 and sent unchanged
+    assert invitation.attachments == [("event.ics", "BEGIN:VCALENDAR", "text/calendar"), ("logo.png", b"\x89PNG\x00\xff", "image/png")]
+    assert set(EmailOutbox.objects.values_list('status', flat=True)) == {'sent'}
+    # Sent emails are not sent again
+    assert drain_outbox() == 0
+
+
+@pytest.mark.django_db
+def test_failed_outbox_email_is_retried_with_backoff(use_outbox, settings):
+    settings.EMAIL_BACKEND = 'event_planner.tests.test_mail.FlakyBackend'
+    settings.MAIL_MAX_RETRIES = 0
+    settings.MAIL_OUTBOX_MAX_ATTEMPTS = 2
+    settings.MAIL_OUTBOX_BACKOFF = 60
+    FlakyBackend.failures = 10
+    send_mail("Subject", "Body", "from@example.com", ["user@example.com"])
+
+    drain_outbox()
+    entry = EmailOutbox.objects.get()
+    assert (entry.status, entry.attempts, entry.last_error) == ('pending', 1, "connection lost")
+    assert entry.next_attempt_at > timezone.now() + timedelta(seconds=50)
+
+    # Second attempt is the last one
+    EmailOutbox.objects.update(next_attempt_at=timezone.now())
+    drain_outbox()
+    entry.refresh_from_db()
+    assert (entry.status, entry.attempts) == ('failed', 2)
+    FlakyBackend.failures = 0
+
+
+@pytest.mark.django_db
+def test_connect_failure_releases_outbox_email(use_outbox, settings):
+    settings.EMAIL_BACKEND = 'event_planner.tests.test_mail.UnreachableBackend'
+    send_mail("Subject", "Body", "from@example.com", ["user@example.com"])
+    assert drain_outbox() == 1
+    entry = EmailOutbox.objects.get()
+    # Failed attempt is scheduled with backoff instead of staying claimed by the lease
+    assert (entry.status, entry.attempts, entry.last_error) == ('pending', 1, "connection refused")
+    assert entry.next_attempt_at < timezone.now() + timedelta(seconds=get_outbox_lease())
+
+
+@pytest.mark.django_db
+def test_send_outbox_command(use_outbox):
+    send_mail("Subject", "Body", "from@example.com", ["user@example.com"])
+    out = StringIO()
+    call_command('send_outbox', '--once', stdout=out)
+    assert "1 outbox emails processed." in out.getvalue()
+    assert len(mail.outbox) == 1
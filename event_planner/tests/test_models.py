@@ -2,7 +2,8 @@ import pytest
 from datetime import date, timedelta
 from decimal import Decimal
 from django.core.exceptions import ValidationError
-from django.db import IntegrityError
+from django.db import IntegrityError, connection
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
 from event_planner.models import *
 
@@ -2262,3 +2263,82 @@ class TestTaskScoreHistory:
 
 
 
+
+
+
+# -------------------------------------------------------------
+# Tests for GiftProposal
+# -------------------------------------------------------------
+@pytest.mark.django_db
+class TestGiftProposal:
+    def create_proposals(self, donee, proposer, titles):
+        gift_search = GiftSearch.objects.create(title='Gift', purpose='Purpose', deadline=date.today(), donee=donee, created_by=proposer)
+        return [GiftProposal.objects.create(gift_search=gift_search, title=title, description='', proposed_by=proposer) for title in titles]
+
+    def test_ranked_counts_up_votes(self, user_profile1, user_profile2, test_user3, test_user4):
+        first, second, third = self.create_proposals(user_profile1, user_profile2, ['First', 'Second', 'Third'])
+        second.votes.up(test_user3.pk)
+        second.votes.up(test_user4.pk)
+        third.votes.up(test_user3.pk)
+        first.votes.down(test_user4.pk)
+        ranked = list(GiftProposal.objects.ranked())
+        assert [proposal.title for proposal in ranked] == ['Second', 'Third', 'First']
+        assert [proposal.vote_count for proposal in ranked] == [proposal.votes.count() for proposal in ranked]
+
+    def test_ranked_keeps_creation_order_for_ties(self, user_profile1, user_profile2):
+        self.create_proposals(user_profile1, user_profile2, ['First', 'Second'])
+        assert [proposal.title for proposal in GiftProposal.objects.ranked()] == ['First', 'Second']
+
+    def test_with_voters_in_one_query(self, user_profile1, user_profile2, test_user3, test_user4, django_assert_num_queries):
+        first, second = self.create_proposals(user_profile1, user_profile2, ['First', 'Second'])
+        first.votes.up(test_user4.pk)
+        first.votes.up(test_user3.pk)
+        # Content type is cached by the first lookup
+        ContentType.objects.get_for_model(GiftProposal)
+        with django_assert_num_queries(2):
+            proposals = list(GiftProposal.objects.ranked().with_voters())
+        assert proposals[0].voters == ['testuser3', 'testuser4']
+        assert proposals[1].voters == []
+
+    def test_vote_tallies_and_leader_follow_votes(self, user_profile1, user_profile2, test_user3, test_user4):
+        first, second = self.create_proposals(user_profile1, user_profile2, ['First', 'Second'])
+        gift_search = first.gift_search
+        gift_search.refresh_from_db()
+        # The first proposal leads without votes
+        assert (gift_search.leading_proposal, gift_search.leading_vote_count) == (first, 0)
+        second.votes.up(test_user3.pk)
+        gift_search.refresh_from_db()
+        assert (gift_search.leading_proposal, gift_search.leading_vote_count) == (second, 1)
+        first.votes.up(test_user3.pk)
+        first.votes.up(test_user4.pk)
+        second.votes.delete(test_user3.pk)
+        gift_search.refresh_from_db()
+        assert (gift_search.leading_proposal, gift_search.leading_vote_count) == (first, 2)
+        assert list(gift_search.ranked_proposals().values_list('title', 'vote_tally')) == [('First', 2), ('Second', 0)]
+        first.delete()
+        gift_search.refresh_from_db()
+        assert (gift_search.leading_proposal, gift_search.leading_vote_count) == (second, 0)
+
+    def test_stale_gift_search_keeps_leader(self, user_profile1, user_profile2, test_user3):
+        first, second = self.create_proposals(user_profile1, user_profile2, ['First', 'Second'])
+        gift_search = GiftSearch.objects.get(pk=first.gift_search_id)
+        second.votes.up(test_user3.pk)
+        gift_search.title = 'Renamed'
+        gift_search.save()
+        gift_search.refresh_from_db()
+        assert (gift_search.title, gift_search.leading_proposal, gift_search.leading_vote_count) == ('Renamed', second, 1)
+
+    def test_save_of_gift_search_loads_no_deferred_fields(self, user_profile1, user_profile2):
+        first, _ = self.create_proposals(user_profile1, user_profile2, ['First', 'Second'])
+        gift_search = GiftSearch.objects.defer('purpose').get(pk=first.gift_search_id)
+        gift_search.title = 'Renamed'
+        with CaptureQueriesContext(connection) as queries:
+            gift_search.save()
+        assert [query['sql'].split()[0] for query in queries if not query['sql'].startswith(('SAVEPOINT', 'RELEASE'))] == ['UPDATE']
+        assert GiftSearch.objects.get(pk=gift_search.pk).title == 'Renamed'
+
+    def test_save_of_deleted_proposal_inserts_it_again(self, user_profile1, user_profile2):
+        first, _ = self.create_proposals(user_profile1, user_profile2, ['First', 'Second'])
+        GiftProposal.objects.filter(pk=first.pk).delete()
+        first.save()
+        assert GiftProposal.objects.filter(pk=first.pk).exists()
@@ -0,0 +1,81 @@
+import pytest
+from datetime import date, time
+from io import StringIO
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.management import call_command
+from django.template.loader import render_to_string
+from event_planner.models import *
+from event_planner.notifications import INVITATION_EMAIL, NotificationTemplate, get_compiled_template
+from event_planner import jobs, notifications
+
+
+
+User = get_user_model()
+
+
+# --- Fixtures ---
+@pytest.fixture(autouse=True)
+def send_without_outbox(settings):
+    settings.MAIL_USE_OUTBOX = False
+
+
+@pytest.fixture
+def invitation_context():
+    event = Event(title="Summer <Party>", date=date(2025, 6, 21), time=time(18, 0), location="Town Hall")
+    return {'event': event, 'attendance_points': 10, 'attend_url': "http://example.com/attend/1/"}
+
+
+# --- Tests for prepared notifications ---
+def test_prepared_rendering_matches_full_rendering(invitation_context):
+    recipient = {'username': "alice", 'ranking_message': "Keep going!"}
+    _, html = INVITATION_EMAIL.prepare(**invitation_context).render(**recipient)
+    assert html == render_to_string("email/invitation_email.html", dict(invitation_context, recipient=recipient))
+
+
+def test_recipient_fields_are_escaped_in_html_only(invitation_context):
+    text, html = INVITATION_EMAIL.prepare(**invitation_context).render(username="<bob>", ranking_message="A & B")
+    assert "Dear <bob>," in text
+    assert "A & B" in text
+    assert "Dear &lt;bob&gt;," in html
+    assert "A &amp; B" in html
+    # Shared fields are escaped by the template
+    assert "Summer &lt;Party&gt;" in html
+    assert "Summer <Party>" in text
+
+
+def test_templates_are_compiled_once(invitation_context, monkeypatch):
+    loaded = []
+    original_get_template = notifications.get_template
+
+    def get_template(name):
+        loaded.append(name)
+        return original_get_template(name)
+
+    get_compiled_template.cache_clear()
+    monkeypatch.setattr(notifications, "get_template", get_template)
+    template = NotificationTemplate('invitation_email', ['username', 'ranking_message'])
+    template.prepare(**invitation_context)
+    template.prepare(**invitation_context)
+    assert loaded == ["email/invitation_email.txt", "email/invitation_email.html"]
+    get_compiled_template.cache_clear()
+
+
+@pytest.mark.django_db
+def test_invitation_email_uses_prepared_template():
+    user = User.objects.create(username="invited", email="invited@example.com")
+    Event.objects.create(title="Garden Party", date=date.today(), time=time(18, 0), location="Garden")
+    jobs.send_invitation_email()
+    message = next(message for message in mail.outbox if message.to == ["invited@example.com"])
+    assert message.body.startswith("Dear invited,")
+    assert "Garden Party" in message.body
+    html, mimetype = message.alternatives[0]
+    assert mimetype == "text/html"
+    assert "<p>Dear invited,</p>" in html
+    assert message.attachments[0][0] == "event.ics"
+
+
+def test_benchmark_notifications_command():
+    out = StringIO()
+    call_command('benchmark_notifications', '--recipients', '5', stdout=out)
+    assert "5 recipients" in out.getvalue()
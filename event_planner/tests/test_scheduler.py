@@ -0,0 +1,179 @@
+import json
+import pytest
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from io import StringIO
+from django.core.management import call_command
+from event_planner import job_config, scheduler as scheduler_module
+from event_planner.management.commands import run_scheduler
+
+
+
+# --- Fixtures ---
+@pytest.fixture
+def stopped_scheduler():
+    yield scheduler_module.scheduler
+    scheduler_module.shutdown_scheduler(wait=False)
+    scheduler_module.scheduler.remove_all_jobs()
+
+
+# --- Tests for scheduler startup ---
+def test_loading_django_does_not_start_scheduler():
+    assert not scheduler_module.scheduler.running
+
+
+def test_reschedule_without_running_scheduler_adds_no_jobs(stopped_scheduler):
+    scheduler_module.reschedule_jobs()
+    assert stopped_scheduler.get_jobs() == []
+
+
+def test_start_scheduler_schedules_enabled_jobs(stopped_scheduler, monkeypatch):
+    monkeypatch.setitem(scheduler_module.JOB_CONFIG['send_digest_emails'], 'enabled', False)
+    monkeypatch.setitem(scheduler_module.JOB_CONFIG['store_user_scores'], 'enabled', True)
+    scheduler_module.start_scheduler()
+    # Starting twice keeps one scheduler
+    scheduler_module.start_scheduler()
+    assert stopped_scheduler.running
+    job_ids = {job.id for job in stopped_scheduler.get_jobs()}
+    assert 'store_user_scores' in job_ids
+    assert 'send_digest_emails' not in job_ids
+    scheduler_module.shutdown_scheduler()
+    assert not stopped_scheduler.running
+
+
+def test_run_scheduler_command_stops_gracefully(stopped_scheduler, monkeypatch):
+    # The stop signal arrives as soon as the handlers are installed
+    monkeypatch.setattr(run_scheduler.signal, "signal", lambda signum, handler: handler(signum, None))
+    out = StringIO()
+    call_command('run_scheduler', stdout=out)
+    assert "Scheduler started with" in out.getvalue()
+    assert "Scheduler stopped." in out.getvalue()
+    assert not stopped_scheduler.running
+
+
+
+# --- Tests for reloading the job configuration ---
+@pytest.fixture
+def config_file(tmp_path, monkeypatch):
+    # Job configuration saved to a temporary file, restored after the test
+    path = tmp_path / "job_settings.json"
+    monkeypatch.setattr(job_config, "CONFIG_FILE_PATH", str(path))
+    monkeypatch.setitem(job_config._config_state, "version", job_config._config_state['version'])
+    original = json.loads(json.dumps(job_config.JOB_CONFIG))
+    job_config.save_job_config(job_config.JOB_CONFIG)
+    yield path
+    job_config.JOB_CONFIG.clear()
+    job_config.JOB_CONFIG.update(original)
+
+
+def save_from_other_process(path, job_id, **values):
+    config = json.loads(path.read_text())
+    config[job_id].update(values)
+    # Size changes as well, the version differs even with a coarse modification time
+    path.write_text(json.dumps(config, indent=2))
+
+
+def test_config_saved_by_other_process_is_reloaded_in_place(config_file):
+    config = scheduler_module.JOB_CONFIG
+    assert not job_config.refresh_job_config(force=True)
+    save_from_other_process(config_file, 'send_reminder_email', lead_time=12)
+    # Checked at most once per interval
+    assert not job_config.refresh_job_config()
+    assert job_config.refresh_job_config(force=True)
+    assert config is job_config.JOB_CONFIG
+    assert config['send_reminder_email']['lead_time'] == 12
+
+
+
+def test_reload_replaces_keys_and_removes_stale_jobs(config_file, monkeypatch):
+    config = job_config.JOB_CONFIG
+    monkeypatch.setitem(config, 'removed_job', {'enabled': True})
+    save_from_other_process(config_file, 'store_user_scores', interval=6)
+    assert job_config.refresh_job_config(force=True)
+    assert 'removed_job' not in config
+    assert config['store_user_scores']['interval'] == 6
+    assert set(config) == set(json.loads(config_file.read_text()))
+
+def test_sync_reschedules_only_changed_jobs(config_file, stopped_scheduler, monkeypatch):
+    for job_id in scheduler_module.SCHEDULED_JOBS:
+        monkeypatch.setitem(job_config.JOB_CONFIG[job_id], 'enabled', job_id in ('store_user_scores', 'update_event_status'))
+    job_config.save_job_config(job_config.JOB_CONFIG)
+    scheduler_module.start_scheduler()
+    unchanged_job = stopped_scheduler.get_job('update_event_status')
+
+    save_from_other_process(config_file, 'store_user_scores', interval=6)
+    save_from_other_process(config_file, 'check_overdue_tasks', enabled=True)
+    save_from_other_process(config_file, 'update_event_status', lead_time=3)
+    assert sorted(scheduler_module.sync_job_config()) == ['check_overdue_tasks', 'store_user_scores']
+    assert stopped_scheduler.get_job('store_user_scores').trigger.interval.total_seconds() == 6 * 3600
+    assert stopped_scheduler.get_job('update_event_status').next_run_time == unchanged_job.next_run_time
+    assert stopped_scheduler.get_job('sync_job_config') is not None
+    # Nothing changed since the last sync
+    assert scheduler_module.sync_job_config() == []
+
+
+
+# --- Tests for cron and time window triggers ---
+def test_cron_and_time_window_triggers(monkeypatch):
+    config = scheduler_module.JOB_CONFIG
+    monkeypatch.setitem(config, 'store_user_scores', {'enabled': True, 'interval': 24, 'cron': '30 2 * * *', 'jitter': 600})
+    monkeypatch.setitem(config, 'create_birthday_event', {'enabled': True, 'interval': 24, 'time_window': {'start': '23:00', 'end': '01:00'}, 'max_instances': 2})
+    now = datetime(2025, 6, 21, 12, 0, tzinfo=ZoneInfo('Europe/Berlin'))
+
+    cron = scheduler_module.build_trigger(scheduler_module.get_trigger_settings('store_user_scores'))
+    next_run = cron.get_next_fire_time(None, now)
+    assert (next_run.day, next_run.hour) == (22, 2)
+    assert 30 * 60 <= (next_run - next_run.replace(minute=0, second=0, microsecond=0)).total_seconds() <= 40 * 60
+
+    # Runs are spread over the window across midnight
+    window = scheduler_module.build_trigger(scheduler_module.get_trigger_settings('create_birthday_event'))
+    for _ in range(20):
+        next_run = window.get_next_fire_time(None, now)
+        assert now.replace(hour=23) <= next_run <= now.replace(day=22, hour=1)
+    assert scheduler_module.get_job_policy('create_birthday_event') == {'max_instances': 2, 'coalesce': True, 'misfire_grace_time': 300}
+
+
+
+@pytest.mark.parametrize("day_of_week, weekdays", [
+    ('0', {6}), ('7', {6}), ('1-5', {0, 1, 2, 3, 4}), ('5-7', {4, 5, 6}), ('sat,0', {5, 6}),
+])
+def test_cron_day_of_week_counts_sunday_as_0_and_7(day_of_week, weekdays):
+    cron = scheduler_module.build_trigger({'cron': f'0 9 * * {day_of_week}', 'jitter': None})
+    # Sunday, 2026-10-18 after 9:00 (seven runs cover every weekday of the expression)
+    next_run = datetime(2026, 10, 18, 12, 0, tzinfo=ZoneInfo('Europe/Berlin'))
+    fired = set()
+    for _ in range(7):
+        next_run = cron.get_next_fire_time(None, next_run + timedelta(minutes=1))
+        fired.add(next_run.weekday())
+    assert fired == weekdays
+    assert next_run.hour == 9
+
+def test_invalid_schedule_keeps_previous_schedule(stopped_scheduler, monkeypatch):
+    for job_id in scheduler_module.SCHEDULED_JOBS:
+        monkeypatch.setitem(scheduler_module.JOB_CONFIG[job_id], 'enabled', job_id == 'store_user_scores')
+    scheduler_module.start_scheduler()
+    trigger = stopped_scheduler.get_job('store_user_scores').trigger
+
+    monkeypatch.setitem(scheduler_module.JOB_CONFIG['store_user_scores'], 'cron', 'every night')
+    assert scheduler_module.schedule_jobs() == []
+    assert stopped_scheduler.get_job('store_user_scores').trigger is trigger
+
+    # A new policy modifies the job without a new trigger
+    monkeypatch.setitem(scheduler_module.JOB_CONFIG['store_user_scores'], 'cron', '')
+    monkeypatch.setitem(scheduler_module.JOB_CONFIG['store_user_scores'], 'misfire_grace_time', 60)
+    assert scheduler_module.schedule_jobs() == ['store_user_scores']
+    job = stopped_scheduler.get_job('store_user_scores')
+    assert (job.misfire_grace_time, job.max_instances, job.coalesce) == (60, 1, True)
+    assert job.trigger is trigger
+
+
+def test_disabling_digest_schedules_one_flush(stopped_scheduler, monkeypatch):
+    for job_id in scheduler_module.SCHEDULED_JOBS:
+        monkeypatch.setitem(scheduler_module.JOB_CONFIG[job_id], 'enabled', job_id == 'send_digest_emails')
+    scheduler_module.schedule_jobs()
+    assert stopped_scheduler.get_job('flush_digest_emails') is None
+
+    monkeypatch.setitem(scheduler_module.JOB_CONFIG['send_digest_emails'], 'enabled', False)
+    assert scheduler_module.schedule_jobs() == ['send_digest_emails']
+    assert stopped_scheduler.get_job('send_digest_emails') is None
+    assert stopped_scheduler.get_job('flush_digest_emails') is not None
@@ -0,0 +1,296 @@
+import pytest
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from event_planner.models import *
+from io import StringIO
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from event_planner import score_engine
+from event_planner.cache_versions import SCORES_VERSION_KEY, get_version
+from event_planner.score_engine import apply_score_delta, apply_score_deltas, verify_scores, score_batch
+
+
+
+User = get_user_model()
+
+
+# --- Fixtures ---
+@pytest.fixture
+def create_userprofile(db):
+    def make_userprofile(username="testuser"):
+        user = User.objects.create(username=username)
+        return UserProfile.objects.get(user=user)
+    return make_userprofile
+
+
+@pytest.fixture
+def payment_event(db):
+    return Event.objects.create(title="Score Engine Event")
+
+
+# --- Tests for delta-based score updates ---
+@pytest.mark.django_db
+def test_created_history_adds_points(create_userprofile, payment_event):
+    profile = create_userprofile("engine_create")
+    PaymentScoreHistory.objects.create(
+        event=payment_event, user_profile=profile, amount=Decimal('10.00'),
+        points_awarded=15, score_type='event')
+    PaymentScoreHistory.objects.create(
+        event=payment_event, user_profile=profile, amount=Decimal('10.00'),
+        points_awarded=5, score_type='event')
+    profile.refresh_from_db()
+    assert profile.payment_score == 20
+    assert profile.total_score == 20
+
+
+@pytest.mark.django_db
+def test_updated_history_applies_difference(create_userprofile, payment_event):
+    profile = create_userprofile("engine_update")
+    history = PaymentScoreHistory.objects.create(
+        event=payment_event, user_profile=profile, amount=Decimal('10.00'),
+        points_awarded=15, score_type='event')
+    history.points_awarded = 40
+    history.save()
+    # A reloaded record knows its original points as well
+    history = PaymentScoreHistory.objects.get(pk=history.pk)
+    history.points_awarded = 30
+    history.save()
+    profile.refresh_from_db()
+    assert profile.payment_score == 30
+    assert profile.total_score == 30
+
+
+@pytest.mark.django_db
+def test_deleted_history_removes_stored_points(create_userprofile, payment_event):
+    profile = create_userprofile("engine_delete")
+    history = PaymentScoreHistory.objects.create(
+        event=payment_event, user_profile=profile, amount=Decimal('10.00'),
+        points_awarded=15, score_type='event')
+    # Unsaved changes must not influence the removed points
+    history.points_awarded = 99
+    history.delete()
+    profile.refresh_from_db()
+    assert profile.payment_score == 0
+    assert profile.total_score == 0
+
+
+@pytest.mark.django_db
+def test_history_moved_to_other_user(create_userprofile, payment_event):
+    profile_old = create_userprofile("engine_old")
+    profile_new = create_userprofile("engine_new")
+    history = PaymentScoreHistory.objects.create(
+        event=payment_event, user_profile=profile_old, amount=Decimal('10.00'),
+        points_awarded=15, score_type='event')
+    history.user_profile = profile_new
+    history.save()
+    profile_old.refresh_from_db()
+    profile_new.refresh_from_db()
+    assert profile_old.payment_score == 0
+    assert profile_new.payment_score == 15
+
+
+@pytest.mark.django_db
+def test_delta_does_not_overwrite_concurrent_change(create_userprofile):
+    profile = create_userprofile("engine_concurrent")
+    stale_profile = UserProfile.objects.get(pk=profile.pk)
+    apply_score_delta(profile, 'role', 10)
+    apply_score_delta(stale_profile, 'role', 5)
+    profile.refresh_from_db()
+    assert profile.role_score == 15
+    assert profile.total_score == 15
+
+
+# --- Tests for verify mode ---
+@pytest.mark.django_db
+def test_verify_scores_reports_drift(create_userprofile, payment_event):
+    profile = create_userprofile("engine_verify")
+    PaymentScoreHistory.objects.create(
+        event=payment_event, user_profile=profile, amount=Decimal('10.00'),
+        points_awarded=15, score_type='event')
+    assert verify_scores(user_profiles=[profile]) == []
+    # Bypass signals to create drift
+    UserProfile.objects.filter(pk=profile.pk).update(payment_score=3)
+    assert verify_scores(user_profiles=[profile]) == [(profile.pk, 'payment', 3, 15)]
+
+
+@pytest.mark.django_db
+def test_verify_mode_logs_drift(create_userprofile, settings, caplog):
+    settings.SCORE_ENGINE_VERIFY = True
+    profile = create_userprofile("engine_verify_mode")
+    apply_score_delta(profile, 'task', 10)
+    assert "Score drift" in caplog.text
+
+
+
+# --- Tests for score batches ---
+@pytest.mark.django_db
+def test_score_batch_flushes_once_after_commit(create_userprofile, payment_event, django_capture_on_commit_callbacks):
+    profile = create_userprofile("engine_batch")
+    with django_capture_on_commit_callbacks() as callbacks:
+        with score_batch():
+            for points in (5, 10, 15):
+                PaymentScoreHistory.objects.create(
+                    event=payment_event, user_profile=profile, amount=Decimal('10.00'),
+                    points_awarded=points, score_type='event')
+            # Scores are not touched before the batch is flushed
+            profile.refresh_from_db()
+            assert profile.payment_score == 0
+    assert len(callbacks) == 1
+    callbacks[0]()
+    profile.refresh_from_db()
+    assert profile.payment_score == 30
+    assert profile.total_score == 30
+
+
+@pytest.mark.django_db
+def test_score_batch_uses_one_update(create_userprofile, payment_event, django_capture_on_commit_callbacks):
+    profiles = [create_userprofile(f"engine_batch_{i}") for i in range(3)]
+    with django_capture_on_commit_callbacks() as callbacks:
+        with score_batch():
+            for profile in profiles:
+                PaymentScoreHistory.objects.create(
+                    event=payment_event, user_profile=profile, amount=Decimal('10.00'),
+                    points_awarded=7, score_type='event')
+    with CaptureQueriesContext(connection) as queries:
+        callbacks[0]()
+    profile_updates = [query for query in queries if query['sql'].startswith('UPDATE "event_planner_userprofile"')]
+    assert len(profile_updates) == 1
+    assert verify_scores(user_profiles=profiles) == []
+
+
+
+@pytest.mark.django_db
+def test_score_deltas_are_updated_in_chunks(create_userprofile, monkeypatch):
+    monkeypatch.setattr(score_engine, "SCORE_DELTAS_CHUNK_SIZE", 2)
+    profiles = [create_userprofile(f"engine_chunk_{i}") for i in range(3)]
+    with CaptureQueriesContext(connection) as queries:
+        apply_score_deltas({profile.pk: 4 + i for i, profile in enumerate(profiles)}, 'task')
+    profile_updates = [query for query in queries if query['sql'].startswith('UPDATE "event_planner_userprofile"')]
+    assert len(profile_updates) == 2
+    assert [profile.task_score for profile in UserProfile.objects.filter(pk__in=[p.pk for p in profiles]).order_by('pk')] == [4, 5, 6]
+
+@pytest.mark.django_db
+def test_nested_score_batch_joins_outer_batch(create_userprofile, django_capture_on_commit_callbacks):
+    profile = create_userprofile("engine_nested")
+
+    @score_batch()
+    def award():
+        apply_score_delta(profile, 'task', 5)
+
+    with django_capture_on_commit_callbacks() as callbacks:
+        with score_batch():
+            award()
+            award()
+    assert len(callbacks) == 1
+
+
+@pytest.mark.django_db
+def test_score_batch_applies_deltas_like_single_awards(create_userprofile, payment_event, django_capture_on_commit_callbacks):
+    profile = create_userprofile("engine_batch_delta")
+    # Stored score differs from the history (e.g. imported scores), a batch must not reset it to the history sum
+    UserProfile.objects.filter(pk=profile.pk).update(payment_score=100, total_score=100)
+    with django_capture_on_commit_callbacks(execute=True):
+        with score_batch():
+            for points in (5, -2):
+                PaymentScoreHistory.objects.create(
+                    event=payment_event, user_profile=profile, amount=Decimal('10.00'),
+                    points_awarded=points, score_type='event')
+    profile.refresh_from_db()
+    assert (profile.payment_score, profile.total_score) == (103, 103)
+
+
+# --- Tests for the score ledger ---
+@pytest.mark.django_db
+def test_history_is_written_through_to_ledger(create_userprofile, payment_event):
+    profile = create_userprofile("engine_ledger")
+    history = PaymentScoreHistory.objects.create(
+        event=payment_event, user_profile=profile, amount=Decimal('10.00'),
+        points_awarded=15, score_type='event')
+    entry = ScoreLedger.objects.get(user_profile=profile)
+    assert entry.source == history
+    assert entry.category == 'payment'
+    assert entry.points == 15
+
+    history.points_awarded = 20
+    history.save()
+    assert ScoreLedger.objects.get(user_profile=profile).points == 20
+
+    history.delete()
+    assert not ScoreLedger.objects.filter(user_profile=profile).exists()
+
+
+@pytest.mark.django_db
+def test_new_history_inserts_ledger_entry_directly(create_userprofile, payment_event):
+    profile = create_userprofile("engine_ledger_insert")
+    with CaptureQueriesContext(connection) as queries:
+        PaymentScoreHistory.objects.create(
+            event=payment_event, user_profile=profile, amount=Decimal('10.00'),
+            points_awarded=15, score_type='event')
+    ledger_queries = [query['sql'].split()[0] for query in queries if '"event_planner_scoreledger"' in query['sql']]
+    assert ledger_queries == ['INSERT']
+
+
+# --- Tests for the rebuild_scores command ---
+@pytest.mark.django_db
+def test_rebuild_scores_repairs_drift(create_userprofile, payment_event):
+    profile = create_userprofile("engine_rebuild")
+    other = create_userprofile("engine_rebuild_other")
+    PaymentScoreHistory.objects.create(
+        event=payment_event, user_profile=profile, amount=Decimal('10.00'),
+        points_awarded=15, score_type='event')
+    # Bypass signals to create drift
+    UserProfile.objects.filter(pk__in=[profile.pk, other.pk]).update(payment_score=3, role_score=2, total_score=5)
+    ScoreLedger.objects.filter(user_profile=profile).update(points=1)
+    ScoreLedger.objects.create(source_type=ContentType.objects.get_for_model(PaymentScoreHistory), source_id=999999,
+                               user_profile=profile, category='payment', points=4)
+
+    out = StringIO()
+    call_command('rebuild_scores', '--dry-run', stdout=out)
+    assert "engine_rebuild: role_score 2 -> 0, payment_score 3 -> 15, total_score 5 -> 15" in out.getvalue()
+    profile.refresh_from_db()
+    assert profile.payment_score == 3
+
+    call_command('rebuild_scores', '--users', 'engine_rebuild', '--chunk-size', '1', stdout=StringIO())
+    profile.refresh_from_db()
+    other.refresh_from_db()
+    assert (profile.payment_score, profile.role_score, profile.total_score) == (15, 0, 15)
+    # Ledger is rebuilt from the history as well
+    assert list(ScoreLedger.objects.filter(user_profile=profile).values_list('category', 'points')) == [('payment', 15)]
+    # Users which are not selected stay unchanged
+    assert other.payment_score == 3
+
+    # The full rebuild keeps matching entries and inserts only missing ones
+    ScoreLedger.objects.filter(user_profile=profile).delete()
+    out = StringIO()
+    call_command('rebuild_scores', stdout=out)
+    assert "Score ledger: 0 stale entries were removed, 1 entries were inserted." in out.getvalue()
+    kept = ScoreLedger.objects.get(user_profile=profile).pk
+    out = StringIO()
+    call_command('rebuild_scores', stdout=out)
+    assert "Score ledger: 0 stale entries were removed, 0 entries were inserted." in out.getvalue()
+    assert ScoreLedger.objects.get(user_profile=profile).pk == kept
+
+
+# --- Tests for the scores version ---
+@pytest.mark.django_db
+def test_scores_version_is_increased_once_per_transaction(create_userprofile, django_capture_on_commit_callbacks):
+    with django_capture_on_commit_callbacks(execute=True):
+        profiles = [create_userprofile(f"engine_version_{i}") for i in range(3)]
+    version = get_version(SCORES_VERSION_KEY, fresh=True)
+    with django_capture_on_commit_callbacks(execute=True) as callbacks:
+        for profile in profiles:
+            apply_score_delta(profile, 'task', 5)
+    assert len(callbacks) == 1
+    assert get_version(SCORES_VERSION_KEY, fresh=True) == version + 1
+
+    # A rolled back change leaves no pending increase behind
+    with pytest.raises(RuntimeError):
+        with transaction.atomic():
+            apply_score_delta(profiles[0], 'task', 5)
+            raise RuntimeError
+    with django_capture_on_commit_callbacks(execute=True) as callbacks:
+        apply_score_delta(profiles[0], 'task', 5)
+    assert len(callbacks) == 1
+    assert get_version(SCORES_VERSION_KEY, fresh=True) == version + 2
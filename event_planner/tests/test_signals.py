@@ -269,6 +269,30 @@ def test_gift_winner_score_history_creation(create_userprofile, db):
         assert h.points_change == 20
 
 
+@pytest.mark.django_db
+def test_gift_winner_is_leader_by_votes(create_userprofile, db):
+    donee = create_userprofile("donee")
+    proposer1 = create_userprofile("proposer1")
+    proposer2 = create_userprofile("proposer2")
+    voter = create_userprofile("voter")
+    GiftConfiguration.objects.create(role='winner', points=20)
+    gift_search = GiftSearch.objects.create(
+        title="Gift Search Votes", purpose="Test", donee=donee,
+        deadline=timezone.now().date(), created_by=donee, final_results_sent=False)
+    GiftProposal.objects.create(
+        gift_search=gift_search, title="Proposal 1", description="Desc",
+        proposed_by=proposer1)
+    proposal2 = GiftProposal.objects.create(
+        gift_search=gift_search, title="Proposal 2", description="Desc",
+        proposed_by=proposer2)
+    proposal2.votes.up(voter.user_id)
+    # The instance was loaded before the vote, the leader is read from the database
+    gift_search.final_results_sent = True
+    gift_search.save()
+    history = GiftScoreHistory.objects.get(score_type='winner')
+    assert (history.user_profile, history.gift_proposal, history.points_change) == (proposer2, proposal2, 20)
+
+
 @pytest.mark.django_db
 def test_gift_winner_score_history_removal(create_userprofile, db):
     user = create_userprofile("winner2")
@@ -1103,3 +1127,77 @@ def test_contribution_str_alternative(create_userprofile, db):
 
 
 
+
+
+# --- Tests for the points registry ---
+@pytest.mark.django_db
+def test_points_registry_reads_without_queries(django_assert_num_queries):
+    from event_planner.points_registry import get_role_points, get_gift_points
+    RoleConfiguration.objects.create(role='attendee', points=10)
+    GiftConfiguration.objects.create(role='voter', points=5)
+    assert get_role_points('attendee') == 10
+    with django_assert_num_queries(0):
+        assert get_role_points('attendee') == 10
+        assert get_gift_points('voter') == 5
+        assert get_role_points('manager') == 0
+
+
+@pytest.mark.django_db
+def test_points_registry_invalidated_on_change():
+    from event_planner.points_registry import get_role_points, get_gift_points
+    config = RoleConfiguration.objects.create(role='organizer', points=20)
+    gift_config = GiftConfiguration.objects.create(role='winner', points=15)
+    assert get_role_points('organizer') == 20
+    assert get_gift_points('winner') == 15
+    config.points = 25
+    config.save()
+    gift_config.delete()
+    assert get_role_points('organizer') == 25
+    assert get_gift_points('winner') == 0
+
+
+@pytest.mark.django_db
+def test_points_registry_follows_changes_of_other_processes():
+    from django.core.cache import cache
+    from event_planner.cache_versions import POINTS_REGISTRY_VERSION_KEY
+    from event_planner.points_registry import get_role_points
+    RoleConfiguration.objects.create(role='helper', points=10)
+    assert get_role_points('helper') == 10
+    # Other process: points changed and version increased after its commit (no signals in this process)
+    RoleConfiguration.objects.filter(role='helper').update(points=30)
+    CacheVersion.objects.update_or_create(key=POINTS_REGISTRY_VERSION_KEY, defaults={'version': 2})
+    cache.delete(POINTS_REGISTRY_VERSION_KEY)
+    assert get_role_points('helper') == 30
+
+
+# --- Tests for tracked original values ---
+@pytest.mark.django_db
+def test_task_status_change_without_refetch(create_userprofile):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    profile = create_userprofile("tracked_task")
+    event = Event.objects.create(title="Tracked Event")
+    task = Task.objects.create(event=event, title="Tracked Task", base_points=10, status='pending')
+    task.assigned_to.add(profile)
+    task = Task.objects.get(pk=task.pk)
+    task.status = 'completed'
+    with CaptureQueriesContext(connection) as queries:
+        task.save()
+    task_selects = [q for q in queries if q['sql'].startswith('SELECT') and 'FROM "event_planner_task"' in q['sql']]
+    assert task_selects == []
+    assert task.points_awarded == 10
+
+
+@pytest.mark.django_db
+def test_transaction_old_status_from_snapshot(create_userprofile):
+    payer = create_userprofile("tracked_payer")
+    payee = create_userprofile("tracked_payee")
+    transaction = Transaction.objects.create(from_user=payer, to_user=payee, amount=Decimal('5.00'), status='billed')
+    transaction = Transaction.objects.get(pk=transaction.pk)
+    transaction.status = 'paid'
+    transaction.save()
+    assert transaction._old_status == 'billed'
+    # A record which does not exist yet has no old status
+    new_transaction = Transaction(pk=transaction.pk + 100, from_user=payer, to_user=payee, amount=Decimal('5.00'))
+    new_transaction.save()
+    assert new_transaction._old_status is None
@@ -26,6 +26,7 @@ User = get_user_model()
     ("index", {}),
     ("account_delete", {}),
     ("leaderboard", {}),
+    ("leaderboard_history", {}),
     ("event_list", {}),
     ("event_planned", {}),
     ("create_event", {}),
@@ -134,6 +135,14 @@ def create_task_with_event(db, create_user_with_scores):
         return task
     return _create_task_with_event
 
+# -------------------------------------------------------------
+# Fixture which stores uploaded files in a temporary MEDIA_ROOT (not in the media folder of the project)
+# -------------------------------------------------------------
+@pytest.fixture
+def media_root(settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path / "media")
+    return settings.MEDIA_ROOT
+
 # -------------------------------------------------------------
 # Helper function to create task_template
 # -------------------------------------------------------------
@@ -296,8 +305,10 @@ def test_index_view_authenticated(client, django_user_model):
     # Role points set correctly from RoleConfiguration
     assert context['attendee_points'] == 10
 
-    # current_points equal total_score
+    # current_points equal total_score (score history is added as delta to the initial scores)
+    user_profile.refresh_from_db()
     assert context['current_points'] == user_profile.total_score
+    assert context['current_points'] == (20 + 10) + (50 + 30 + 20 + 10) + 30
 
     # score_history contains entries and is sorted descending
     score_history = context['score_history']
@@ -509,7 +520,7 @@ def test_update_task_detail_invalid_actual_expenses(client, create_user_with_sco
 # DASHBOARD TASK DETAIL: POST request with file upload 
 # -------------------------------------------------------------
 @pytest.mark.django_db
-def test_update_task_detail_file_upload(client, create_user_with_scores, create_task_with_event):
+def test_update_task_detail_file_upload(client, create_user_with_scores, create_task_with_event, media_root):
     user = create_user_with_scores("testuser", 1, 0, 0, 0, 0, 0)
     task = create_task_with_event(user, status="pending")
     client.force_login(user)
@@ -526,12 +537,13 @@ def test_update_task_detail_file_upload(client, create_user_with_scores, create_
     updated_task = Task.objects.get(id=task.id)
     assert updated_task.attachment, "Task attachment should not be empty."
     assert updated_task.attachment.name.endswith('.txt'), f"Attachment name: {updated_task.attachment.name}"
+    assert updated_task.attachment.path.startswith(media_root)
 
 # -------------------------------------------------------------
 # DASHBOARD TASK DETAIL: POST request with both actual_expenses and file upload
 # -------------------------------------------------------------
 @pytest.mark.django_db
-def test_update_task_detail_both_expenses_and_file(client, create_user_with_scores, create_task_with_event):
+def test_update_task_detail_both_expenses_and_file(client, create_user_with_scores, create_task_with_event, media_root):
     user = create_user_with_scores("testuser", 1, 0, 0, 0, 0, 0)
     task = create_task_with_event(user, status="pending")
     client.force_login(user)
@@ -802,10 +814,7 @@ def test_leaderboard_template_and_context(client, create_user_with_scores):
         "leaderboard_roles",
         "leaderboard_tasks",
         "leaderboard_gifts",
-        "historic_total_json",
-        "historic_role_json",
-        "historic_task_json",
-        "historic_gift_json",
+        "leaderboard_payments",
     ]
     for key in context_keys:
         assert key in context
@@ -902,21 +911,19 @@ def test_historic_chart_json_structure(client, create_user_with_scores):
         score_date=date(current_year, 2, 15)
     )
     client.force_login(user)
-    url = reverse("leaderboard")
-    response = client.get(url)
+    url = reverse("leaderboard_history")
+    response = client.get(url, {"metric": "total"})
 
     # Check historic JSON for total scores
-    historic_total_json = response.context["historic_total_json"]
-    data = json.loads(historic_total_json)
+    data = response.json()
     assert "labels" in data
-    assert "datasets" in data
+    assert "series" in data
     # Expect at least one label (dates from PastUserScores)
     assert len(data["labels"]) >= 1
-    # Each dataset should have a label (username) and data array of same length as labels
-    for dataset in data["datasets"]:
-        assert "label" in dataset
-        assert "data" in dataset
-        assert len(dataset["data"]) == len(data["labels"])
+    # Each user has a series of same length as labels
+    assert data["users"] == ["chart_user"]
+    for series in data["series"]:
+        assert len(series) == len(data["labels"])
 
 # -------------------------------------------------------------
 # Leaderboard: data for roles, tasks, gifts
@@ -972,16 +979,14 @@ def test_leaderboard_no_past_scores(client, create_user_with_scores):
     # Create user with scores
     user = create_user_with_scores("nopast_user", 5, 5, 3, 3, 2, 2)
     client.force_login(user)
-    url = reverse("leaderboard")
-    response = client.get(url)
+    url = reverse("leaderboard_history")
 
     # Historic chart JSON should be built from an empty queryset
-    for key in ["historic_total_json", "historic_role_json", "historic_task_json", "historic_gift_json"]:
-        historic_json = response.context[key]
-        data = json.loads(historic_json)
+    for metric in ["total", "role", "task", "gift"]:
+        data = client.get(url, {"metric": metric}).json()
         # When no PastUserScores exist, grouping yields empty lists
         assert data["labels"] == []
-        assert data["datasets"] == []
+        assert data["series"] == []
 
 # -------------------------------------------------------------
 # Leaderboard: all active profiles have identical scores
@@ -1006,6 +1011,139 @@ def test_leaderboard_all_equal_scores(client, create_user_with_scores):
         # Rank change should be 0
         assert entry["rank_change"] == 0
 
+# -------------------------------------------------------------
+# Leaderboard: pagination keeps ranks of all active users
+# -------------------------------------------------------------
+@pytest.mark.django_db
+def test_leaderboard_pagination(client, create_user_with_scores, monkeypatch):
+    monkeypatch.setattr(views, "LEADERBOARD_PAGE_SIZE", 2)
+    user = create_user_with_scores("page_1", 9, 9, 0, 0, 0, 0)
+    create_user_with_scores("page_2", 8, 8, 0, 0, 0, 0)
+    create_user_with_scores("page_3", 8, 7, 0, 0, 0, 0)
+    create_user_with_scores("page_4", 5, 9, 0, 0, 0, 0)
+    client.force_login(user)
+
+    response = client.get(reverse("leaderboard"), {"page": 2})
+    entries = response.context["leaderboard_total"]
+    assert [entry["user"].user.username for entry in entries] == ["page_3", "page_4"]
+    # Tied users share the rank, ranks continue from the first page
+    assert [entry["current_rank"] for entry in entries] == [2, 4]
+    assert entries[1]["previous_rank"] == 1
+    assert response.context["has_previous_page"] is True
+    assert response.context["has_next_page"] is False
+
+# -------------------------------------------------------------
+# Leaderboard: ranks around the current user
+# -------------------------------------------------------------
+@pytest.mark.django_db
+def test_leaderboard_around_me(client, create_user_with_scores):
+    for i in range(1, 8):
+        create_user_with_scores(f"around_{i}", 10 * i, 0, 0, 0, 0, 0)
+    user = User.objects.get(username="around_4")
+    client.force_login(user)
+    response = client.get(reverse("leaderboard"))
+
+    entries = response.context["leaderboard_around_me"]
+    assert [entry["user"].user.username for entry in entries] == ["around_6", "around_5", "around_4", "around_3", "around_2"]
+    assert [entry["current_rank"] for entry in entries] == [2, 3, 4, 5, 6]
+
+
+# -------------------------------------------------------------
+# Leaderboard: one query per category with the current and past rank of that category only
+# -------------------------------------------------------------
+@pytest.mark.django_db
+def test_leaderboard_category_computes_two_windows(create_user_with_scores):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from event_planner.rankings import get_leaderboard
+    create_user_with_scores("window_user", 5, 2, 0, 0, 0, 0)
+    with CaptureQueriesContext(connection) as queries:
+        entries = get_leaderboard('role')
+    assert len(queries) == 1
+    assert queries[0]['sql'].count("RANK()") == 2
+    assert (entries[0]['current_rank'], entries[0]['previous_rank']) == (1, 1)
+
+
+# -------------------------------------------------------------
+# Leaderboard: snapshot served from cache until scores change
+# -------------------------------------------------------------
+@pytest.mark.django_db
+def test_leaderboard_snapshot_cache(client, create_user_with_scores):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    user = create_user_with_scores("cache_user", 5, 5, 0, 0, 0, 0)
+    other = create_user_with_scores("cache_other", 3, 3, 0, 0, 0, 0)
+    client.force_login(user)
+    client.get(reverse("leaderboard"))
+
+    # Hot leaderboard: no queries on scores (only session and user of the request)
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(reverse("leaderboard"))
+    assert not [q for q in queries if "event_planner_" in q["sql"]]
+    assert response.context["leaderboard_total"][0]["user"].user.username == "cache_user"
+
+    # Score changes bump the scores version and rebuild the snapshot
+    profile = other.userprofile
+    profile.role_score = 10
+    profile.save()
+    response = client.get(reverse("leaderboard"))
+    assert response.context["leaderboard_total"][0]["user"].user.username == "cache_other"
+
+
+# -------------------------------------------------------------
+# Leaderboard: score changes of another process (e.g. run_scheduler) reach this process through the shared version
+# -------------------------------------------------------------
+@pytest.mark.django_db
+def test_leaderboard_snapshot_follows_version_of_other_process(client, create_user_with_scores):
+    from django.core.cache import cache
+    from django.db.models import F
+    from event_planner.cache_versions import SCORES_VERSION_KEY
+    user = create_user_with_scores("process_user", 5, 5, 0, 0, 0, 0)
+    other = create_user_with_scores("process_other", 3, 3, 0, 0, 0, 0)
+    client.force_login(user)
+    client.get(reverse("leaderboard"))
+
+    # Other process: scores changed without signals in this process, version increased in the database
+    UserProfile.objects.filter(pk=other.userprofile.pk).update(role_score=10, total_score=10)
+    CacheVersion.objects.filter(key=SCORES_VERSION_KEY).update(version=F('version') + 1)
+    response = client.get(reverse("leaderboard"))
+    assert response.context["leaderboard_total"][0]["user"].user.username == "process_user"
+    # Version is read from the database again after CACHE_VERSION_TIMEOUT
+    cache.delete(SCORES_VERSION_KEY)
+    response = client.get(reverse("leaderboard"))
+    assert response.context["leaderboard_total"][0]["user"].user.username == "process_other"
+
+
+# -------------------------------------------------------------
+# Leaderboard history: weekly buckets, user filter and conditional requests
+# -------------------------------------------------------------
+@pytest.mark.django_db
+def test_leaderboard_history_downsampling(client, create_user_with_scores):
+    user = create_user_with_scores("history_user", 0, 0, 0, 0, 0, 0)
+    other = create_user_with_scores("history_other", 0, 0, 0, 0, 0, 0)
+    # Monday, Wednesday and Monday of the following week
+    for day, score in [(date(2024, 3, 4), 1), (date(2024, 3, 6), 3), (date(2024, 3, 11), 5)]:
+        PastUserScores.objects.create(user=user, score_date=day, total_score=score, role_score=score)
+        PastUserScores.objects.create(user=other, score_date=day, total_score=10 * score)
+    client.force_login(user)
+    url = reverse("leaderboard_history")
+
+    params = {"metric": "role", "from": "2024-03-01", "to": "2024-03-31", "resolution": "week", "users": "history_user"}
+    response = client.get(url, params)
+    data = response.json()
+    # Last score of each week is used
+    assert data["labels"] == ["2024-03-04", "2024-03-11"]
+    assert data["users"] == ["history_user"]
+    assert data["series"] == [[3, 5]]
+
+    # Unchanged history is answered with 304
+    response_cached = client.get(url, params, HTTP_IF_NONE_MATCH=response["ETag"])
+    assert response_cached.status_code == 304
+
+    # Invalid parameters
+    assert client.get(url, {"metric": "unknown"}).status_code == 400
+    assert client.get(url, {"from": "not-a-date"}).status_code == 400
+
 
 
 # -------------------------------------------------------------
@@ -3678,6 +3816,14 @@ def test_delete_task_template_nonexistent_returns_404(client, create_user_with_s
 # -------------------------------------------------------------
 # CALENDAR views
 # -------------------------------------------------------------
+# -------------------------------------------------------------
+# Helper function which returns the calendar feed of a range
+# -------------------------------------------------------------
+def get_calendar_feed(client, start, end):
+    response = client.get(reverse('calendar_feed'), {'start': start.isoformat(), 'end': end.isoformat()})
+    assert response.status_code == 200
+    return response.json()
+
 # -------------------------------------------------------------
 # CALENDAR: anonymous GET redirects to the login
 # -------------------------------------------------------------
@@ -3703,9 +3849,8 @@ def test_calendar_view_returns_template_and_context(client, create_user_with_sco
     assert response.status_code == 200
     templates = [t.name for t in response.templates]
     assert 'event_planner/calendar.html' in templates
-    assert 'calendar_events_json' in response.context
-    events = json.loads(response.context['calendar_events_json'])
-    assert isinstance(events, list)
+    # Entries are loaded from the feed
+    assert reverse('calendar_feed') in response.content.decode()
 
 # -------------------------------------------------------------
 # CALENDAR: birthday appears in calendar
@@ -3717,10 +3862,7 @@ def test_calendar_view_includes_birthday_event(client, create_user_with_scores):
     user.userprofile.birthday = bday
     user.userprofile.save()
     client.force_login(user)
-    url = reverse('calendar_view')
-    response = client.get(url)
-
-    events = json.loads(response.context['calendar_events_json'])
+    events = get_calendar_feed(client, date(2025, 6, 1), date(2025, 7, 1))
     birthday_events = [e for e in events if e.get('extendedProps', {}).get('type') == 'birthday']
     assert len(birthday_events) >= 1
     assert any(user.username in e['title'] for e in birthday_events)
@@ -3742,10 +3884,7 @@ def test_calendar_view_includes_event(client, create_user_with_scores):
         event_type="birthday",
         created_by=user
     )
-    url = reverse('calendar_view')
-    response = client.get(url)
-
-    events = json.loads(response.context['calendar_events_json'])
+    events = get_calendar_feed(client, date(2025, 5, 1), date(2025, 6, 1))
     event_events = [e for e in events if e.get('title') == "Calendar Test Event"]
     assert len(event_events) == 1
     assert event_events[0].get('extendedProps', {}).get('type') == 'event'
@@ -3770,10 +3909,7 @@ def test_calendar_view_includes_task_not_overdue(client, create_user_with_scores
         due_date=future_due_date
     )
     task.assigned_to.add(user.userprofile)
-    url = reverse('calendar_view')
-    response = client.get(url)
-
-    events = json.loads(response.context['calendar_events_json'])
+    events = get_calendar_feed(client, date.today(), date.today() + timedelta(days=7))
     task_events = [e for e in events if e.get('extendedProps', {}).get('type') == 'task' and "Future Task" in e.get('title', "")]
     assert len(task_events) >= 1
     for te in task_events:
@@ -3799,10 +3935,7 @@ def test_calendar_view_includes_task_overdue(client, create_user_with_scores, cr
         due_date=past_due_date
     )
     task.assigned_to.add(user.userprofile)
-    url = reverse('calendar_view')
-    response = client.get(url)
-
-    events = json.loads(response.context['calendar_events_json'])
+    events = get_calendar_feed(client, date.today() - timedelta(days=7), date.today())
     overdue_task_events = [e for e in events if e.get('extendedProps', {}).get('type') == 'task' and "Overdue Task" in e.get('title', "")]
     assert len(overdue_task_events) >= 1
     for te in overdue_task_events:
@@ -3821,10 +3954,7 @@ def test_calendar_view_includes_gift_search(client, create_user_with_scores, cre
     other = create_user_with_scores("othergift", 1, 0, 0, 0, 0, 0)
     deadline = timezone.now() + timedelta(days=5)
     gs = create_gift_search(user, "Holiday Gift", deadline, other.userprofile)
-    url = reverse('calendar_view')
-    response = client.get(url)
-
-    events = json.loads(response.context['calendar_events_json'])
+    events = get_calendar_feed(client, date.today(), date.today() + timedelta(days=7))
     gift_events = [e for e in events if e.get('extendedProps', {}).get('type') == 'gift' and "Holiday Gift" in e.get('title', "")]
     assert len(gift_events) >= 1
 
@@ -3837,10 +3967,7 @@ def test_calendar_view_excludes_gift_search_for_donee(client, create_user_with_s
     client.force_login(user)
     deadline = timezone.now() + timedelta(days=5)
     gs = create_gift_search(user, "Self Gift", deadline, user.userprofile)
-    url = reverse('calendar_view')
-    response = client.get(url)
-
-    events = json.loads(response.context['calendar_events_json'])
+    events = get_calendar_feed(client, date.today(), date.today() + timedelta(days=7))
     gift_events = [e for e in events if e.get('extendedProps', {}).get('type') == 'gift' and "Self Gift" in e.get('title', "")]
     assert len(gift_events) == 0
 
@@ -3851,11 +3978,7 @@ def test_calendar_view_excludes_gift_search_for_donee(client, create_user_with_s
 def test_calendar_view_json_structure(client, create_user_with_scores):
     user = create_user_with_scores("jsonuser", 1, 0, 0, 0, 0, 0)
     client.force_login(user)
-    url = reverse('calendar_view')
-    response = client.get(url)
-
-    json_str = response.context.get('calendar_events_json')
-    data = json.loads(json_str)
+    data = get_calendar_feed(client, date.today(), date.today() + timedelta(days=42))
     assert isinstance(data, list)
     for item in data:
         assert 'title' in item
@@ -3866,7 +3989,7 @@ def test_calendar_view_json_structure(client, create_user_with_scores):
             assert isinstance(item['extendedProps'], dict)
 
 # -------------------------------------------------------------
-# CALENDAR: calendar_events_json is empty without data
+# CALENDAR: calendar feed is empty without data
 # -------------------------------------------------------------
 @pytest.mark.django_db
 def test_calendar_view_no_events(client, create_user_with_scores):
@@ -3875,22 +3998,119 @@ def test_calendar_view_no_events(client, create_user_with_scores):
     user.userprofile.birthday = None
     user.userprofile.save()
     client.force_login(user)
-    url = reverse('calendar_view')
-    response = client.get(url)
-
-    events = json.loads(response.context['calendar_events_json'])
+    events = get_calendar_feed(client, date.today(), date.today() + timedelta(days=42))
     # Assuming this test runs in isolation, no other users exist.
     assert events == []
 
+# -------------------------------------------------------------
+# CALENDAR: feed returns only entries of the range (birthdays of every year in the range)
+# -------------------------------------------------------------
+@pytest.mark.django_db
+def test_calendar_feed_filters_range(client, create_user_with_scores):
+    user = create_user_with_scores("rangeuser", 1, 0, 0, 0, 0, 0)
+    leap = create_user_with_scores("leapuser", 1, 0, 0, 0, 0, 0)
+    user.userprofile.birthday = date(1990, 12, 31)
+    user.userprofile.save()
+    leap.userprofile.birthday = date(1992, 2, 29)
+    leap.userprofile.save()
+    for event_date in ["2025-01-05", "2025-03-05"]:
+        Event.objects.create(title=f"Event {event_date}", date=event_date, time="10:00:00", location="Hall", created_by=user)
+    client.force_login(user)
+
+    events = get_calendar_feed(client, date(2024, 12, 30), date(2025, 3, 1))
+    assert sorted((e['title'], e['start']) for e in events) == [
+        ("Event 2025-01-05", "2025-01-05"),
+        ("leapuser's Birthday", "2025-02-28"),
+        ("rangeuser's Birthday", "2024-12-31"),
+    ]
+    events = get_calendar_feed(client, date(2028, 2, 1), date(2028, 3, 1))
+    assert [(e['title'], e['start']) for e in events] == [("leapuser's Birthday", "2028-02-29")]
 
+# -------------------------------------------------------------
+# CALENDAR: feed answers unchanged entries with 304 and shows changes
+# -------------------------------------------------------------
+@pytest.mark.django_db
+def test_calendar_feed_etag(client, create_user_with_scores, django_capture_on_commit_callbacks):
+    from django.db.models import F
+    from event_planner.cache_versions import CALENDAR_VERSION_KEY
+    # Setup is committed first (one version increase per key and transaction)
+    with django_capture_on_commit_callbacks(execute=True):
+        user = create_user_with_scores("etaguser", 1, 0, 0, 0, 0, 0)
+    client.force_login(user)
+    params = {'start': "2025-05-01T00:00:00+02:00", 'end': "2025-06-01T00:00:00+02:00"}
+    response = client.get(reverse('calendar_feed'), params)
+    etag = response['ETag']
+    response = client.get(reverse('calendar_feed'), params, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+
+    with django_capture_on_commit_callbacks(execute=True):
+        Event.objects.create(title="New Event", date="2025-05-05", time="10:00:00", location="Hall", created_by=user)
+    response = client.get(reverse('calendar_feed'), params, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert [e['title'] for e in response.json()] == ["New Event"]
+
+    # Change committed by another process: no signal in this process, only the shared version is increased
+    etag = response['ETag']
+    Event.objects.filter(title="New Event").update(title="Renamed Event")
+    CacheVersion.objects.filter(key=CALENDAR_VERSION_KEY).update(version=F('version') + 1)
+    response = client.get(reverse('calendar_feed'), params, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert [e['title'] for e in response.json()] == ["Renamed Event"]
 
 # -------------------------------------------------------------
-# CALENDAR: 
+# CALENDAR: feed rejects invalid ranges
 # -------------------------------------------------------------
+@pytest.mark.django_db
+@pytest.mark.parametrize("params", [
+    {'start': "2025-05-01", 'end': "2025-04-01"},
+    {'start': "2025-01-01", 'end': "2027-01-01"},
+    {'start': "not a date", 'end': "2025-04-01"},
+])
+def test_calendar_feed_invalid_range(client, create_user_with_scores, params):
+    user = create_user_with_scores("invaliduser", 1, 0, 0, 0, 0, 0)
+    client.force_login(user)
+    response = client.get(reverse('calendar_feed'), params)
+    assert response.status_code == 400
 
 
 
+# -------------------------------------------------------------
+# GIFT SEARCH: closed_gift_list counts votes without a query per proposal
+# -------------------------------------------------------------
+@pytest.mark.django_db
+def test_closed_gift_list_queries_independent_of_proposals(client, create_user_with_scores, create_gift_search, django_assert_max_num_queries):
+    user = create_user_with_scores("viewer", 0, 0, 0, 0, 0, 0)
+    donee = create_user_with_scores("donee", 0, 0, 0, 0, 0, 0)
+    voters = [create_user_with_scores(f"voter{index}", 0, 0, 0, 0, 0, 0) for index in range(3)]
+    for index in range(3):
+        gs = create_gift_search(user, f"Search {index}", date.today() - timedelta(days=1), donee.userprofile)
+        for number in range(3):
+            proposal = GiftProposal.objects.create(gift_search=gs, title=f"Proposal {index}.{number}", description="", proposed_by=user.userprofile)
+            for voter in voters[:number]:
+                proposal.votes.up(voter.pk)
+    client.force_login(user)
+    with django_assert_max_num_queries(12):
+        response = client.get(reverse('closed_gift_list'))
+    for item in response.context['closed_searches']:
+        assert item['best_proposal'].title.endswith(".2")
+        assert item['vote_count'] == 2
+        assert item['sorted_voters'] == ["voter0", "voter1"]
+
 
 # -------------------------------------------------------------
-# CALENDAR: 
+# Tests for the job runs page
 # -------------------------------------------------------------
+@pytest.mark.django_db
+def test_job_runs_page_is_staff_only(client):
+    JobRun.objects.create(job_id='store_user_scores', status='succeeded', duration=0.5)
+    JobRun.objects.create(job_id='send_invitation_email', status='failed', duration=1.5, error="Traceback")
+    user = User.objects.create_user(username='member', password='password')
+    client.force_login(user)
+    assert client.get(reverse('job_runs')).status_code == 302
+
+    user.is_staff = True
+    user.save()
+    response = client.get(reverse('job_runs'), {'job': 'store_user_scores'})
+    assert response.status_code == 200
+    assert [row['job_id'] for row in response.context['statistics']] == ['send_invitation_email', 'store_user_scores']
+    assert [run.job_id for run in response.context['recent_runs']] == ['store_user_scores']
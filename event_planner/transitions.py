@@ -0,0 +1,56 @@
+import time
+import logging
+from dataclasses import dataclass, field
+from django.db import router, transaction
+from django.db.models import Q
+from django.db.models.signals import post_save
+
+
+
+logger = logging.getLogger(__name__)
+
+
+
+# -------------------------------------------------------------
+# Status transition of a model: rows with the source status matching the condition get the target status
+# -------------------------------------------------------------
+@dataclass(frozen=True)
+class StatusTransition:
+    model: type
+    source: str
+    target: str
+    condition: Q = field(default_factory=Q)
+    # Sends post_save for each transitioned row (for models with signal-driven side effects)
+    send_signals: bool = False
+
+
+
+# -------------------------------------------------------------
+# Applies a transition with one filtered UPDATE and returns the number of transitioned rows
+# -------------------------------------------------------------
+def run_transition(transition):
+    started = time.monotonic()
+    model = transition.model
+    candidates = model.objects.filter(transition.condition, status=transition.source)
+
+    with transaction.atomic():
+        if transition.send_signals:
+            # Side effects run only for the rows which were actually transitioned
+            pks = list(candidates.values_list('pk', flat=True))
+            count = model.objects.filter(pk__in=pks, status=transition.source).update(status=transition.target)
+            using = router.db_for_write(model)
+            for instance in model.objects.filter(pk__in=pks, status=transition.target):
+                post_save.send(sender=model, instance=instance, created=False, update_fields={'status'}, raw=False, using=using)
+        else:
+            count = candidates.update(status=transition.target)
+
+    logger.info("%s: %s -> %s for %s rows in %.3fs", model.__name__, transition.source, transition.target, count, time.monotonic() - started)
+    return count
+
+
+
+# -------------------------------------------------------------
+# Applies transitions in the given order and returns the number of transitioned rows per (source, target)
+# -------------------------------------------------------------
+def run_transitions(transitions):
+    return {(transition.source, transition.target): run_transition(transition) for transition in transitions}
@@ -15,9 +15,11 @@ urlpatterns = [
     
     # Display leaderboard
     path('leaderboard/', views.leaderboard, name='leaderboard'),    # UNITTEST
+    path('leaderboard/history/', views.leaderboard_history, name='leaderboard_history'),    # UNITTEST
 
     # Display calendar
     path('calendar/', views.calendar_view, name='calendar_view'),        # UNITTEST
+    path('calendar/feed/', views.calendar_feed, name='calendar_feed'),    # UNITTEST
 
     # List upcoming events
     path('events/', EventListView.as_view(), name='event_list'),    # UNITTEST
@@ -132,6 +134,7 @@ urlpatterns = [
 
     # Manage job settings
     path('job-settings/', views.job_settings, name='job_settings'),
+    path('job-runs/', views.job_runs, name='job_runs'),    # UNITTEST
 
     # Manage general settings
     path('general-settings/', views.general_settings, name='general_settings'),
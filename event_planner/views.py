@@ -1,5 +1,6 @@
 import json
-from datetime import datetime, date
+import hashlib
+from datetime import datetime, date, timedelta
 from collections import defaultdict
 from decimal import Decimal
 from django.utils import timezone
@@ -10,18 +11,25 @@ from django.contrib import messages
 from django.contrib.auth import logout, get_user_model
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.decorators import user_passes_test, login_required
-from django.views.decorators.http import require_http_methods
-from django.contrib.contenttypes.models import ContentType
+from django.views.decorators.http import require_http_methods, condition
 from django.core.serializers.json import DjangoJSONEncoder
+from django.core.paginator import Paginator
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
 from django.forms import NumberInput
 from django.db.models import Q
 from django import forms
 from django.urls import reverse
 from django.http import HttpResponseNotAllowed, HttpResponseForbidden, HttpResponseBadRequest, HttpResponse, JsonResponse
-from event_planner.scheduler import schedule_jobs
-from event_planner.job_config import JOB_CONFIG, save_job_config
+from event_planner.scheduler import reschedule_jobs
+from event_planner.job_config import JOB_CONFIG, save_job_config, refresh_job_config
 from event_planner.jobs import send_billing_email
-from vote.models import Vote
+from event_planner.points_registry import get_role_points
+from event_planner.rankings import get_leaderboard, get_leaderboard_around, get_leaderboard_snapshot
+from event_planner.score_engine import get_scores_version, get_scores_modified
+from event_planner.calendar_feed import build_feed, parse_feed_range
+from event_planner.cache_versions import CALENDAR_VERSION_KEY, get_version
+from event_planner.job_runs import job_run_statistics, get_run_retention
 from .models import *
 from .forms import UserUpdateForm, UserProfileUpdateForm, EventForm, AddRoleForm, TaskForm, TaskEditForm, TaskTemplateForm,\
       RoleConfigurationForm, DeleteEventForm, GiftContributionForm, ContributionForm, GiftSearchForm, GiftProposalForm
@@ -35,6 +43,41 @@ User = get_user_model()
 
 
 
+# -------------------------------------------------------------
+# Number of score history entries per page on the dashboard
+# -------------------------------------------------------------
+SCORE_HISTORY_PAGE_SIZE = 50
+
+
+
+# -------------------------------------------------------------
+# Number of users per page on the leaderboards
+# -------------------------------------------------------------
+LEADERBOARD_PAGE_SIZE = 100
+
+
+
+# -------------------------------------------------------------
+# Number of recent job runs on the job runs page
+# -------------------------------------------------------------
+JOB_RUNS_PAGE_SIZE = 100
+
+
+
+# -------------------------------------------------------------
+# Metrics (score fields of PastUserScores) and resolutions of the leaderboard history
+# -------------------------------------------------------------
+HISTORY_METRICS = {
+    'total': 'total_score',
+    'role': 'role_score',
+    'task': 'task_score',
+    'gift': 'gift_score',
+    'payment': 'payment_score',
+}
+HISTORY_RESOLUTIONS = ('day', 'week', 'month')
+
+
+
 # -------------------------------------------------------------
 # Model which associates tasks with an event and users. It can optionally be based on a task template (through TaskTemplate model)
 # -------------------------------------------------------------
@@ -49,8 +92,7 @@ def index(request):
         # Filter upcoming events
         upcoming_events = Event.objects.filter(date__gt=timezone.now())#
         # Get points awarded for the attendee role (assumed role name "attendee")
-        attendee_role = RoleConfiguration.objects.filter(role='attendee').first()
-        attendee_points = attendee_role.points if attendee_role else 0
+        attendee_points = get_role_points('attendee')
 
         user_profile = request.user.userprofile
         # Annotate each event with an is_attending attribute
@@ -58,14 +100,10 @@ def index(request):
             event.is_attending = event.eventparticipant_set.filter(user_profile=user_profile, role='attendee').exists()
         
         # Score section
-        # Fetch RoleScoreHistory, TaskScoreHistory, GiftScoreHistory, PaymentScoreHistory entries for the user
-        role_scores = list(RoleScoreHistory.objects.filter(user_profile=user_profile))
-        task_scores = list(TaskScoreHistory.objects.filter(user_profile=user_profile))
-        gift_scores = list(GiftScoreHistory.objects.filter(user_profile=user_profile))
-        payment_scores = list(PaymentScoreHistory.objects.filter(user_profile=user_profile))
-        
-        # Merge and sort by timestamp (most recent first)
-        score_history = sorted(role_scores + task_scores + gift_scores + payment_scores, key=lambda entry: entry.timestamp, reverse=True)
+        # Fetch one page of the score ledger of the user (most recent first), the history records are prefetched per score category
+        score_ledger = ScoreLedger.objects.filter(user_profile=user_profile).order_by('-timestamp', '-pk').prefetch_related('source')
+        score_page = Paginator(score_ledger, SCORE_HISTORY_PAGE_SIZE).get_page(request.GET.get('score_page'))
+        score_history = [entry.source for entry in score_page]
         current_points = request.user.userprofile.total_score
 
         # Payment section
@@ -79,6 +117,7 @@ def index(request):
             'attendee_points': attendee_points,
             'current_points': current_points,
             'score_history': score_history,
+            'score_page': score_page,
             "transactions": transactions,
             "total_sum": total_sum,
         }
@@ -89,266 +128,146 @@ def index(request):
 
 
 # -------------------------------------------------------------
-# Function-based view which displays a ranked list of users' scores and historic
+# Helper function which builds the leaderboards of a page (cached as snapshot per scores version)
 # -------------------------------------------------------------
-@login_required
-def leaderboard(request):
-    # Get active profiles (exclude inactive users)
-    active_profiles = list(UserProfile.objects.filter(is_inactive=False))
-
-    # Helper function to determine arrow direction based on current vs. past values
-    def get_arrow(current, past):
-        if current > past:
-            return "up"
-        elif current < past:
-            return "down"
-        else:
-            return "right"
-
-    # Annotate each profile with arrow fields
-    for profile in active_profiles:
-        profile.total_arrow = get_arrow(profile.total_score, profile.total_score_past)
-        profile.role_arrow = get_arrow(profile.role_score, profile.role_score_past)
-        profile.task_arrow = get_arrow(profile.task_score, profile.task_score_past)
-        profile.gift_arrow = get_arrow(profile.gift_score, profile.gift_score_past)
-        profile.payment_arrow = get_arrow(profile.payment_score, profile.payment_score_past)
-
-    # Helper function builds tied ranking for sorted list of profiles
-    # Returns a dictionary mapping profile.id -> rank
-    def build_tied_ranking(sorted_profiles, score_field):
-        ranking = {}
-        current_rank = 0
-        prev_score = None
-        for i, profile in enumerate(sorted_profiles):
-            score = getattr(profile, score_field)
-            if prev_score is None or score < prev_score:
-                current_rank = i + 1
-                prev_score = score
-            ranking[profile.id] = current_rank
-        return ranking
-
-    # Build tied rankings for past scores for each category
-    sorted_past_total = sorted(active_profiles, key=lambda p: p.total_score_past, reverse=True)
-    past_total_ranks = build_tied_ranking(sorted_past_total, 'total_score_past')
-
-    sorted_past_roles = sorted(active_profiles, key=lambda p: p.role_score_past, reverse=True)
-    past_roles_ranks = build_tied_ranking(sorted_past_roles, 'role_score_past')
-
-    sorted_past_tasks = sorted(active_profiles, key=lambda p: p.task_score_past, reverse=True)
-    past_tasks_ranks = build_tied_ranking(sorted_past_tasks, 'task_score_past')
-
-    sorted_past_gifts = sorted(active_profiles, key=lambda p: p.gift_score_past, reverse=True)
-    past_gifts_ranks = build_tied_ranking(sorted_past_gifts, 'gift_score_past')
-
-    sorted_past_payments = sorted(active_profiles, key=lambda p: p.payment_score_past, reverse=True)
-    past_payments_ranks = build_tied_ranking(sorted_past_payments, 'payment_score_past')
-
-    # Helper function to build a leaderboard for a given score field
-    # score_field: current score field name (e.g., 'role_score')
-    # past_field: corresponding past score field name (e.g., 'role_score_past')
-    # arrow_field: name of the arrow attribute to use (e.g., 'role_arrow')
-    # past_ranks: tied ranking mapping from profile.id to past rank
-    def build_leaderboard(score_field, past_field, arrow_field, past_ranks):
-        # Sort profiles by the current score (descending)
-        sorted_current = sorted(active_profiles, key=lambda p: getattr(p, score_field), reverse=True)
-        leaderboard = []
-        current_rank = 0
-        prev_score = None
-
-        # Build dictionary with leaderboard data
-        for i, profile in enumerate(sorted_current):
-            score = getattr(profile, score_field)
-            if prev_score is None or score < prev_score:
-                current_rank = i + 1
-                prev_score = score
-            previous_rank = past_ranks.get(profile.id, current_rank)
-            rank_change = previous_rank - current_rank  # positive means improvement
-            leaderboard.append({
-                'user': profile,
-                'current_rank': current_rank,
-                'previous_rank': previous_rank,
-                'rank_change': rank_change,
-                'arrow': getattr(profile, arrow_field)
-            })
-        return leaderboard
-
-    # Create leaderbord data per leaderboard type
-    leaderboard_total = build_leaderboard('total_score', 'total_score_past', 'total_arrow', past_total_ranks)
-    leaderboard_roles = build_leaderboard('role_score', 'role_score_past', 'role_arrow', past_roles_ranks)
-    leaderboard_tasks = build_leaderboard('task_score', 'task_score_past', 'task_arrow', past_tasks_ranks)
-    leaderboard_gifts = build_leaderboard('gift_score', 'gift_score_past', 'gift_arrow', past_gifts_ranks)
-    leaderboard_payments = build_leaderboard('payment_score', 'payment_score_past', 'payment_arrow', past_payments_ranks)
-
-    # Prepare historic date for current year
-    current_year = date.today().year
-    past_scores = PastUserScores.objects.filter(score_date__year=current_year)
-
-    # Helper function to create dictionary for chart
-    def build_chart_data(score_field):
-        # Group past scores by user
-        data_by_user = defaultdict(list)
-        all_dates = set()
-        for ps in past_scores:
-            data_by_user[ps.user.username].append((ps.score_date, getattr(ps, score_field)))
-            all_dates.add(ps.score_date)
-        # Sort dates and format as strings "YYYY-MM-DD"
-        labels = sorted(all_dates)
-        labels = [d.strftime("%Y-%m-%d") for d in labels]
-        
-        datasets = []
-        # Generate unique color for each dataset using HSL
-        total_users = len(data_by_user)
-        for i, (username, values) in enumerate(sorted(data_by_user.items())):
-            # Calculate hue evenly spaced over 360 degrees
-            hue = int((i * 360 / total_users) % 360)
-            color = f"hsl({hue}, 70%, 50%)"
-            # Build dictionary mapping date to score
-            score_dict = {d: score for d, score in values}
-            data_array = []
-            for label in labels:
-                d = date.fromisoformat(label)
-                data_array.append(score_dict.get(d, None))
-
-            datasets.append({
-                "label": username,
-                "data": data_array,
-                "fill": False,
-                "borderColor": color,
-                "backgroundColor": color,
-                "tension": 0.1,
-            })
-        return {"labels": labels, "datasets": datasets}
-
-    # Create chart with historic data per score type
-    historic_total_json = json.dumps(build_chart_data("total_score"))
-    historic_role_json = json.dumps(build_chart_data("role_score"))
-    historic_task_json = json.dumps(build_chart_data("task_score"))
-    historic_gift_json = json.dumps(build_chart_data("gift_score"))
-    historic_payment_json = json.dumps(build_chart_data("payment_score"))
+def build_leaderboard_context(page):
+    offset = (page - 1) * LEADERBOARD_PAGE_SIZE
 
-    context = {
+    # Create leaderbord data per leaderboard type (one query per leaderboard page)
+    leaderboard_total = get_leaderboard('total', offset, LEADERBOARD_PAGE_SIZE)
+    leaderboard_roles = get_leaderboard('role', offset, LEADERBOARD_PAGE_SIZE)
+    leaderboard_tasks = get_leaderboard('task', offset, LEADERBOARD_PAGE_SIZE)
+    leaderboard_gifts = get_leaderboard('gift', offset, LEADERBOARD_PAGE_SIZE)
+    leaderboard_payments = get_leaderboard('payment', offset, LEADERBOARD_PAGE_SIZE)
+    has_next_page = UserProfile.objects.filter(is_inactive=False).count() > offset + LEADERBOARD_PAGE_SIZE
+
+    return {
         'leaderboard_total': leaderboard_total,
         'leaderboard_roles': leaderboard_roles,
         'leaderboard_tasks': leaderboard_tasks,
         'leaderboard_gifts': leaderboard_gifts,
         'leaderboard_payments': leaderboard_payments,
-        'historic_total_json': historic_total_json,
-        'historic_role_json': historic_role_json,
-        'historic_task_json': historic_task_json,
-        'historic_gift_json': historic_gift_json,
-        'historic_payment_json': historic_payment_json,
+        'page': page,
+        'has_previous_page': page > 1,
+        'has_next_page': has_next_page,
     }
 
+
+
+# -------------------------------------------------------------
+# Function-based view which displays a ranked list of users' scores and historic
+# -------------------------------------------------------------
+@login_required
+def leaderboard(request):
+    # Page of the leaderboards (ranks are calculated over all active users in the database)
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+
+    # Leaderboards are served from the cache until scores change
+    context = dict(get_leaderboard_snapshot(f'page:{page}:{LEADERBOARD_PAGE_SIZE}', lambda: build_leaderboard_context(page)))
+    # Users ranked directly above and below the current user in the total leaderboard
+    context['leaderboard_around_me'] = get_leaderboard_snapshot(
+        f'around:{request.user.pk}', lambda: get_leaderboard_around(request.user.userprofile, 'total')
+    )
+
     return render(request, 'event_planner/leaderboard.html', context)
 
 
 
+# -------------------------------------------------------------
+# Helper functions which return ETag and Last-Modified of the leaderboard history (changes with the scores version)
+# -------------------------------------------------------------
+def leaderboard_history_etag(request):
+    query = hashlib.md5(request.GET.urlencode().encode()).hexdigest()
+    return f"{get_scores_version()}-{query}"
+
+
+def leaderboard_history_last_modified(request):
+    return get_scores_modified()
+
+
+
+# -------------------------------------------------------------
+# Function-based view which returns the historic scores of users as compact JSON (lazy loaded by the leaderboard charts)
+# -------------------------------------------------------------
+@login_required
+@require_http_methods(["GET"])
+@condition(etag_func=leaderboard_history_etag, last_modified_func=leaderboard_history_last_modified)
+def leaderboard_history(request):
+    # Validate parameters (default: total score of all users in the current year per day)
+    metric = request.GET.get('metric', 'total')
+    resolution = request.GET.get('resolution', 'day')
+    if metric not in HISTORY_METRICS or resolution not in HISTORY_RESOLUTIONS:
+        return HttpResponseBadRequest("Invalid metric or resolution.")
+    today = date.today()
+    try:
+        date_from = date.fromisoformat(request.GET['from']) if request.GET.get('from') else date(today.year, 1, 1)
+        date_to = date.fromisoformat(request.GET['to']) if request.GET.get('to') else today
+    except ValueError:
+        return HttpResponseBadRequest("Invalid date.")
+
+    # One query for the whole series (username is joined, no query per row)
+    past_scores = PastUserScores.objects.filter(score_date__range=(date_from, date_to))
+    if request.GET.get('users'):
+        past_scores = past_scores.filter(user__username__in=request.GET['users'].split(','))
+    rows = past_scores.order_by('score_date').values_list('user__username', 'score_date', HISTORY_METRICS[metric])
+
+    # Last score of each user per bucket (day, week starting on Monday, month)
+    buckets = {}
+    scores_by_user = defaultdict(dict)
+    for username, score_date, score in rows:
+        if resolution == 'week':
+            score_date = score_date - timedelta(days=score_date.weekday())
+        elif resolution == 'month':
+            score_date = score_date.replace(day=1)
+        buckets[score_date] = None
+        scores_by_user[username][score_date] = score
+
+    # Columnar output: one labels array and one array of scores per user (null if no score in bucket)
+    labels = sorted(buckets)
+    users = sorted(scores_by_user)
+    return JsonResponse({
+        'metric': metric,
+        'resolution': resolution,
+        'labels': [label.isoformat() for label in labels],
+        'users': users,
+        'series': [[scores_by_user[username].get(label) for label in labels] for username in users],
+    })
+
+
+
 # -------------------------------------------------------------
 # Function-based view which displays a calendar with all dates (birthday, event, task, gift search)
 # -------------------------------------------------------------
 @login_required
 def calendar_view(request):
-    calendar_events = []
-    now = timezone.now()
-    current_year = now.year
-    today = now.date()
-
-    # Birthdays: Show each user's birthday (year-adjusted)
-    birthdays = UserProfile.objects.exclude(birthday__isnull=True)
-    for profile in birthdays:
-        bday = profile.birthday
-        try:
-            birthday_this_year = bday.replace(year=current_year)
-        except ValueError:
-            # Handle Feb 29 on non-leap years
-            birthday_this_year = bday.replace(year=current_year, day=bday.day-1)
-        calendar_events.append({
-            'title': f"{profile.user.username}'s Birthday",
-            'start': birthday_this_year.strftime("%Y-%m-%d"),
-            'color': 'DarkCyan',       
-            'textColor': 'White', 
-            'extendedProps': {
-                'icon': 'bi bi-person-bounding-box',  
-                'type': 'birthday'
-            }
-        })
+    # Entries are loaded by the calendar for the visible range only (see calendar_feed)
+    return render(request, 'event_planner/calendar.html')
 
-    # Events: Only events with date, time, and location set
-    events = Event.objects.filter(date__isnull=False, time__isnull=False, location__isnull=False)
-    for event in events:
-        calendar_events.append({
-            'title': f"{event.title}",
-            'start': event.date.isoformat(),
-            'color': 'ForestGreen', 
-            'textColor': 'White',
-            'extendedProps': {
-                'icon': 'bi bi-balloon',
-                'type': 'event'
-            }
-        })
 
-    # Tasks: Only tasks for the logged-in user
-    tasks = Task.objects.filter(assigned_to=request.user.userprofile)
-    for task in tasks:
-        due_date_str = task.due_date.strftime("%Y-%m-%d") if hasattr(task.due_date, 'strftime') else str(task.due_date)
-        overdue = False
-        task_date = task.due_date.date() if hasattr(task.due_date, 'date') else task.due_date
-        if task_date < today and task.status != 'completed':
-            overdue = True
-        icon = 'bi bi-briefcase'
-        if overdue:
-            icon = 'bi bi-exclamation-triangle'
-        calendar_events.append({
-            'title': f"Task: {task.title}" + (" (Overdue)" if overdue else ""),
-            'start': due_date_str,
-            'color': 'RoyalBlue', 
-            'textColor': 'White',
-            'extendedProps': {
-                'icon': icon,
-                'type': 'task',
-                'status': task.status
-            }
-        })
-        if overdue:
-            calendar_events.append({
-                'start': due_date_str,
-                'color': 'Red',
-                'textColor': 'White',
-                'title': 'overdue'
-            })
-
-    # Gift Searches: Exclude searches where the logged-in user is donee
-    gift_searches = GiftSearch.objects.filter(deadline__isnull=False).exclude(donee=request.user.userprofile)
-    for gs in gift_searches:
-        calendar_events.append({
-            'title': f"Gift Search: {gs.title}",
-            'start': gs.deadline.isoformat(),
-            'color': 'DarkMagenta',
-            'textColor': 'White',
-            'extendedProps': {
-                'icon': 'bi bi-gift',
-                'type': 'gift'
-            }
-        })
 
-    # Gift Contributions: Exclude contributions where the logged-in user is donee
-    gift_contributions = GiftContribution.objects.filter(deadline__isnull=False).exclude(donee=request.user.userprofile)
-    for gc in gift_contributions:
-        calendar_events.append({
-            'title': f"Gift Contribution: {gc.title}",
-            'start': gc.deadline.isoformat(),
-            'color': 'BlueViolet',
-            'textColor': 'White',
-            'extendedProps': {
-                'icon': 'bi bi-cash-coin',
-                'type': 'gift'
-            }
-        })
+# -------------------------------------------------------------
+# Function-based view which returns the calendar entries of a range as FullCalendar event source (?start=&end=)
+# -------------------------------------------------------------
+@login_required
+@require_http_methods(["GET"])
+def calendar_feed(request):
+    try:
+        start, end = parse_feed_range(request.GET.get('start'), request.GET.get('end'))
+    except ValueError as error:
+        return HttpResponseBadRequest(str(error))
 
-    context = {
-        'calendar_events_json': json.dumps(calendar_events)
-    }
-    return render(request, 'event_planner/calendar.html', context)
+    # Version is read from the database, a change committed by any process is never answered with 304
+    version = get_version(CALENDAR_VERSION_KEY, fresh=True)
+    body = json.dumps(build_feed(request.user.userprofile, start, end, version))
+    # Unchanged entries are answered with 304 (the browser revalidates on every range change)
+    etag = quote_etag(f'{version}-{hashlib.md5(body.encode()).hexdigest()}')
+    response = get_conditional_response(request, etag=etag) or HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
 
 
@@ -1348,33 +1267,21 @@ def closed_gift_list(request):
     today = timezone.now().date()
     # Filter searches with deadline >= today and exclude those for which current user is donee
     closed_searches = GiftSearch.objects.filter(deadline__lte=today).exclude(donee=request.user.userprofile).order_by('-deadline')
-    
+    # Best proposals are maintained by the vote signals and loaded with the searches
+    closed_searches = closed_searches.select_related('leading_proposal__proposed_by__user', 'leading_proposal__gift_search__donee__user')
+
+    # Voters of the best proposals sorted by username
+    attach_voters(search.leading_proposal for search in closed_searches if search.leading_proposal)
+
     # Prepare data for each search
     search_data = []
     for search in closed_searches:
-        proposals = search.proposals.all()
-        best_proposal = None
-        best_vote_count = -1
-        # FInd best voted proposal
-        for proposal in proposals:
-            vote_count = proposal.votes.count()
-            if vote_count > best_vote_count:
-                best_vote_count = vote_count
-                best_proposal = proposal
-        
-        # Get voters for this proposal
-        sorted_voters = []
-        if best_proposal:
-            ct = ContentType.objects.get_for_model(best_proposal)
-            votes = Vote.objects.filter(content_type=ct, object_id=best_proposal.id)
-            sorted_voters = sorted(votes, key=lambda v: User.objects.get(id=v.user_id).username)
-            #sorted_voters = sorted(votes, key=lambda v: User.objects.get(id=v.user_id).username)
-                    
+        best_proposal = search.leading_proposal
         search_data.append({
             'search': search,
             'best_proposal': best_proposal,
-            'vote_count': best_vote_count,
-            'sorted_voters': sorted_voters,
+            'vote_count': search.leading_vote_count if best_proposal else -1,
+            'sorted_voters': best_proposal.voters if best_proposal else [],
         })
     context = {'closed_searches': search_data}
 
@@ -1392,8 +1299,7 @@ def gift_search_detail(request, search_id):
         return HttpResponseForbidden("You are not allowed to view this page.")
     
     # Get all proposals and sort by vote count (descending)
-    proposals = list(gift_search.proposals.all())
-    proposals.sort(key=lambda p: p.votes.count(), reverse=True)
+    proposals = list(gift_search.proposals.ranked())
     
     if request.method == 'POST':
         form = GiftProposalForm(request.POST, request.FILES)
@@ -1490,7 +1396,8 @@ def gift_contribution_list(request):
 def closed_contribution_list(request):
     today = timezone.now().date()
     # Exclude contributions where user is donee, only closed lists
-    closed_contributions = GiftContribution.objects.filter(status__in=['closed', 'canceled']).exclude(donee=request.user.userprofile)
+    closed_contributions = (GiftContribution.objects.filter(status__in=['closed', 'canceled'])
+                            .exclude(donee=request.user.userprofile).select_related('gift_search__leading_proposal__proposed_by__user'))
     for contribution in closed_contributions:
         # Calculate progress percentage
         if contribution.collection_target:
@@ -1501,18 +1408,10 @@ def closed_contribution_list(request):
         if contribution.gift_search:
             if contribution.gift_search.deadline <= today:
                 search = contribution.gift_search
-                proposals = search.proposals.all()
-                best_proposal = None
-                best_vote_count = -1
-                # Find best voted proposal
-                for proposal in proposals:
-                    vote_count = proposal.votes.count()
-                    if vote_count > best_vote_count:
-                        best_vote_count = vote_count
-                        best_proposal = proposal
+                best_proposal = search.leading_proposal
 
                 search.best_proposal=best_proposal
-                search.vote_count=best_vote_count
+                search.vote_count=search.leading_vote_count if best_proposal else -1
 
     return render(request, 'event_planner/closed_contribution_list.html', {
         'closed_contributions': closed_contributions,
@@ -1752,6 +1651,8 @@ def role_configuration(request):
 @login_required
 @require_http_methods(["GET", "POST"])
 def job_settings(request):
+    # Changes are based on the latest saved settings (another process may have saved them)
+    refresh_job_config(force=True)
     if request.method == "POST":
         # Update JOB_CONFIG values from form submission
         # Overdue tasks settings
@@ -1819,10 +1720,17 @@ def job_settings(request):
         JOB_CONFIG['store_user_scores']['enabled'] = request.POST.get('store_scores_enabled') == 'on'
         JOB_CONFIG['store_user_scores']['interval'] = int(request.POST.get('store_scores_interval', JOB_CONFIG['store_user_scores']['interval']))
 
+        # Digest email settings
+        JOB_CONFIG['send_digest_emails']['enabled'] = request.POST.get('send_digest_enabled') == 'on'
+        JOB_CONFIG['send_digest_emails']['interval'] = int(request.POST.get('send_digest_interval', JOB_CONFIG['send_digest_emails']['interval']))
+        digest_window = request.POST.get('send_digest_window', JOB_CONFIG['send_digest_emails']['window'])
+        if digest_window in ('hourly', 'daily'):
+            JOB_CONFIG['send_digest_emails']['window'] = digest_window
+
         # Persist changes to JSON file
         save_job_config(JOB_CONFIG)
-        # Reschedule jobs
-        schedule_jobs()
+        # Reschedule jobs (if the scheduler runs in this process)
+        reschedule_jobs()
         # return redirect(request.META.get('HTTP_REFERER', '/'))
         return render(request, "event_planner/job_settings_success.html")
     else:
@@ -1830,6 +1738,26 @@ def job_settings(request):
     
 
 
+# -------------------------------------------------------------
+# Function-based view which displays the run history and performance metrics of the scheduled jobs
+# -------------------------------------------------------------
+@user_passes_test(lambda u: u.is_staff)
+@login_required
+@require_http_methods(["GET"])
+def job_runs(request):
+    recent_runs = JobRun.objects.order_by('-started_at')
+    job_id = request.GET.get('job')
+    if job_id:
+        recent_runs = recent_runs.filter(job_id=job_id)
+    return render(request, "event_planner/job_runs.html", {
+        "statistics": job_run_statistics(),
+        "recent_runs": recent_runs[:JOB_RUNS_PAGE_SIZE],
+        "job_id": job_id,
+        "retention": get_run_retention(),
+    })
+
+
+
 # -------------------------------------------------------------
 # Function-based view which allows to set general parameters for jobs
 # -------------------------------------------------------------
@@ -1837,6 +1765,8 @@ def job_settings(request):
 @login_required
 @require_http_methods(["GET", "POST"])
 def general_settings(request):
+    # Changes are based on the latest saved settings (another process may have saved them)
+    refresh_job_config(force=True)
     # Get configuration dictionaries
     config_score_interval = JOB_CONFIG.get('store_user_scores', {})
     config_general = JOB_CONFIG.get('general', {})